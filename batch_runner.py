@@ -0,0 +1,136 @@
+"""无人值守的批量运行
+
+从 JSONL 或 YAML 任务文件读取多个项目，以有界并发分别运行概念与小说工作流，
+输出每个任务的状态与耗时。每个任务是一个对象：
+
+    {"id": "雾港", "concept": {"title": "雾港来信", "genre": "悬疑"}, "outline": "第一章 ...\\n第二章 ..."}
+    {"id": "星海", "answers": {"请选择（1-2）": "2"}, "outline": "第一章 ..."}
+
+- id：项目 ID（检查点按它保存，重复运行时从上次中断处继续），缺省为行号，不能重复
+- concept：直接使用的小说概念，提供时跳过概念工作流
+- answers：概念工作流中交互提示的脚本化回答（按提示词关键字匹配的对象），
+  未覆盖的提示词仍按自动选择 AI 生成并确认回答
+- outline：小说大纲
+- working_dir：项目保存目录，缺省为 NOVEL_WORKING_DIR
+
+    python batch_runner.py jobs.jsonl --concurrency 4 --report report.jsonl
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import input_provider
+
+def load_jobs(path: str) -> List[Dict]:
+    """读取任务文件：.yaml/.yml 为任务列表（或含 jobs 键的对象），其余按 JSONL 逐行读取"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError as e:
+                raise RuntimeError("读取 YAML 任务文件需要先安装 PyYAML") from e
+            data = yaml.safe_load(f) or []
+            jobs = data.get("jobs", []) if isinstance(data, dict) else data
+        else:
+            jobs = [json.loads(line) for line in f if line.strip()]
+    seen = set()
+    for i, job in enumerate(jobs, 1):
+        if not isinstance(job, dict):
+            raise ValueError(f"第 {i} 个任务不是对象：{job!r}")
+        if not isinstance(job.get("answers") or {}, dict):
+            raise ValueError(f"第 {i} 个任务的 answers 必须是对象（提示词关键字 -> 回答）")
+        job.setdefault("id", f"job-{i}")
+        if job["id"] in seen:
+            raise ValueError(f"第 {i} 个任务的 id 与之前的任务重复：{job['id']}")
+        seen.add(job["id"])
+    return jobs
+
+def run_job(job: Dict, resume: bool = True, checkpointer=None) -> Dict:
+    """运行单个任务，返回状态、耗时与保存路径；异常只记入该任务的结果"""
+    import novel_agent
+
+    provider = input_provider.AutoConfirmInput(overrides=job.get("answers"))
+    result = {"id": job["id"], "status": "ok", "seconds": 0.0}
+    started = time.perf_counter()
+    try:
+        concept = novel_agent.NovelConcept(**job["concept"]) if job.get("concept") else None
+        with input_provider.using(provider):
+            state = novel_agent.run_workflows(job["id"], resume=resume, concept=concept,
+                                              outline=job.get("outline", ""),
+                                              working_dir=job.get("working_dir", ""),
+                                              checkpointer=checkpointer)
+        if state is None:
+            result["status"] = "unconfirmed"
+        else:
+            result["save_path"] = state.get("save_path", "")
+            result["chapters"] = len(state.get("chapters") or [])
+            if state.get("failed_chapters"):
+                result["status"] = "partial"
+                result["failed_chapters"] = state["failed_chapters"]
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+def run_batch(jobs: List[Dict], concurrency: int = 4, resume: bool = True, on_result=None) -> List[Dict]:
+    """以有界并发运行全部任务，按完成顺序把结果交给 on_result，返回按任务顺序排列的结果
+
+    全部任务共用一个检查点存储，运行结束后关闭。
+    """
+    import novel_agent
+
+    results: Dict[str, Dict] = {}
+    checkpointer = novel_agent.open_checkpointer()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = {pool.submit(run_job, job, resume, checkpointer): job["id"] for job in jobs}
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                if on_result:
+                    on_result(result)
+    finally:
+        checkpointer.conn.close()
+    return [results[job["id"]] for job in jobs]
+
+def _print_result(result: Dict) -> None:
+    detail = result.get("error") or result.get("save_path", "")
+    print(f"[{result['status']:<11}] {result['id']:<24} {result['seconds']:8.2f} 秒  {detail}", file=sys.stderr)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="NovAgent 批量运行")
+    parser.add_argument("jobs", help="任务文件（JSONL 或 YAML）")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("NOVEL_BATCH_CONCURRENCY", "4")),
+                        help="同时运行的项目数")
+    parser.add_argument("--report", help="把每个任务的结果以 JSONL 写入该文件")
+    parser.add_argument("--restart", action="store_true", help="忽略已有检查点，从头运行")
+    parser.add_argument("--verbose", action="store_true", help="显示工作流的输出（多个项目的输出会交错）")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.jobs)
+    print(f"共 {len(jobs)} 个任务，并发 {args.concurrency}", file=sys.stderr)
+    started = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        results = run_batch(jobs, args.concurrency, resume=not args.restart, on_result=_print_result)
+    wall = time.perf_counter() - started
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    print(f"完成：{counts}，总耗时 {wall:.2f} 秒", file=sys.stderr)
+    return 0 if counts.get("ok", 0) == len(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
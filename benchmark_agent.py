@@ -0,0 +1,183 @@
+"""NovAgent 端到端性能基准
+
+默认在本地启动 MockQwenServer，无需网络即可测量：
+- 冷启动 `python novel_agent.py --help` 的耗时
+- 两个工作流图的编译耗时
+- 各节点的耗时（p50/p95）
+- 概念 + 小说工作流的端到端耗时（p50/p95）
+- N 个并发会话下的吞吐量
+
+    python benchmark_agent.py --sessions 8 --rounds 2 --chapters 10
+    python benchmark_agent.py --max-p95 5.0 --max-startup 1.0 --json bench.json  # 用于 CI，超出阈值时返回非零状态码
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from unittest import mock
+
+import llm_cache
+import input_provider
+import llm_client
+import novel_agent
+from mock_qwen_server import MockQwenServer
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "p50_seconds": percentile(values, 0.50),
+        "p95_seconds": percentile(values, 0.95),
+        "max_seconds": max(values) if values else 0.0,
+    }
+
+def time_startup(rounds: int) -> Dict:
+    """在新进程中测量冷启动 `python novel_agent.py --help` 的耗时"""
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, novel_agent.__file__, "--help"], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+def time_compile(rounds: int) -> Dict:
+    """测量两个工作流图的构建与编译耗时"""
+    result = {}
+    for name, factory in (("concept", novel_agent.create_concept_workflow),
+                          ("novel", novel_agent.create_novel_workflow)):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            factory().compile()
+            timings.append(time.perf_counter() - started)
+        result[name] = summarize(timings)
+    return result
+
+def _stream_nodes(graph, state: Dict, timings: Dict[str, List[float]]) -> Dict:
+    """逐节点运行工作流并记录每个节点的耗时，返回最终状态"""
+    final = state
+    last = time.perf_counter()
+    for update in graph.stream(state, stream_mode="updates"):
+        now = time.perf_counter()
+        for node, values in update.items():
+            timings[node].append(now - last)
+            if values:
+                final = {**final, **values}
+        last = now
+    return final
+
+def run_session(concept_graph, novel_graph, chapters: int, timings: Dict[str, List[float]]) -> float:
+    """运行一个完整会话（概念工作流 + 小说工作流），交互节点自动选择 AI 生成并确认，返回端到端耗时"""
+    started = time.perf_counter()
+    with input_provider.using(input_provider.AutoConfirmInput()):
+        concept_result = _stream_nodes(concept_graph, {
+            'concept': novel_agent.NovelConcept(),
+            'user_input': '',
+            'feedback_needed': True,
+        }, timings)
+        outline = '\n'.join(f"第{i}章 第{i}个转折" for i in range(1, chapters + 1))
+        _stream_nodes(novel_graph, {
+            'concept': concept_result['concept'],
+            'outline': outline,
+            'draft_content': '',
+            'current_section': '',
+            'save_path': '',
+            'user_feedback': '',
+        }, timings)
+    return time.perf_counter() - started
+
+def run_benchmark(base_url: Optional[str] = None, sessions: int = 4, rounds: int = 2,
+                  chapters: int = 5, latency: float = 0.05, tokens_per_second: float = 5000.0) -> Dict:
+    """运行基准并返回报告；未指定 base_url 时使用本地模拟服务"""
+    server = None
+    if base_url is None:
+        server = MockQwenServer(latency=latency, tokens_per_second=tokens_per_second).start()
+        base_url = server.url
+
+    try:
+        # 基准生成的项目写入临时目录，结束后连同目录一起删除
+        with tempfile.TemporaryDirectory(prefix="novagent-bench-") as working_dir, \
+                mock.patch.dict(os.environ, {"QWEN_CACHE_MODE": "off", "NOVEL_WORKING_DIR": working_dir}):
+            llm_cache.configure(None)
+            llm_client.configure(base_url=base_url, api_key=llm_client.get_settings().api_key or "mock")
+            llm_client.reset_stats()
+
+            report = {"base_url": base_url, "sessions": sessions, "rounds": rounds,
+                      "chapters": chapters, "startup": time_startup(rounds), "compile": time_compile(rounds)}
+            concept_graph = novel_agent.get_concept_graph()
+            novel_graph = novel_agent.get_novel_graph()
+            timings: Dict[str, List[float]] = defaultdict(list)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=sessions) as pool:
+                    totals = list(pool.map(
+                        lambda _: run_session(concept_graph, novel_graph, chapters, timings),
+                        range(sessions * rounds),
+                    ))
+                wall = time.perf_counter() - started
+
+            report["nodes"] = {node: summarize(values) for node, values in sorted(timings.items())}
+            report["end_to_end"] = summarize(totals)
+            report["throughput_sessions_per_second"] = len(totals) / wall if wall else 0.0
+            report["llm"] = llm_client.get_stats()["latency"]
+    finally:
+        llm_cache.configure(None)
+        llm_client.configure()
+        if server:
+            server.stop()
+    return report
+
+def print_report(report: Dict) -> None:
+    print(f"\n=== NovAgent 性能基准（{report['sessions']} 并发 × {report['rounds']} 轮，{report['chapters']} 章）===")
+    print(f"冷启动               p50 {report['startup']['p50_seconds'] * 1000:8.2f} ms")
+    for name, stats in report["compile"].items():
+        print(f"编译 {name:<16} p50 {stats['p50_seconds'] * 1000:8.2f} ms")
+    for node, stats in report["nodes"].items():
+        print(f"节点 {node:<16} p50 {stats['p50_seconds'] * 1000:8.2f} ms  p95 {stats['p95_seconds'] * 1000:8.2f} ms")
+    e2e = report["end_to_end"]
+    print(f"端到端               p50 {e2e['p50_seconds'] * 1000:8.2f} ms  p95 {e2e['p95_seconds'] * 1000:8.2f} ms")
+    print(f"吞吐量               {report['throughput_sessions_per_second']:.2f} 会话/秒")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="NovAgent 端到端性能基准")
+    parser.add_argument("--base-url", help="被测服务地址，默认启动本地模拟服务")
+    parser.add_argument("--sessions", type=int, default=4, help="并发会话数")
+    parser.add_argument("--rounds", type=int, default=2, help="每个并发槽位运行的会话数")
+    parser.add_argument("--chapters", type=int, default=5, help="每个会话生成的章节数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟服务的首字延迟（秒）")
+    parser.add_argument("--tps", type=float, default=5000.0, help="模拟服务每秒生成的 token 数")
+    parser.add_argument("--json", help="把报告写入 JSON 文件")
+    parser.add_argument("--max-p95", type=float, help="端到端 p95 的上限（秒），超出时返回非零状态码")
+    parser.add_argument("--max-startup", type=float, help="冷启动 p95 的上限（秒），超出时返回非零状态码")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.base_url, args.sessions, args.rounds, args.chapters, args.latency, args.tps)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.max_p95 is not None and report["end_to_end"]["p95_seconds"] > args.max_p95:
+        print(f"端到端 p95 超出上限 {args.max_p95} 秒")
+        return 1
+    if args.max_startup is not None and report["startup"]["p95_seconds"] > args.max_startup:
+        print(f"冷启动 p95 超出上限 {args.max_startup} 秒")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""模型调用的限流、重试与熔断
+
+进程内所有模型请求共享一个 CallGovernor：
+- 请求数（QWEN_RPM）与估算 token 数（QWEN_TPM）两个令牌桶，额度不足时排队等待；
+- 可重试的错误（429、超时、连接错误、5xx）按带随机抖动的指数退避重试，响应带 Retry-After 时以其为准；
+- 每个模型单独熔断：连续失败达到阈值后在冷却期内直接失败，冷却后放行一个试探请求，
+  一个模型熔断不影响改用其他模型（例如 model_router 的备用模型）的请求；
+- 统计排队等待时间、重试次数与熔断次数。
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import tracing
+
+T = TypeVar("T")
+
+class CircuitOpenError(RuntimeError):
+    """熔断期间拒绝的请求"""
+
+def is_retryable(error: BaseException) -> bool:
+    """限流、超时、连接错误与服务端错误可以重试，参数错误等客户端错误不重试"""
+    import httpx
+    import openai
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, httpx.TimeoutException,
+                          httpx.TransportError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+@dataclass(frozen=True)
+class GovernorSettings:
+    """限流、重试与熔断配置，限额为 0 表示不限制"""
+    requests_per_minute: float = 0.0
+    tokens_per_minute: float = 0.0
+    max_retries: int = 3
+    backoff_base: float = 1.0  # 第一次重试前的最大等待（秒），之后逐次翻倍
+    backoff_max: float = 30.0
+    failure_threshold: int = 5  # 连续失败多少次后熔断
+    reset_seconds: float = 30.0  # 熔断冷却时间
+
+    @classmethod
+    def from_env(cls) -> "GovernorSettings":
+        return cls(
+            requests_per_minute=float(os.getenv("QWEN_RPM", "0")),
+            tokens_per_minute=float(os.getenv("QWEN_TPM", "0")),
+            max_retries=int(os.getenv("QWEN_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("QWEN_BACKOFF_BASE", "1")),
+            backoff_max=float(os.getenv("QWEN_BACKOFF_MAX", "30")),
+            failure_threshold=int(os.getenv("QWEN_BREAKER_THRESHOLD", "5")),
+            reset_seconds=float(os.getenv("QWEN_BREAKER_RESET", "30")),
+        )
+
+class TokenBucket:
+    """按分钟补充的令牌桶，容量为一分钟的额度
+
+    reserve() 立即扣除额度（允许透支）并返回需要等待的秒数，同步与异步调用方各自睡眠即可，
+    先到的请求先得到额度。
+    """
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._tokens = per_minute
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+    def charge(self, amount: float) -> None:
+        """事后补扣额度（例如按实际输出 token 数）"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开，冷却后进入半开状态，试探成功则关闭"""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.opens = 0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.clock() - self.opened_at >= self.reset_seconds else "open"
+
+    def before_call(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half_open" and self._probing):
+                raise CircuitOpenError("模型服务连续失败，已暂停请求，请稍后再试")
+            if state == "half_open":
+                self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release_probe(self) -> None:
+        """试探请求被取消（既未成功也未失败）时释放试探名额，下一个请求重新试探"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.failure_threshold > 0 and self.failures >= self.failure_threshold):
+                if self.opened_at is None or self._probing:
+                    self.opens += 1
+                self.opened_at = self.clock()
+            self._probing = False
+
+class CallGovernor:
+    """共享的调用管控：限流排队、重试与熔断"""
+
+    def __init__(self, settings: Optional[GovernorSettings] = None, window: int = 1000):
+        self.settings = settings or GovernorSettings.from_env()
+        self.requests = TokenBucket(self.settings.requests_per_minute)
+        self.tokens = TokenBucket(self.settings.tokens_per_minute)
+        self.breaker = CircuitBreaker(self.settings.failure_threshold, self.settings.reset_seconds)  # 未指定模型的请求
+        self._breakers: Dict[str, CircuitBreaker] = {}  # 模型 -> 熔断器
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self.calls = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    def breaker_for(self, model: Optional[str] = None) -> CircuitBreaker:
+        """模型的熔断器，未指定模型时使用共享的 breaker"""
+        if not model:
+            return self.breaker
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = CircuitBreaker(self.settings.failure_threshold,
+                                                                 self.settings.reset_seconds)
+            return breaker
+
+    def circuit_open(self, model: str) -> bool:
+        """模型是否处于熔断冷却期（半开状态可以放行试探请求，不算熔断）"""
+        with self._lock:
+            breaker = self._breakers.get(model)
+        return breaker is not None and breaker.state == "open"
+
+    def _admit(self, estimated_tokens: int, breaker: CircuitBreaker) -> float:
+        """检查熔断并预留额度，返回需要排队等待的秒数"""
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            with self._lock:
+                self.rejected += 1
+            raise
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        with self._lock:
+            self.calls += 1
+            self.total_wait += wait
+            self._waits.append(wait)
+        tracing.current_span().add(queue_wait_seconds=wait)
+        return wait
+
+    def _on_error(self, error: BaseException, attempt: int, breaker: CircuitBreaker) -> Optional[float]:
+        """记录失败，可以重试时返回退避秒数"""
+        if not is_retryable(error):
+            # 请求本身有问题，不能说明服务已恢复：只释放试探名额，不关闭熔断也不清零失败计数
+            breaker.release_probe()
+            raise error
+        breaker.record_failure()
+        if attempt >= self.settings.max_retries:
+            raise error
+        with self._lock:
+            self.retries += 1
+        tracing.current_span().add(retries=1)
+        delay = _retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.settings.backoff_max, self.settings.backoff_base * 2 ** attempt))
+        return delay
+
+    def call(self, fn: Callable[[], T], estimated_tokens: int = 0, model: Optional[str] = None) -> T:
+        """同步执行一次模型调用，按 model 熔断"""
+        breaker = self.breaker_for(model)
+        for attempt in range(self.settings.max_retries + 1):
+            wait = self._admit(estimated_tokens, breaker)
+            try:
+                if wait:
+                    time.sleep(wait)
+                result = fn()
+            except Exception as e:
+                time.sleep(self._on_error(e, attempt, breaker))
+                continue
+            except BaseException:
+                breaker.release_probe()  # 被中断，不计为成功或失败
+                raise
+            breaker.record_success()
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], estimated_tokens: int = 0,
+                    model: Optional[str] = None) -> T:
+        """异步执行一次模型调用，排队与退避期间不阻塞事件循环"""
+        breaker = self.breaker_for(model)
+        for attempt in range(self.settings.max_retries + 1):
+            wait = self._admit(estimated_tokens, breaker)
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                result = await fn()
+            except Exception as e:
+                await asyncio.sleep(self._on_error(e, attempt, breaker))
+                continue
+            except BaseException:
+                breaker.release_probe()  # 被取消，不计为成功或失败
+                raise
+            breaker.record_success()
+            return result
+
+    def charge_tokens(self, amount: int) -> None:
+        """按响应中的实际输出 token 数补扣 TPM 额度"""
+        self.tokens.charge(amount)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            circuits = {"": self.breaker, **self._breakers}
+            states = {model: breaker.state for model, breaker in circuits.items()}
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                # 任一模型熔断时为 open，各模型的状态见 circuits
+                "circuit_state": next((state for state in ("open", "half_open") if state in states.values()), "closed"),
+                "circuit_opens": sum(breaker.opens for breaker in circuits.values()),
+                "circuits": {model: state for model, state in states.items() if model},
+                "queue_wait_avg_seconds": self.total_wait / self.calls if self.calls else 0.0,
+                "queue_wait_p95_seconds": waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0,
+                "queue_wait_max_seconds": waits[-1] if waits else 0.0,
+            }
+
+_governor: Optional[CallGovernor] = None
+_governor_lock = threading.Lock()
+
+def configure(governor: Optional[CallGovernor] = None) -> None:
+    """替换全局调用管控；传入 None 时下次使用前重新读取环境变量"""
+    global _governor
+    with _governor_lock:
+        _governor = governor
+
+def get_governor() -> CallGovernor:
+    """获取进程内共享的调用管控"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = CallGovernor()
+        return _governor
+
+__all__ = [
+    "CallGovernor",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "GovernorSettings",
+    "TokenBucket",
+    "configure",
+    "get_governor",
+    "is_retryable",
+]
@@ -0,0 +1,183 @@
+"""按段落寻址的内容修改
+
+把正文切成带稳定 ID 的段落（ID 由段落内容哈希得出，未改动的段落 ID 不变），
+让模型只返回针对具体段落的编辑操作，在本地校验后应用。输出 token 与修改规模成正比，而不是与章节长度成正比。
+
+编辑操作的 JSON 格式：
+    {"edits": [
+        {"op": "replace", "id": "p1a2b3c", "text": "新的段落"},
+        {"op": "insert_after", "id": "p1a2b3c", "text": "插入的段落"},  # id 为 null 时插入到开头
+        {"op": "delete", "id": "p4d5e6f"}
+    ]}
+"""
+import hashlib
+import json
+from typing import Dict, List, Optional, Tuple
+
+import llm_client
+from prompt_builder import SYSTEM_PROMPT, PromptBuilder
+
+OPS = ("replace", "insert_after", "delete")
+
+class PatchError(ValueError):
+    """编辑操作不合法"""
+
+def split_paragraphs(text: str) -> List[Tuple[str, str]]:
+    """把正文切成 (段落 ID, 段落) 列表，空行不计"""
+    paragraphs = []
+    seen: Dict[str, int] = {}
+    for paragraph in (p.strip() for p in text.split('\n')):
+        if not paragraph:
+            continue
+        base = "p" + hashlib.sha1(paragraph.encode("utf-8")).hexdigest()[:7]
+        seen[base] = seen.get(base, 0) + 1
+        paragraphs.append((base if seen[base] == 1 else f"{base}-{seen[base]}", paragraph))
+    return paragraphs
+
+def paragraph_layout(text: str) -> Tuple[str, List[str]]:
+    """与 split_paragraphs 对应的原始排版：(第一段之前的文本, 每段之后直到下一段开头的文本)
+
+    分隔中保留原有的空行与缩进，最后一段之后为正文末尾的文本。
+    """
+    spans = []
+    offset = 0
+    for line in text.split('\n'):
+        paragraph = line.strip()
+        if paragraph:
+            start = offset + line.index(paragraph)
+            spans.append((start, start + len(paragraph)))
+        offset += len(line) + 1
+    if not spans:
+        return text, []
+    ends = [start for start, _ in spans[1:]] + [len(text)]
+    return text[:spans[0][0]], [text[end:next_start] for (_, end), next_start in zip(spans, ends)]
+
+def render_paragraphs(paragraphs: List[Tuple[str, str]]) -> str:
+    """把段落渲染为模型可见的带 ID 文本"""
+    return '\n'.join(f"[{pid}] {paragraph}" for pid, paragraph in paragraphs)
+
+def validate_edits(paragraphs: List[Tuple[str, str]], edits: List[Dict]) -> None:
+    """校验编辑操作，不合法时抛出 PatchError"""
+    ids = {pid for pid, _ in paragraphs}
+    touched = set()
+    if not isinstance(edits, list):
+        raise PatchError("edits 必须是列表")
+    for i, edit in enumerate(edits, 1):
+        if not isinstance(edit, dict) or edit.get("op") not in OPS:
+            raise PatchError(f"第 {i} 个编辑操作类型无效：{edit!r}")
+        pid = edit.get("id")
+        if not (edit["op"] == "insert_after" and pid is None) and (not isinstance(pid, str) or pid not in ids):
+            raise PatchError(f"第 {i} 个编辑操作引用了不存在的段落：{pid!r}")
+        if edit["op"] in ("replace", "insert_after"):
+            text = edit.get("text")
+            if not isinstance(text, str):
+                raise PatchError(f"第 {i} 个编辑操作的 text 必须是字符串：{text!r}")
+            if not text.strip():
+                raise PatchError(f"第 {i} 个编辑操作缺少 text")
+        if edit["op"] in ("replace", "delete"):
+            if pid in touched:
+                raise PatchError(f"段落 {pid} 被重复替换或删除")
+            touched.add(pid)
+
+def apply_edits(paragraphs: List[Tuple[str, str]], edits: List[Dict], separator: str = '\n',
+                layout: Optional[Tuple[str, List[str]]] = None) -> str:
+    """校验并应用编辑操作，返回新正文
+
+    提供 layout（见 paragraph_layout）时保留各段原有的分隔与缩进，未改动的段落及其前后排版逐字不变，
+    插入的段落沿用前一段之后的分隔；否则以 separator 分段。
+    """
+    validate_edits(paragraphs, edits)
+    replaced = {e["id"]: e for e in edits if e["op"] in ("replace", "delete")}
+    inserted: Dict[Optional[str], List[str]] = {}
+    for edit in edits:
+        if edit["op"] == "insert_after":
+            inserted.setdefault(edit["id"], []).append(edit["text"].strip())
+    prefix, separators = layout if layout is not None else ("", [separator] * (len(paragraphs) - 1) + [""])
+
+    # 每项为 [段落, 其后的分隔]
+    result = [[text, separator] for text in inserted.get(None, [])]
+    last = len(paragraphs) - 1
+    for i, (pid, paragraph) in enumerate(paragraphs):
+        edit = replaced.get(pid)
+        if edit is None:
+            result.append([paragraph, separators[i]])
+        elif edit["op"] == "replace":
+            result.append([edit["text"].strip(), separators[i]])
+        extra = inserted.get(pid, [])
+        if extra:
+            between = separators[i] if i < last else separator
+            if edit is None or edit["op"] == "replace":
+                result[-1][1] = between
+            result.extend([text, between] for text in extra)
+            result[-1][1] = separators[i]
+    if result:
+        result[-1][1] = separators[-1] if separators else ""
+    return prefix + ''.join(text + sep for text, sep in result)
+
+def _parse_edits(content: str) -> List[Dict]:
+    text = content.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.index('\n') + 1:] if '\n' in text else text
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise PatchError(f"无法解析编辑操作：{e}") from e
+    if isinstance(data, dict):
+        if "edits" not in data:
+            raise PatchError("缺少 edits 字段")
+        return data["edits"]
+    return data
+
+EDIT_FORMAT = (
+    "请按修改要求修改下面的{subject}，只输出 JSON，格式为 {\"edits\": [...]}，每个编辑操作为以下之一：\n"
+    "{\"op\": \"replace\", \"id\": 段落ID, \"text\": 新段落}\n"
+    "{\"op\": \"insert_after\", \"id\": 段落ID（插入到开头时为 null）, \"text\": 新段落}\n"
+    "{\"op\": \"delete\", \"id\": 段落ID}\n"
+    "只列出需要改动的段落，不要输出未改动的内容。\n\n"
+)
+
+def revise(text: str, instruction: str, background: str = "", attempts: int = 2,
+           builder: Optional[PromptBuilder] = None, subject: str = "小说正文") -> Tuple[str, List[Dict]]:
+    """请模型按修改要求给出编辑操作并在本地应用，返回 (新正文, 编辑操作)
+
+    编辑操作不合法时把错误反馈给模型重试，直到用完 attempts 次。提供 builder 时以项目的固定前缀
+    （系统提示词、概念与大纲）作为 system 消息，与章节生成请求共享服务端缓存；
+    输出格式说明固定不变，放在正文与修改要求之前。subject 为提示词中对文本的称呼（如“小说大纲”）。
+    """
+    paragraphs = split_paragraphs(text)
+    layout = paragraph_layout(text)
+    separator = '\n\n' if '\n\n' in text else '\n'
+    messages = [
+        builder.system_message() if builder else {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": (
+            EDIT_FORMAT.replace("{subject}", subject)
+            + (f"{background}\n\n" if background else "")
+            + f"以下是{subject}，每段前的方括号内为段落 ID：\n{render_paragraphs(paragraphs)}\n\n"
+            f"修改要求：{instruction}"
+        )},
+    ]
+    error: Optional[PatchError] = None
+    for _ in range(max(1, attempts)):
+        response = llm_client.chat_completion(messages, task="edit", response_format={"type": "json_object"})
+        content = response.choices[0].message.content or ""
+        try:
+            edits = _parse_edits(content)
+            return apply_edits(paragraphs, edits, separator, layout), edits
+        except PatchError as e:
+            error = e
+            messages += [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": f"编辑操作不合法：{e}。请修正后重新输出完整的 JSON。"},
+            ]
+    raise error
+
+__all__ = [
+    "PatchError",
+    "apply_edits",
+    "paragraph_layout",
+    "render_paragraphs",
+    "revise",
+    "split_paragraphs",
+    "validate_edits",
+]
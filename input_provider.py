@@ -0,0 +1,111 @@
+"""可替换的用户输入来源
+
+工作流中需要用户回答的地方都通过 ask() 取得输入，默认转发给 input()。批量或无人值守运行时
+可以换成脚本化回答或自动确认；输入来源保存在 contextvars 中，不同线程、不同任务中的项目互不影响。
+
+    with using(AutoConfirmInput()):
+        run_workflows("项目")
+"""
+import builtins
+import contextlib
+import contextvars
+from typing import Dict, Iterator, List, Optional, Union
+
+class InputProvider:
+    """输入来源的基类
+
+    unattended 为 True 表示没有人在回答提示词，工作流遇到反复失败时应直接报错而不是再次询问。
+    """
+
+    unattended = False
+
+    def ask(self, prompt: str = "") -> str:
+        raise NotImplementedError
+
+class InteractiveInput(InputProvider):
+    """从终端读取输入"""
+
+    def ask(self, prompt: str = "") -> str:
+        return builtins.input(prompt)
+
+class ScriptedInput(InputProvider):
+    """按预设答案回答
+
+    answers 为列表时按顺序逐个作答；为字典时按提示词中包含的关键字作答，值为列表时依次取用，
+    用完后重复最后一个。没有匹配的答案时返回 default。
+    """
+
+    unattended = True
+
+    def __init__(self, answers: Union[List[str], Dict[str, Union[str, List[str]]], None] = None,
+                 default: str = ""):
+        self.queue: List[str] = list(answers) if isinstance(answers, list) else []
+        self.answers: Dict[str, List[str]] = {
+            key: list(value) if isinstance(value, list) else [value]
+            for key, value in (answers.items() if isinstance(answers, dict) else [])
+        }
+        self.default = default
+        self.prompts: List[str] = []  # 已回答过的提示词，便于排查
+
+    def ask(self, prompt: str = "") -> str:
+        self.prompts.append(prompt)
+        if self.queue:
+            return str(self.queue.pop(0))
+        for key, values in self.answers.items():
+            if key in prompt:
+                return str(values.pop(0) if len(values) > 1 else values[0])
+        return self.default
+
+# 自动确认时的回答：由 AI 生成概念，并直接确认
+AUTO_CONFIRM_ANSWERS = {
+    "请选择（1-2）": "2",
+    "请选择（1-3）": "1",
+}
+
+class AutoConfirmInput(ScriptedInput):
+    """无人值守运行：选择 AI 生成概念并确认，其余提示词回答 default"""
+
+    def __init__(self, overrides: Optional[Dict[str, Union[str, List[str]]]] = None, default: str = ""):
+        super().__init__({**AUTO_CONFIRM_ANSWERS, **(overrides or {})}, default)
+
+class InterruptInput(InputProvider):
+    """在 LangGraph 工作流中以 interrupt() 暂停，等待调用方以 Command(resume=回答) 继续
+
+    暂停期间不占用线程，状态保存在检查点中（必须为工作流配置 checkpointer）。继续时节点会从头
+    重新执行，此前已回答的提示词按顺序直接取回答案。
+    """
+
+    def ask(self, prompt: str = "") -> str:
+        from langgraph.types import interrupt
+        return str(interrupt({"prompt": prompt}))
+
+_provider: contextvars.ContextVar = contextvars.ContextVar("novel_input_provider", default=None)
+_interactive = InteractiveInput()
+
+def get_provider() -> InputProvider:
+    """当前上下文的输入来源，未设置时为终端输入"""
+    return _provider.get() or _interactive
+
+@contextlib.contextmanager
+def using(provider: InputProvider) -> Iterator[InputProvider]:
+    """在上下文中使用指定的输入来源"""
+    token = _provider.set(provider)
+    try:
+        yield provider
+    finally:
+        _provider.reset(token)
+
+def ask(prompt: str = "") -> str:
+    """向当前输入来源提问"""
+    return get_provider().ask(prompt)
+
+__all__ = [
+    "AutoConfirmInput",
+    "InputProvider",
+    "InteractiveInput",
+    "InterruptInput",
+    "ScriptedInput",
+    "ask",
+    "get_provider",
+    "using",
+]
@@ -0,0 +1,158 @@
+"""模型响应的本地缓存
+
+以请求内容（模型、消息、温度、max_tokens 等）的哈希为键，把响应存入 SQLite，
+按最近访问时间做 LRU 淘汰，并支持按存活时间过期。默认关闭，通过 QWEN_CACHE_MODE 启用：
+- off：不使用缓存
+- readwrite：先查缓存，未命中再调用模型并写入
+- record：总是调用模型，并把结果写入缓存
+- replay：只从缓存读取，未命中时抛出 CacheMissError，可用于离线运行
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+MODES = ("off", "readwrite", "record", "replay")
+
+class CacheMissError(LookupError):
+    """replay 模式下缓存未命中"""
+
+class ResponseCache:
+    """基于 SQLite 的内容寻址响应缓存"""
+
+    def __init__(self, path: str, mode: str = "readwrite",
+                 max_bytes: int = 256 * 1024 * 1024, max_age: Optional[float] = None):
+        if mode not in MODES:
+            raise ValueError(f"未知的缓存模式：{mode}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_age = max_age  # 秒，None 表示永不过期
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed_at)")
+
+    @property
+    def reads(self) -> bool:
+        return self.mode in ("readwrite", "replay")
+
+    @property
+    def writes(self) -> bool:
+        return self.mode in ("readwrite", "record")
+
+    @staticmethod
+    def key(request: Dict) -> str:
+        """计算请求的缓存键，是否流式不影响键值"""
+        payload = {k: v for k, v in request.items() if k not in ("stream", "stream_options", "timeout")}
+        canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取缓存的响应，过期条目视为未命中"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, response: Dict) -> None:
+        """写入响应并按需淘汰"""
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        """删除过期条目，再按最近访问时间从旧到新删除，直到总大小不超过上限"""
+        if self.max_age is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"mode": self.mode, "entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+_cache: Optional[ResponseCache] = None
+_configured = False
+_lock = threading.Lock()
+
+def configure(cache: Optional[ResponseCache] = None) -> Optional[ResponseCache]:
+    """设置全局缓存；传入 None 则按环境变量重新创建"""
+    global _cache, _configured
+    with _lock:
+        if _cache is not None and _cache is not cache:
+            _cache.close()
+        _cache, _configured = cache, cache is not None
+    return cache
+
+def get_cache() -> Optional[ResponseCache]:
+    """获取全局缓存，未启用时返回 None"""
+    global _cache, _configured
+    if not _configured:
+        with _lock:
+            if not _configured:
+                mode = os.getenv("QWEN_CACHE_MODE", "off").lower()
+                if mode != "off":
+                    max_age_days = os.getenv("QWEN_CACHE_MAX_AGE_DAYS")
+                    _cache = ResponseCache(
+                        os.getenv("QWEN_CACHE_PATH", "./.llm_cache/responses.sqlite"),
+                        mode=mode,
+                        max_bytes=int(float(os.getenv("QWEN_CACHE_MAX_MB", "256")) * 1024 * 1024),
+                        max_age=float(max_age_days) * 86400 if max_age_days else None,
+                    )
+                _configured = True
+    return _cache
+
+__all__ = [
+    "CacheMissError",
+    "ResponseCache",
+    "configure",
+    "get_cache",
+]
@@ -0,0 +1,546 @@
+"""Qwen 模型客户端层
+
+进程内共享一组按配置创建的 OpenAI 兼容客户端（同步与异步），
+复用 keep-alive 连接池，统计每次请求的延迟，并在启用时经过 llm_cache 响应缓存。
+异步客户端按事件循环创建；同步代码应通过 run() 在进程内共享的后台事件循环中运行协程，
+各节点共用该循环的异步客户端与连接池，不必每次重新建立连接与 TLS 握手（进程退出时由 shutdown() 关闭）。
+调用方以 task 指明任务类型，由 model_router 选择该任务的模型、token 上限与超时。
+未命中缓存的请求经过 call_governor 统一限流、重试与熔断；启用 tracing 时每次调用记为一个 span。所有调用模型的节点都应通过本模块。
+"""
+import asyncio
+import atexit
+import contextvars
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Awaitable, Dict, List, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+import call_governor
+import llm_cache
+import model_router
+import prompt_builder
+import tracing
+
+if TYPE_CHECKING:  # openai 与 httpx 导入较慢，首次创建客户端时才导入
+    import httpx
+    import openai
+
+# 加载环境变量
+load_dotenv()
+
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+T = TypeVar("T")
+
+@dataclass(frozen=True)
+class LLMSettings:
+    """模型调用配置，进程内只解析一次"""
+    api_key: Optional[str] = None
+    base_url: str = DASHSCOPE_BASE_URL
+    model: str = "qwen3-235b-a22b"
+    temperature: float = 0.7
+    max_tokens: int = 2048
+    timeout: float = 120.0  # 单次请求总超时（秒）
+    connect_timeout: float = 10.0  # 建立连接超时（秒）
+    max_connections: int = 20  # 连接池最大连接数
+    max_keepalive_connections: int = 10  # 保持空闲的长连接数
+    keepalive_expiry: float = 60.0  # 空闲长连接的保留时间（秒）
+
+    @classmethod
+    def from_env(cls) -> "LLMSettings":
+        """从 QWEN_* 环境变量读取配置"""
+        return cls(
+            api_key=os.getenv("QWEN_API_KEY"),
+            base_url=os.getenv("QWEN_BASE_URL", DASHSCOPE_BASE_URL),
+            model=os.getenv("QWEN_MODEL_NAME", "qwen3-235b-a22b"),
+            temperature=float(os.getenv("QWEN_TEMPERATURE", "0.7")),
+            max_tokens=int(os.getenv("QWEN_MAX_TOKENS", "2048")),
+            timeout=float(os.getenv("QWEN_TIMEOUT", "120")),
+            connect_timeout=float(os.getenv("QWEN_CONNECT_TIMEOUT", "10")),
+            max_connections=int(os.getenv("QWEN_POOL_SIZE", "20")),
+            max_keepalive_connections=int(os.getenv("QWEN_POOL_KEEPALIVE", "10")),
+        )
+
+    def http_limits(self) -> "httpx.Limits":
+        import httpx
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def http_timeout(self) -> "httpx.Timeout":
+        import httpx
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+class LatencyStats:
+    """线程安全的请求延迟统计，保留最近 window 次请求用于计算分位数"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.total_seconds += seconds
+            self._recent.append(seconds)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            recent = sorted(self._recent)
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_seconds": self.total_seconds / self.requests if self.requests else 0.0,
+                "p50_seconds": _percentile(recent, 0.50),
+                "p95_seconds": _percentile(recent, 0.95),
+                "max_seconds": recent[-1] if recent else 0.0,
+            }
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def estimate_tokens(text: str) -> int:
+    """本地粗略估算 token 数：中日韩字符约一字一 token，其余字符约四个一 token"""
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uf900' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
+
+_lock = threading.Lock()
+_settings: Optional[LLMSettings] = None
+_client: Optional["openai.OpenAI"] = None
+_async_clients = weakref.WeakKeyDictionary()  # 事件循环 -> AsyncOpenAI
+_loop: Optional[asyncio.AbstractEventLoop] = None  # run() 使用的后台事件循环
+_loop_thread: Optional[threading.Thread] = None
+_stats = LatencyStats()
+
+def configure(settings: Optional[LLMSettings] = None, **overrides) -> LLMSettings:
+    """设置（或重新设置）全局配置，已创建的客户端会被关闭并在下次使用时重建"""
+    global _settings, _client
+    with _lock:
+        settings = replace(settings or LLMSettings.from_env(), **overrides)
+        old_client = _client
+        old_async = list(_async_clients.items())
+        _settings, _client = settings, None
+        _async_clients.clear()
+    if old_client is not None:
+        old_client.close()
+    for loop, client in old_async:
+        # 异步客户端只能在所属事件循环中关闭；已关闭的循环中的连接已随循环失效
+        if not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+    return settings
+
+def get_settings() -> LLMSettings:
+    """获取当前配置，首次调用时从环境变量解析"""
+    global _settings
+    if _settings is None:
+        with _lock:
+            if _settings is None:
+                _settings = LLMSettings.from_env()
+    return _settings
+
+def get_client() -> "openai.OpenAI":
+    """获取进程内共享的同步客户端"""
+    global _client
+    if _client is None:
+        import httpx
+        import openai
+
+        settings = get_settings()
+        with _lock:
+            if _client is None:
+                _client = openai.OpenAI(
+                    api_key=settings.api_key,
+                    base_url=settings.base_url,
+                    timeout=settings.http_timeout(),
+                    max_retries=0,  # 重试由 call_governor 统一处理
+                    http_client=httpx.Client(
+                        limits=settings.http_limits(),
+                        timeout=settings.http_timeout(),
+                    ),
+                )
+    return _client
+
+def get_async_client() -> "openai.AsyncOpenAI":
+    """获取当前事件循环共享的异步客户端（httpx 异步连接池不能跨事件循环复用）"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import httpx
+        import openai
+
+        settings = get_settings()
+        client = openai.AsyncOpenAI(
+            api_key=settings.api_key,
+            base_url=settings.base_url,
+            timeout=settings.http_timeout(),
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=settings.http_limits(),
+                timeout=settings.http_timeout(),
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+async def aclose_async_client() -> None:
+    """关闭当前事件循环的异步客户端及其连接池"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+def _ensure_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_thread
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_run_loop, args=(_loop,), name="llm-client", daemon=True)
+            _loop_thread.start()
+        return _loop
+
+def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+    loop.close()
+
+def run(coro: Awaitable[T]) -> T:
+    """在进程内共享的后台事件循环中运行协程并等待结果
+
+    协程在调用方 contextvars 的副本中运行（与 asyncio.run 相同，输入来源、追踪与工作流事件照常可用），
+    调用方被中断时取消该协程。各次调用共用该循环的异步客户端，连接在节点之间保持复用。
+    不能在该循环内部调用（协程中应直接 await）。
+    """
+    loop = _ensure_loop()
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("不能在 llm_client 的事件循环中调用 run()，请直接 await 协程")
+    context = contextvars.copy_context()
+
+    async def main() -> T:
+        return await asyncio.get_running_loop().create_task(coro, context=context)
+
+    future = asyncio.run_coroutine_threadsafe(main(), loop)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
+async def _close_loop() -> None:
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await aclose_async_client()
+
+def shutdown(timeout: float = 5.0) -> None:
+    """取消后台事件循环中的任务、关闭其异步客户端并停止该循环，下次 run() 时重新创建"""
+    global _loop, _loop_thread
+    with _lock:
+        loop, thread = _loop, _loop_thread
+        _loop, _loop_thread = None, None
+    if loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_close_loop(), loop).result(timeout)
+    except Exception:
+        pass  # 退出时尽力关闭，连接会随进程结束释放
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout)
+
+atexit.register(shutdown)
+
+def build_request(messages: List[Dict], task: Optional[str] = None, **kwargs) -> Dict:
+    """补全请求参数：全局配置 < 任务路由 < 调用方显式传入的参数"""
+    settings = get_settings()
+    route, model = model_router.get_router().resolve(task, settings.model, call_governor.get_governor().circuit_open)
+    request = {
+        "model": model,
+        "temperature": settings.temperature,
+        "max_tokens": settings.max_tokens,
+        "extra_body": {"enable_thinking": False},
+    }
+    request.update(route.overrides())
+    request.update(kwargs)
+    if request.get("stream"):
+        # 流式响应默认不带 usage，要求服务端在最后追加一个只含 usage 的数据块
+        request.setdefault("stream_options", {"include_usage": True})
+    request["messages"] = messages
+    return request
+
+class _TimedStream:
+    """包装流式响应，在流结束或被关闭时记录整段延迟
+
+    流被完整读取时，把拼接后的完整响应交给 on_complete（用于写入缓存）。调用方读到所需的全部内容后
+    提前关闭（例如遇到结束标记）时，以 close(complete=True) 把已收到的内容同样视为完整响应。
+    """
+
+    def __init__(self, stream, started: float, model: str, on_complete=None, span=tracing.NULL_SPAN):
+        self._stream = stream
+        self._model = model
+        self._started = started
+        self._on_complete = on_complete
+        self._span = span
+        self._recorded = False
+        self._parts: List[str] = []
+        self._last = None
+        self._finish_reason: Optional[str] = None
+
+    def _observe(self, chunk) -> None:
+        self._last = chunk
+        if chunk.choices and chunk.choices[0].finish_reason:
+            self._finish_reason = chunk.choices[0].finish_reason
+        if self._on_complete and chunk.choices and chunk.choices[0].delta.content:
+            self._parts.append(chunk.choices[0].delta.content)
+
+    def _finish(self, error: bool = False, complete: bool = False) -> None:
+        if not self._recorded:
+            self._recorded = True
+            _record_latency(self._model, time.perf_counter() - self._started, error)
+            if self._last is not None:
+                _record_usage(self._span, self._last.usage)
+            self._span.finish(RuntimeError("stream failed") if error else None)
+            if complete and self._on_complete and self._last is not None:
+                # 提前关闭时没有收到 finish_reason，按正常结束记录
+                self._on_complete(_completion_from_stream(self._last, ''.join(self._parts),
+                                                          self._finish_reason or "stop"))
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                self._observe(chunk)
+                yield chunk
+        except Exception:
+            self._finish(error=True)
+            raise
+        self._finish(complete=True)
+
+    def close(self, complete: bool = False) -> None:
+        self._finish(complete=complete)
+        self._stream.close()
+
+class _AsyncTimedStream(_TimedStream):
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self._observe(chunk)
+                yield chunk
+        except Exception:
+            self._finish(error=True)
+            raise
+        self._finish(complete=True)
+
+    async def close(self, complete: bool = False) -> None:
+        self._finish(complete=complete)
+        await self._stream.close()
+
+class _ReplayStream:
+    """以单个数据块回放缓存的响应，接口与流式响应一致"""
+
+    def __init__(self, cached: Dict):
+        from openai.types.chat import ChatCompletionChunk
+        choice = cached["choices"][0]
+        self._chunk = ChatCompletionChunk.model_validate({
+            "id": cached.get("id", ""),
+            "object": "chat.completion.chunk",
+            "created": cached.get("created", 0),
+            "model": cached.get("model", ""),
+            "choices": [{
+                "index": 0,
+                "delta": {"role": "assistant", "content": choice["message"].get("content")},
+                "finish_reason": choice.get("finish_reason") or "stop",
+            }],
+            "usage": cached.get("usage"),
+        })
+
+    def __iter__(self):
+        yield self._chunk
+
+    async def __aiter__(self):
+        yield self._chunk
+
+    def close(self, complete: bool = False) -> None:
+        pass
+
+class _AsyncReplayStream(_ReplayStream):
+    async def close(self, complete: bool = False) -> None:
+        pass
+
+def _completion_from_stream(last_chunk, content: str, finish_reason: Optional[str] = None) -> Dict:
+    """把流式响应拼接为与非流式响应相同结构的字典（开启 include_usage 时最后一块只有 usage）"""
+    if finish_reason is None and last_chunk.choices:
+        finish_reason = last_chunk.choices[0].finish_reason
+    return {
+        "id": last_chunk.id,
+        "object": "chat.completion",
+        "created": last_chunk.created,
+        "model": last_chunk.model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason or "stop",
+        }],
+        "usage": last_chunk.usage.model_dump() if last_chunk.usage else None,
+    }
+
+def _cached_completion(cached: Dict):
+    from openai.types.chat import ChatCompletion
+    return ChatCompletion.model_validate(cached)
+
+def _lookup_cache(request: Dict):
+    """查询响应缓存，返回 (缓存, 键, 命中的响应)"""
+    cache = llm_cache.get_cache()
+    if cache is None:
+        return None, None, None
+    key = cache.key(request)
+    cached = cache.get(key) if cache.reads else None
+    if cached is None and cache.mode == "replay":
+        raise llm_cache.CacheMissError(f"缓存中没有该请求的响应：{key}")
+    return cache, key, cached
+
+def _prompt_tokens(request: Dict) -> int:
+    """估算请求的输入 token 数，用于 TPM 限流"""
+    return sum(estimate_tokens(str(m.get("content") or "")) for m in request["messages"])
+
+def _record_usage(span, usage) -> None:
+    """把响应中的 token 用量记入 span，并按实际输出 token 数补扣 TPM 额度"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    span.add(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+             cached_tokens=cached_tokens)
+    prompt_builder.record_usage(usage.prompt_tokens, cached_tokens)
+    if usage.completion_tokens:
+        call_governor.get_governor().charge_tokens(usage.completion_tokens)
+
+def _record_latency(model: str, seconds: float, error: bool = False) -> None:
+    """记入总体延迟统计与该模型的健康统计（用于切换备用模型）"""
+    _stats.record(seconds, error)
+    model_router.get_router().record(model, seconds, error)
+
+def _start_span(request: Dict, task: Optional[str]):
+    tracer = tracing.get_tracer()
+    if tracer is None:
+        return tracing.NULL_SPAN
+    return tracer.start("chat_completion", "llm", model=request["model"], task=task,
+                        project=prompt_builder.current_project(), stream=bool(request.get("stream")))
+
+def chat_completion(messages: List[Dict], task: Optional[str] = None, **kwargs):
+    """同步调用聊天补全接口，未指定的参数取任务路由或全局配置"""
+    request = build_request(messages, task, **kwargs)
+    span = _start_span(request, task)
+    try:
+        cache, key, cached = _lookup_cache(request)
+        if cached is not None:
+            span.set(cache_hit=True)
+            span.finish()
+            return _ReplayStream(cached) if request.get("stream") else _cached_completion(cached)
+
+        def attempt():
+            started = time.perf_counter()
+            try:
+                return get_client().chat.completions.create(**request), started
+            except Exception:
+                _record_latency(request["model"], time.perf_counter() - started, error=True)
+                raise
+
+        span.add(llm_calls=1)
+        with tracing.activate(span):
+            response, started = call_governor.get_governor().call(attempt, _prompt_tokens(request), request["model"])
+    except BaseException as e:
+        span.finish(e)
+        raise
+    store = (lambda data: cache.put(key, data)) if cache and cache.writes else None
+    if request.get("stream"):
+        return _TimedStream(response, started, request["model"], on_complete=store, span=span)
+    _record_latency(request["model"], time.perf_counter() - started)
+    _record_usage(span, getattr(response, "usage", None))
+    span.finish()
+    if store:
+        store(response.model_dump())
+    return response
+
+async def achat_completion(messages: List[Dict], task: Optional[str] = None, **kwargs):
+    """异步调用聊天补全接口，未指定的参数取任务路由或全局配置"""
+    request = build_request(messages, task, **kwargs)
+    span = _start_span(request, task)
+    try:
+        cache, key, cached = _lookup_cache(request)
+        if cached is not None:
+            span.set(cache_hit=True)
+            span.finish()
+            return _AsyncReplayStream(cached) if request.get("stream") else _cached_completion(cached)
+
+        async def attempt():
+            started = time.perf_counter()
+            try:
+                return await get_async_client().chat.completions.create(**request), started
+            except Exception:
+                _record_latency(request["model"], time.perf_counter() - started, error=True)
+                raise
+
+        span.add(llm_calls=1)
+        with tracing.activate(span):
+            response, started = await call_governor.get_governor().acall(attempt, _prompt_tokens(request),
+                                                                             request["model"])
+    except BaseException as e:
+        span.finish(e)
+        raise
+    store = (lambda data: cache.put(key, data)) if cache and cache.writes else None
+    if request.get("stream"):
+        return _AsyncTimedStream(response, started, request["model"], on_complete=store, span=span)
+    _record_latency(request["model"], time.perf_counter() - started)
+    _record_usage(span, getattr(response, "usage", None))
+    span.finish()
+    if store:
+        store(response.model_dump())
+    return response
+
+def get_stats() -> Dict:
+    """返回连接池配置与请求延迟统计"""
+    settings = get_settings()
+    return {
+        "base_url": settings.base_url,
+        "max_connections": settings.max_connections,
+        "max_keepalive_connections": settings.max_keepalive_connections,
+        "timeout": settings.timeout,
+        "connect_timeout": settings.connect_timeout,
+        "latency": _stats.snapshot(),
+        "cache": llm_cache.get_cache().stats() if llm_cache.get_cache() else None,
+        "governor": call_governor.get_governor().snapshot(),
+        "routing": model_router.get_router().snapshot(),
+        "prompt_cache": prompt_builder.snapshot(),
+    }
+
+def reset_stats() -> None:
+    """清空延迟统计"""
+    global _stats
+    _stats = LatencyStats()
+
+__all__ = [
+    "LLMSettings",
+    "LatencyStats",
+    "estimate_tokens",
+    "configure",
+    "get_settings",
+    "get_client",
+    "get_async_client",
+    "aclose_async_client",
+    "run",
+    "chat_completion",
+    "achat_completion",
+    "get_stats",
+    "reset_stats",
+]
@@ -0,0 +1,300 @@
+"""书稿导出：Markdown 与 EPUB
+
+逐章从项目目录流式读取正文，先把每章正文渲染为片段文件（按章节内容哈希命名），再把片段依次
+拷贝进 Markdown 文件与 EPUB（zip）包中。整个过程任何时候只有一个文件块在内存中，内存占用与书的
+长度无关。目录取自大纲（卷 → 章），大纲中没有的章节按“第N章”命名：
+
+    {project_dir}/export/
+        export.json           # 上次导出的各格式签名
+        {title}.md
+        {title}.epub
+        .parts/{hash}.md      # 各章正文片段，内容不变的章节下次直接复用
+        .parts/{hash}.xhtml
+
+再次导出时只渲染内容有变化的章节；书名、目录与各章哈希都未变的格式直接跳过，不重新打包。
+"""
+import argparse
+import contextlib
+import hashlib
+import html
+import json
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+import zipfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import project_store
+import tracing
+from outline_tree import OutlineTree
+from project_store import ChapterHandle
+
+EXPORT_DIR = "export"
+PARTS_DIR = ".parts"
+STATE = "export.json"
+FORMATS = ("markdown", "epub")
+RENDER_VERSION = "1"  # 片段渲染方式变化时递增，使旧片段失效
+COPY_BUFFER = 1 << 16
+
+@dataclass
+class TocEntry:
+    """目录中的一章：所在卷标题（没有分卷时为空）与章节标题"""
+    volume: str
+    title: str
+
+@dataclass
+class ExportResult:
+    paths: Dict[str, str] = field(default_factory=dict)  # 格式 -> 输出文件
+    rendered: int = 0  # 重新渲染的章节片段数
+    reused: int = 0  # 直接复用的章节片段数
+    skipped: List[str] = field(default_factory=list)  # 没有变化、未重新打包的格式
+
+def table_of_contents(outline: str, count: int) -> List[TocEntry]:
+    """按大纲给出 count 章的目录，大纲中章节不足时其余章节按“第N章”命名"""
+    toc = [TocEntry(volume.heading if volume else "", chapter.heading or f"第{i + 1}章")
+           for i, (volume, chapter) in enumerate(OutlineTree.parse(outline).chapters()[:count])]
+    return toc + [TocEntry("", f"第{i + 1}章") for i in range(len(toc), count)]
+
+def _paragraphs(path: str) -> Iterator[str]:
+    """逐段读取章节文件，不把整章读入内存"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+@contextlib.contextmanager
+def _atomic_output(path: str) -> Iterator[str]:
+    """先写同目录下的临时文件，成功后原子替换目标文件"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".part")
+    os.close(fd)
+    try:
+        yield tmp_path
+        tracing.current_span().add(bytes_written=os.path.getsize(tmp_path))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _part_key(digest: str) -> str:
+    return hashlib.sha1(f"{RENDER_VERSION}:{digest}".encode("utf-8")).hexdigest()
+
+def _render_part(source: str, path: str, fmt: str) -> None:
+    with _atomic_output(path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as out:
+        for paragraph in _paragraphs(source):
+            if fmt == "markdown":
+                out.write(paragraph + "\n\n")
+            else:
+                out.write(f"<p>{html.escape(paragraph)}</p>\n")
+
+class ManuscriptExporter:
+    """单个项目的导出器"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.directory = os.path.join(self.root, EXPORT_DIR)
+        self.parts = os.path.join(self.directory, PARTS_DIR)
+
+    def _load_state(self) -> Dict:
+        path = os.path.join(self.directory, STATE)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def part_path(self, digest: str, fmt: str) -> str:
+        return os.path.join(self.parts, f"{_part_key(digest)}.{'md' if fmt == 'markdown' else 'xhtml'}")
+
+    def output_path(self, title: str, fmt: str) -> str:
+        return os.path.join(self.directory, f"{project_store.project_title(title)}.{'md' if fmt == 'markdown' else 'epub'}")
+
+    @tracing.traced("export_manuscript", "save")
+    def export(self, formats: Sequence[str] = FORMATS) -> ExportResult:
+        """导出项目目录中已保存的书稿"""
+        unknown = set(formats) - set(FORMATS)
+        if unknown:
+            raise ValueError(f"不支持的导出格式：{'、'.join(sorted(unknown))}")
+        store = project_store.get_store(self.root)
+        chapters = store.handle()
+        title = store.manifest.get("title") or os.path.basename(self.root)
+        toc = table_of_contents(store.read_outline(), len(chapters))
+
+        result = ExportResult()
+        state = self._load_state()
+        for fmt in formats:
+            for i, digest in enumerate(chapters.hashes):
+                part = self.part_path(digest, fmt)
+                if os.path.exists(part):
+                    result.reused += 1
+                else:
+                    _render_part(chapters.path(i), part, fmt)
+                    result.rendered += 1
+
+            path = result.paths[fmt] = self.output_path(title, fmt)
+            signature = hashlib.sha1(json.dumps(
+                [RENDER_VERSION, title, [(e.volume, e.title) for e in toc], chapters.hashes],
+                ensure_ascii=False).encode("utf-8")).hexdigest()
+            if state.get(fmt) == signature and os.path.exists(path):
+                result.skipped.append(fmt)
+                continue
+            stale = self.output_path(state.get(f"{fmt}_title", title), fmt)
+            if fmt == "markdown":
+                self._write_markdown(path, title, toc, chapters)
+            else:
+                self._write_epub(path, title, toc, chapters)
+            if stale != path and os.path.exists(stale):
+                os.remove(stale)
+            state[fmt], state[f"{fmt}_title"] = signature, title
+
+        project_store.atomic_write(os.path.join(self.directory, STATE), json.dumps(state, ensure_ascii=False, indent=2))
+        self._prune(chapters)
+        return result
+
+    def _prune(self, chapters: ChapterHandle) -> None:
+        """删除不再被任何章节引用的片段"""
+        keep = {os.path.basename(self.part_path(digest, fmt)) for digest in chapters.hashes for fmt in FORMATS}
+        for name in os.listdir(self.parts) if os.path.isdir(self.parts) else []:
+            if name not in keep:
+                os.remove(os.path.join(self.parts, name))
+
+    def _copy_part(self, digest: str, fmt: str, out) -> None:
+        with open(self.part_path(digest, fmt), "rb") as part:
+            shutil.copyfileobj(part, out, COPY_BUFFER)
+
+    def _write_markdown(self, path: str, title: str, toc: List[TocEntry], chapters: ChapterHandle) -> None:
+        volumes = any(entry.volume for entry in toc)
+        with _atomic_output(path) as tmp_path, open(tmp_path, "wb") as out:
+            lines = [f"# {title}", "", "## 目录", ""]
+            for volume, entries in _group(toc):
+                if volume:
+                    lines.append(f"- {volume}")
+                lines += [f"{'  ' if volume else ''}- [{entry.title}](#{_anchor(i)})" for i, entry in entries]
+            out.write(('\n'.join(lines) + '\n\n').encode("utf-8"))
+            current = None
+            for i, (entry, digest) in enumerate(zip(toc, chapters.hashes)):
+                if entry.volume and entry.volume != current:
+                    out.write(f"## {entry.volume}\n\n".encode("utf-8"))
+                current = entry.volume
+                level = "###" if volumes else "##"
+                out.write(f'{level} <a id="{_anchor(i)}"></a>{entry.title}\n\n'.encode("utf-8"))
+                self._copy_part(digest, "markdown", out)
+
+    def _write_epub(self, path: str, title: str, toc: List[TocEntry], chapters: ChapterHandle) -> None:
+        identifier = f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, 'novagent:' + self.root)}"
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with _atomic_output(path) as tmp_path, zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as book:
+            # mimetype 必须是第一个条目且不压缩
+            book.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", zipfile.ZIP_STORED)
+            book.writestr("META-INF/container.xml", CONTAINER_XML)
+            book.writestr("OEBPS/content.opf", _package_document(identifier, title, modified, len(toc)))
+            book.writestr("OEBPS/nav.xhtml", _navigation(title, toc))
+            for i, (entry, digest) in enumerate(zip(toc, chapters.hashes)):
+                with book.open(f"OEBPS/{_chapter_file(i)}", "w") as out:
+                    out.write(_xhtml_head(entry.title).encode("utf-8"))
+                    out.write(f"<h2>{html.escape(entry.title)}</h2>\n".encode("utf-8"))
+                    self._copy_part(digest, "epub", out)
+                    out.write(XHTML_TAIL.encode("utf-8"))
+
+def _anchor(index: int) -> str:
+    return f"chapter-{index + 1}"
+
+def _chapter_file(index: int) -> str:
+    return f"text/chapter-{index + 1:05d}.xhtml"
+
+def _group(toc: List[TocEntry]) -> List[Tuple[str, List[Tuple[int, TocEntry]]]]:
+    """把连续属于同一卷的章节分为一组"""
+    groups: List[Tuple[str, List[Tuple[int, TocEntry]]]] = []
+    for i, entry in enumerate(toc):
+        if not groups or groups[-1][0] != entry.volume:
+            groups.append((entry.volume, []))
+        groups[-1][1].append((i, entry))
+    return groups
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+XHTML_TAIL = "</body>\n</html>\n"
+
+def _xhtml_head(title: str) -> str:
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+            f'xml:lang="zh" lang="zh">\n<head><title>{html.escape(title)}</title></head>\n<body>\n')
+
+def _package_document(identifier: str, title: str, modified: str, count: int) -> str:
+    items = '\n'.join(f'    <item id="c{i + 1}" href="{_chapter_file(i)}" media-type="application/xhtml+xml"/>'
+                      for i in range(count))
+    spine = '\n'.join(f'    <itemref idref="c{i + 1}"/>' for i in range(count))
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id" xml:lang="zh">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">{identifier}</dc:identifier>
+    <dc:title>{html.escape(title)}</dc:title>
+    <dc:language>zh</dc:language>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+{items}
+  </manifest>
+  <spine>
+{spine}
+  </spine>
+</package>
+"""
+
+def _navigation(title: str, toc: List[TocEntry]) -> str:
+    lines = [_xhtml_head(title).rstrip('\n'), '<nav epub:type="toc" id="toc">', f"<h1>{html.escape(title)}</h1>", "<ol>"]
+    for volume, entries in _group(toc):
+        links = [f'<li><a href="{_chapter_file(i)}">{html.escape(entry.title)}</a></li>' for i, entry in entries]
+        if volume:
+            lines += [f"<li><span>{html.escape(volume)}</span>", "<ol>", *links, "</ol>", "</li>"]
+        else:
+            lines += links
+    lines += ["</ol>", "</nav>"]
+    return '\n'.join(lines) + '\n' + XHTML_TAIL
+
+def export_project(root: str, formats: Sequence[str] = FORMATS) -> ExportResult:
+    """导出项目目录中的书稿（见 ManuscriptExporter.export）"""
+    return ManuscriptExporter(root).export(formats)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="把项目书稿导出为 Markdown / EPUB")
+    parser.add_argument("project", help="项目目录，或 NOVEL_WORKING_DIR 下的项目标题")
+    parser.add_argument("--format", dest="formats", nargs="+", choices=FORMATS, default=list(FORMATS),
+                        help="导出格式（默认全部）")
+    args = parser.parse_args(argv)
+
+    root = args.project
+    if not os.path.isdir(root):
+        root = project_store.project_dir(os.getenv("NOVEL_WORKING_DIR", "./novels"), args.project)
+    if not os.path.exists(os.path.join(root, project_store.MANIFEST)):
+        print(f"找不到项目：{args.project}", file=sys.stderr)
+        return 1
+    result = export_project(root, args.formats)
+    for fmt, path in result.paths.items():
+        print(f"{fmt}: {path}{'（无变化）' if fmt in result.skipped else ''}")
+    print(f"重新渲染 {result.rendered} 个章节片段，复用 {result.reused} 个")
+    return 0
+
+__all__ = [
+    "ExportResult",
+    "FORMATS",
+    "ManuscriptExporter",
+    "TocEntry",
+    "export_project",
+    "table_of_contents",
+]
+
+if __name__ == "__main__":
+    sys.exit(main())
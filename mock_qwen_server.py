@@ -0,0 +1,261 @@
+"""本地模拟的 Qwen（DashScope 兼容模式）服务
+
+实现 OpenAI 兼容的 /v1/chat/completions 接口，可配置首字延迟、生成速度、流式输出与错误注入，
+用于离线测试和性能基准。把 QWEN_BASE_URL 指向 MockQwenServer.url 即可让 NovAgent 使用它：
+
+    python mock_qwen_server.py --port 8000 --latency 0.2 --tps 500
+    QWEN_BASE_URL=http://127.0.0.1:8000/v1 python novel_agent.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional
+
+SAMPLE_CONCEPT = """标题：雾港来信
+类型：悬疑
+主题：一封迟到二十年的信揭开小城旧案
+目标读者：喜欢推理小说的成年读者
+背景设定：常年被海雾笼罩的南方港口小城
+写作风格：冷静克制，细节丰富
+预计字数：120000
+
+主要人物：
+沈默 - 主角：沉默寡言的邮局分拣员，记忆力惊人
+林晚 - 女主角：返乡调查父亲死因的记者
+周海生 - 反派：表面和善的码头老板
+
+关键情节点：
+- 沈默发现一封寄错地址的旧信
+- 林晚循着信中线索回到雾港
+- 两人发现旧案与码头走私有关
+- 周海生设局嫁祸沈默
+- 真相在海雾散去的清晨揭开
+
+补充说明：全书以沈默的第一人称叙述
+每章开头引用一封旧信
+【概念结束】
+"""
+
+SAMPLE_CONCEPT_JSON = json.dumps({
+    "title": "雾港来信",
+    "genre": "悬疑",
+    "logline": "一封迟到二十年的信揭开小城旧案",
+    "target_audience": "喜欢推理小说的成年读者",
+    "setting": "常年被海雾笼罩的南方港口小城",
+    "style_and_tone": "冷静克制，细节丰富",
+    "word_count_target": 120000,
+    "main_characters": [
+        {"name": "沈默", "role": "主角", "traits": "沉默寡言的邮局分拣员，记忆力惊人"},
+        {"name": "林晚", "role": "女主角", "traits": "返乡调查父亲死因的记者"},
+        {"name": "周海生", "role": "反派", "traits": "表面和善的码头老板"},
+    ],
+    "key_plot_points": [
+        "沈默发现一封寄错地址的旧信",
+        "林晚循着信中线索回到雾港",
+        "两人发现旧案与码头走私有关",
+        "周海生设局嫁祸沈默",
+        "真相在海雾散去的清晨揭开",
+    ],
+    "additional_notes": "无",
+}, ensure_ascii=False)
+
+SAMPLE_OUTLINE = """第一章 错投的旧信
+- 沈默在分拣时发现一封二十年前的信
+- 信封上的地址早已拆迁
+第二章 返乡
+- 林晚回到雾港调查父亲的死因
+- 两人在邮局相遇
+第三章 码头的秘密
+- 旧信指向码头的一次走私
+- 周海生设局嫁祸沈默
+- 海雾散去，真相揭开"""
+
+CHAPTER_SENTENCE = "海雾从码头漫上来，吞没了路灯，也吞没了他没有说出口的话。"
+
+def reply_for(messages: List[Dict]) -> str:
+    """根据提示词给出确定的模拟回复"""
+    prompt = messages[-1].get("content", "") if messages else ""
+    if "标题：[标题]" in prompt:
+        return SAMPLE_CONCEPT
+    if '"key_plot_points"' in prompt:
+        return SAMPLE_CONCEPT_JSON
+    if "分章大纲" in prompt:
+        return SAMPLE_OUTLINE
+    if "正文" in prompt:
+        return CHAPTER_SENTENCE * 20
+    return "好的。"
+
+class MockQwenServer:
+    """在后台线程中运行的模拟服务"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05,
+                 tokens_per_second: float = 2000.0, chunk_size: int = 8,
+                 error_rate: float = 0.0, error_status: int = 429, seed: Optional[int] = None,
+                 failing_models: Iterable[str] = ()):
+        self.latency = latency  # 首个 token 前的延迟（秒）
+        self.tokens_per_second = tokens_per_second  # 生成速度，按一个字符一个 token 估算
+        self.chunk_size = chunk_size  # 流式输出时每个数据块的字符数
+        self.error_rate = error_rate  # 注入错误的概率
+        self.error_status = error_status  # 注入错误时返回的状态码
+        self.failing_models = set(failing_models)  # 请求这些模型时总是返回错误（模拟单个模型不可用）
+        self.requests = 0
+        self.errors = 0
+        self._prefixes = set()  # 模拟服务端上下文缓存：见过的 system 消息
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def serve_forever(self) -> None:
+        """在当前线程中处理请求，直到其他线程调用 stop()"""
+        self._httpd.serve_forever()
+
+    def start(self) -> "MockQwenServer":
+        """在后台线程中处理请求"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """停止处理请求并关闭监听端口"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "MockQwenServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _cached_tokens(self, messages: List[Dict]) -> int:
+        """system 消息与之前的请求逐字相同时视为命中缓存，返回命中的 token 数（按字符数估算）"""
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        prefix = messages[0].get("content") or ""
+        with self._lock:
+            hit = prefix in self._prefixes
+            self._prefixes.add(prefix)
+        return len(prefix) if hit else 0
+
+    def _should_fail(self, model: Optional[str] = None) -> bool:
+        with self._lock:
+            self.requests += 1
+            failed = model in self.failing_models or self._random.random() < self.error_rate
+            self.errors += int(failed)
+        return failed
+
+def _make_handler(server: MockQwenServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive，便于验证连接复用
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                return
+            request = json.loads(body or b"{}")
+            if server._should_fail(request.get("model")):
+                self._send_json(server.error_status, {"error": {
+                    "message": "injected error", "type": "mock_error", "code": str(server.error_status),
+                }})
+                return
+
+            time.sleep(server.latency)
+            content = reply_for(request.get("messages", []))
+            max_tokens = request.get("max_tokens")
+            finish_reason = "stop"
+            if max_tokens and len(content) > max_tokens:
+                content, finish_reason = content[:max_tokens], "length"
+            prompt_chars = sum(len(m.get("content") or "") for m in request.get("messages", []))
+            usage = {"prompt_tokens": prompt_chars, "completion_tokens": len(content),
+                     "total_tokens": prompt_chars + len(content),
+                     "prompt_tokens_details": {"cached_tokens": server._cached_tokens(request.get("messages", []))}}
+            meta = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()),
+                    "model": request.get("model", "mock")}
+            if request.get("stream"):
+                include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+                self._stream(meta, content, finish_reason, usage if include_usage else None)
+            else:
+                time.sleep(len(content) / server.tokens_per_second)
+                self._send_json(200, {**meta, "object": "chat.completion", "usage": usage, "choices": [{
+                    "index": 0, "message": {"role": "assistant", "content": content},
+                    "finish_reason": finish_reason,
+                }]})
+
+        def _send_json(self, status: int, payload: Dict) -> None:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _stream(self, meta: Dict, content: str, finish_reason: str, usage: Optional[Dict]) -> None:
+            """与兼容接口一致：只有请求带 stream_options.include_usage 时才在最后追加只含 usage 的数据块"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            step = server.chunk_size
+            try:
+                for i in range(0, len(content), step):
+                    piece = content[i:i + step]
+                    time.sleep(len(piece) / server.tokens_per_second)
+                    last = i + step >= len(content)
+                    chunk = {**meta, "object": "chat.completion.chunk", "choices": [{
+                        "index": 0, "delta": {"content": piece},
+                        "finish_reason": finish_reason if last else None,
+                    }]}
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                if usage is not None:
+                    chunk = {**meta, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端提前关闭了流
+                self.close_connection = True
+
+    return Handler
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地模拟的 Qwen 兼容服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.2, help="首个 token 前的延迟（秒）")
+    parser.add_argument("--tps", type=float, default=500.0, help="每秒生成的 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的概率")
+    parser.add_argument("--error-status", type=int, default=429, help="注入错误时的状态码")
+    args = parser.parse_args()
+
+    server = MockQwenServer(args.host, args.port, latency=args.latency, tokens_per_second=args.tps,
+                            error_rate=args.error_rate, error_status=args.error_status)
+    print(f"模拟服务已启动：{server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""按任务类型路由模型
+
+概念、大纲、章节初稿、摘要、修改与格式修复等任务可以各自指定模型、输出 token 上限、超时与温度，
+未配置的任务和字段沿用 QWEN_* 全局配置，调用方显式传入的参数优先。路由表来自 QWEN_MODEL_ROUTES
+（JSON 字符串或 JSON 文件路径），例如：
+
+    {"summary": {"model": "qwen-turbo", "max_tokens": 512, "timeout": 30},
+     "draft": {"model": "qwen-plus", "fallback": "qwen-turbo", "fallback_p95": 40, "fallback_error_rate": 0.2}}
+
+配置了 fallback 的任务在主模型最近的 p95 延迟或错误率超过阈值、或主模型已被 call_governor 熔断时改用备用模型，
+冷却 fallback_cooldown 秒后清空主模型的统计并重新试用。每个模型的延迟与错误由 llm_client 在每次请求后记录。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, fields
+from typing import Callable, Dict, Optional, Tuple
+
+# 调用方使用的任务类型
+TASKS = ("concept", "outline", "draft", "summary", "edit", "repair")
+
+@dataclass(frozen=True)
+class Route:
+    """单个任务的模型配置，为 None 的字段沿用全局配置"""
+    model: Optional[str] = None
+    max_tokens: Optional[int] = None
+    timeout: Optional[float] = None  # 单次请求超时（秒）
+    temperature: Optional[float] = None
+    fallback: Optional[str] = None  # 备用模型
+    fallback_p95: Optional[float] = None  # 主模型最近 p95 延迟（秒）超过时切换
+    fallback_error_rate: Optional[float] = None  # 主模型最近错误率超过时切换
+    min_samples: int = 20  # 主模型样本不足时不切换
+    fallback_cooldown: float = 60.0  # 切换后多久重新试用主模型（秒）
+
+    def overrides(self) -> Dict:
+        """需要覆盖全局配置的请求参数"""
+        values = {"max_tokens": self.max_tokens, "timeout": self.timeout, "temperature": self.temperature}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def unhealthy(self, health: Dict) -> bool:
+        """按主模型的统计判断是否应切换到备用模型"""
+        if not self.fallback or health["samples"] < self.min_samples:
+            return False
+        return ((self.fallback_p95 is not None and health["p95_seconds"] > self.fallback_p95)
+                or (self.fallback_error_rate is not None and health["error_rate"] > self.fallback_error_rate))
+
+class ModelHealth:
+    """单个模型最近 window 次请求的延迟与错误"""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)  # (秒数, 是否出错)
+
+    def record(self, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            self._recent.append((seconds, error))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._recent.clear()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            recent = list(self._recent)
+        latencies = sorted(seconds for seconds, _ in recent)
+        return {
+            "samples": len(recent),
+            "p95_seconds": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else 0.0,
+            "error_rate": sum(error for _, error in recent) / len(recent) if recent else 0.0,
+        }
+
+class ModelRouter:
+    """按任务选择模型，并根据各模型的健康状况切换到备用模型"""
+
+    def __init__(self, routes: Optional[Dict[str, Route]] = None, window: int = 200,
+                 clock: Callable[[], float] = time.monotonic):
+        self.routes: Dict[str, Route] = dict(routes or {})
+        self.window = window
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._health: Dict[str, ModelHealth] = {}
+        self._fallback_until: Dict[str, float] = {}  # 任务 -> 重新试用主模型的时间
+        self.fallbacks: Dict[str, int] = {}  # 任务 -> 切换次数
+
+    @classmethod
+    def from_config(cls, config: Dict, **kwargs) -> "ModelRouter":
+        """从 {任务: {字段: 值}} 创建路由表，未知字段报 ValueError"""
+        known = {field.name for field in fields(Route)}
+        routes = {}
+        for task, values in config.items():
+            if isinstance(values, str):
+                values = {"model": values}
+            unknown = set(values) - known
+            if unknown:
+                raise ValueError(f"任务 {task} 的路由包含未知字段：{'、'.join(sorted(unknown))}")
+            routes[task] = Route(**values)
+        return cls(routes, **kwargs)
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        """从 QWEN_MODEL_ROUTES 读取路由表，可以是 JSON 字符串或 JSON 文件路径"""
+        value = os.getenv("QWEN_MODEL_ROUTES", "").strip()
+        if not value:
+            return cls()
+        if not value.startswith("{"):
+            with open(value, "r", encoding="utf-8") as f:
+                value = f.read()
+        return cls.from_config(json.loads(value))
+
+    def health(self, model: str) -> ModelHealth:
+        with self._lock:
+            health = self._health.get(model)
+            if health is None:
+                health = self._health[model] = ModelHealth(self.window)
+            return health
+
+    def record(self, model: str, seconds: float, error: bool = False) -> None:
+        """记录一次请求的结果"""
+        self.health(model).record(seconds, error)
+
+    def resolve(self, task: Optional[str], default_model: str,
+                circuit_open: Optional[Callable[[str], bool]] = None) -> Tuple[Route, str]:
+        """返回任务的路由和本次应使用的模型
+
+        circuit_open(model) 为真时视主模型不健康，不必等样本数达到 min_samples。
+        """
+        route = self.routes.get(task) if task else None
+        if route is None:
+            return Route(), default_model
+        primary = route.model or default_model
+        if not route.fallback:
+            return route, primary
+        now = self.clock()
+        with self._lock:
+            until = self._fallback_until.get(task)
+            if until is not None and now < until:
+                return route, route.fallback
+        if until is not None:
+            # 冷却结束：清空主模型的旧统计，重新积累样本后再判断
+            with self._lock:
+                self._fallback_until.pop(task, None)
+            self.health(primary).reset()
+            return route, primary
+        if route.unhealthy(self.health(primary).snapshot()) or (circuit_open is not None and circuit_open(primary)):
+            with self._lock:
+                self._fallback_until[task] = now + route.fallback_cooldown
+                self.fallbacks[task] = self.fallbacks.get(task, 0) + 1
+            return route, route.fallback
+        return route, primary
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            health = dict(self._health)
+            now = self.clock()
+            return {
+                "routes": {task: asdict(route) for task, route in self.routes.items()},
+                "models": {model: h.snapshot() for model, h in health.items()},
+                "fallback_active": sorted(task for task, until in self._fallback_until.items() if now < until),
+                "fallbacks": dict(self.fallbacks),
+            }
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+def configure(router: Optional[ModelRouter] = None) -> None:
+    """替换全局路由；传入 None 时下次使用前重新读取环境变量"""
+    global _router
+    with _router_lock:
+        _router = router
+
+def get_router() -> ModelRouter:
+    """获取进程内共享的路由"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter.from_env()
+        return _router
+
+__all__ = [
+    "ModelHealth",
+    "ModelRouter",
+    "Route",
+    "TASKS",
+    "configure",
+    "get_router",
+]
@@ -0,0 +1,63 @@
+"""基于 MinHash 的近似重复检测
+
+把文本切成词项集合（汉字二元组、英文单词，与检索索引一致），用 num_perm 个哈希函数取最小值作为签名，
+两个签名相同位置相等的比例即为两集合 Jaccard 相似度的估计。
+"""
+import hashlib
+import random
+from typing import Iterable, List, Tuple
+
+from retrieval_index import tokenize
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+def _term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=4).digest(), "little")
+
+class MinHash:
+    """固定参数的 MinHash 签名生成器，同一实例生成的签名可以互相比较"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.permutations: List[Tuple[int, int]] = [
+            (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)
+        ]
+
+    def signature(self, text: str) -> List[int]:
+        hashes = {_term_hash(term) for term in tokenize(text)}
+        if not hashes:
+            return [_MAX_HASH] * len(self.permutations)
+        return [min(((a * h + b) % _PRIME) & _MAX_HASH for h in hashes) for a, b in self.permutations]
+
+def similarity(a: List[int], b: List[int]) -> float:
+    """两个签名估计的 Jaccard 相似度"""
+    return sum(x == y for x, y in zip(a, b)) / len(a) if a else 0.0
+
+class NearDuplicateFilter:
+    """记录已接受的文本，新文本与其中任意一个相似度达到 threshold 时视为重复"""
+
+    def __init__(self, threshold: float = 0.6, num_perm: int = 64):
+        self.threshold = threshold
+        self.minhash = MinHash(num_perm)
+        self.signatures: List[List[int]] = []
+
+    def add(self, text: str) -> bool:
+        """文本不与已接受的文本重复时记录并返回 True"""
+        signature = self.minhash.signature(text)
+        if any(similarity(signature, seen) >= self.threshold for seen in self.signatures):
+            return False
+        self.signatures.append(signature)
+        return True
+
+def deduplicate(texts: Iterable[str], threshold: float = 0.6) -> List[int]:
+    """返回去除近似重复后保留的文本序号"""
+    keep = NearDuplicateFilter(threshold)
+    return [i for i, text in enumerate(texts) if keep.add(text)]
+
+__all__ = [
+    "MinHash",
+    "NearDuplicateFilter",
+    "deduplicate",
+    "similarity",
+]
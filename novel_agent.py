@@ -1,24 +1,47 @@
+import argparse
+import asyncio
+import atexit
+import functools
+import hashlib
+import json
 import os
-from typing import Dict, List, Optional, TypedDict, Annotated
+import sqlite3
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, TypedDict, Annotated
 from dotenv import load_dotenv
-from langgraph.graph import StateGraph, END, START
 from pydantic import BaseModel
-from dashscope import Generation
 from datetime import datetime
-import openai
+import call_governor
+import content_patch
+import input_provider
+import llm_cache
+import llm_client
+import near_duplicates
+import outline_prefetch
+from outline_tree import OutlineTree, chapter_records, plan_regeneration
+import project_catalog
+import project_store
+from project_store import ChapterHandle
+import prompt_builder
+from prompt_builder import SYSTEM_PROMPT, PromptBuilder
+import retrieval_index
+import structured_output
+import tracing
+from story_context import StoryContext
+import version_store
+
+if TYPE_CHECKING:  # langgraph 导入较慢，构建工作流时才导入
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.graph import StateGraph
 
 # 加载环境变量
 load_dotenv()
 
-# 定义状态类型
-class NovelState(TypedDict):
-    project_name: str
-    outline: str
-    content: str
-    current_chapter: int
-    total_chapters: int
-    working_dir: str
-    mode: str  # 'new' 或 'edit'
+class ConceptCharacter(BaseModel):
+    """结构化输出中主要人物的格式"""
+    name: str
+    role: str
+    traits: str
 
 class NovelConcept(BaseModel):
     """小说概念模型"""
@@ -33,59 +56,490 @@ class NovelConcept(BaseModel):
     word_count_target: int = 0 # 目标字数
     additional_notes: str = "" # 补充说明
 
+# 定义状态类型
+class NovelState(TypedDict):
+    project_name: str
+    concept: NovelConcept
+    outline: str
+    outline_tree: Dict # 大纲树及各章的生成记录，用于大纲修改后的增量重新生成
+    content: str
+    draft_content: str # 整段初稿（旧版状态），现由 chapters 句柄代替，不再填充
+    chapters: ChapterHandle # 各章正文的句柄（章节 ID 与哈希），正文保存在项目目录中按需读取
+    failed_chapters: List[int] # 重试后仍生成失败的章节序号（从 1 开始）
+    story_context: Dict # 章节与篇章摘要（StoryContext.to_dict()）
+    current_chapter: int
+    total_chapters: int
+    current_section: str # 待处理的修改要求针对的部分：'outline' 为大纲，其他为正文
+    save_path: str
+    user_feedback: str
+    working_dir: str
+    mode: str  # 'new' 或 'edit'
+
 class ConceptState(TypedDict):
     """概念收集状态"""
     concept: NovelConcept
     user_input: str # 用户输入
     feedback_needed: bool # 是否需要用户反馈
 
+def emit_event(event: str, **data) -> None:
+    """向以 stream_mode="custom" 运行工作流的调用方推送事件（如服务模式的 SSE），其他情况下忽略"""
+    from langgraph.config import get_stream_writer
+    try:
+        writer = get_stream_writer()
+    except RuntimeError:  # 不在工作流中运行
+        return
+    writer({"event": event, **data})
+
 # 定义节点函数
 def discuss_outline(state: NovelState) -> NovelState:
-    """与用户讨论并确定小说大纲"""
-    # TODO: 实现与用户的交互逻辑
-    return state
+    """确定小说大纲
 
-def create_initial_draft(state: NovelState) -> NovelState:
-    """根据大纲创建初稿"""
-    # TODO: 调用Qwen模型生成初稿
+    已有大纲时直接使用；否则取用概念确认前在后台预取的大纲（概念未变时），没有可用的预取结果时当场生成。
+    """
+    if state.get('outline') or not state.get('concept'):
+        return state
+    concept = state['concept']
+    started = time.perf_counter()
+    outline = None
+    if speculative_outline_enabled():
+        outline = outline_prefetch.get_prefetcher().take(outline_prefetch.concept_hash(concept))
+    if outline:
+        print(f"\n=== 使用预先生成的大纲（等待 {time.perf_counter() - started:.2f} 秒）===")
+    else:
+        print("\n=== 正在生成大纲 ===")
+        try:
+            outline = llm_client.run(agenerate_outline(concept))
+        except Exception as e:
+            print(f"大纲生成出错：{str(e)}")
+            return state
+    print(outline)
+    state['outline'] = outline
     return state
 
-def save_draft(state: NovelState) -> NovelState:
-    """保存稿件到本地"""
-    project_dir = os.path.join(state['working_dir'], state['project_name'])
-    os.makedirs(project_dir, exist_ok=True)
-    
-    # 保存大纲
-    with open(os.path.join(project_dir, 'outline.txt'), 'w', encoding='utf-8') as f:
-        f.write(state['outline'])
-    
-    # 保存内容
-    with open(os.path.join(project_dir, 'content.txt'), 'w', encoding='utf-8') as f:
-        f.write(state['content'])
-    
+def split_outline(outline: str) -> List[str]:
+    """按“第N章”标题把大纲拆分为各章的大纲条目
+
+    第一个章节标题之前的内容视为总述，不单独成章；没有章节标题时整体视为一章。
+    """
+    return OutlineTree.parse(outline).chapter_entries()
+
+def format_concept(concept: NovelConcept) -> str:
+    """把小说概念整理成供提示词使用的文本"""
+    lines = [
+        f"标题：{concept.title}",
+        f"类型：{concept.genre}",
+        f"主题：{concept.logline}",
+        f"背景设定：{concept.setting}",
+        f"写作风格：{concept.style_and_tone}",
+        "主要人物：",
+    ]
+    for char in concept.main_characters:
+        lines.append(f"{char.get('name', '')} - {char.get('role', '')}：{char.get('traits', char.get('description', ''))}")
+    return '\n'.join(lines)
+
+OUTLINE_PROMPT = """请根据以下小说概念编写分章大纲，共 {chapters} 章。
+每章以“第N章 章节标题”单独成行开头，下面用“- ”列出 2 到 4 个场景要点，不要输出其他内容。
+
+小说概念：
+{concept}
+
+关键情节点：
+{plot_points}"""
+
+def outline_messages(concept: NovelConcept) -> List[Dict]:
+    """生成分章大纲的对话消息，章节数由 NOVEL_OUTLINE_CHAPTERS 控制"""
+    plot_points = '\n'.join(f"- {point}" for point in concept.key_plot_points) or "无"
+    prompt = OUTLINE_PROMPT.format(chapters=int(os.getenv("NOVEL_OUTLINE_CHAPTERS", "10")),
+                                   concept=format_concept(concept), plot_points=plot_points)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+async def agenerate_outline(concept: NovelConcept) -> str:
+    """根据概念生成分章大纲"""
+    response = await llm_client.achat_completion(outline_messages(concept), task="outline")
+    return (response.choices[0].message.content or "").strip()
+
+def speculative_outline_enabled() -> bool:
+    """是否在用户确认概念前预取大纲（NOVEL_SPECULATIVE_OUTLINE，默认关闭）"""
+    return os.getenv("NOVEL_SPECULATIVE_OUTLINE", "false").lower() in ("1", "true", "yes")
+
+async def _draft_chapters(concept: NovelConcept, outline: str, entries: List[str],
+                          concurrency: int, retries: int,
+                          journal: Optional["DraftJournal"] = None,
+                          context: Optional[StoryContext] = None,
+                          previous: Optional[Sequence[str]] = None,
+                          retriever: Optional[retrieval_index.RetrievalIndex] = None,
+                          indices: Optional[List[int]] = None,
+                          on_chapter: Optional[Callable[[int, str], Any]] = None,
+                          builder: Optional[PromptBuilder] = None,
+                          stream: bool = False) -> List[Any]:
+    """以有界并发逐章生成正文，已记入 journal 的章节直接复用
+
+    网络与服务端错误只由 call_governor 重试；这里只在模型返回空正文时重新生成该章，最多 retries 次。
+    仍然出错的章节记为失败（结果为 None），熔断与缓存回放未命中无法通过重试恢复，直接向上抛出。
+
+    indices 指定只生成哪些章节（从 0 开始），其余章节在结果中为 None。
+    提供 on_chapter(序号, 正文) 时每章完成后立即交给它（例如写入磁盘），结果中保存它的返回值，
+    不在内存中保留整本书的正文。
+
+    提供 context 与按 entries 位置排列的已有正文 previous 时，每章提示词附带预算内的前情概要；
+    previous 为章节句柄时按各章哈希查找摘要（见 StoryContext.build），尚无正文的位置为空。
+    提供 retriever 时再附带与本章大纲最相关的几个前文片段。前文读取失败时该章不附带上下文，照常生成。
+    各章请求共用 builder 的固定前缀（概念与完整大纲），这些随章节变化的内容都放在前缀之后。
+    stream 为 True 时以流式方式请求，每收到一段正文即推送 chapter_delta 事件（见 emit_event）。
+    """
+    top_k = int(os.getenv("NOVEL_RETRIEVAL_K", "3"))
+    budget = int(os.getenv("NOVEL_CONTEXT_TOKENS", "3000"))
+    recent_chars = int(os.getenv("NOVEL_RECENT_CHARS", "1500"))
+    results: List[Any] = [None] * len(entries)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    builder = builder or PromptBuilder(format_concept(concept), outline)
+    hashes = previous.hashes if isinstance(previous, ChapterHandle) else None
+
+    async def finish(index: int, text: str) -> None:
+        emit_event("chapter", chapter=index + 1, total=len(entries), text=text)
+        results[index] = await asyncio.to_thread(on_chapter, index, text) if on_chapter else text
+
+    async def request_chapter(messages: List[Dict]) -> str:
+        response = await llm_client.achat_completion(messages, task="draft")
+        return (response.choices[0].message.content or "") if response.choices else ""
+
+    async def stream_chapter(index: int, messages: List[Dict]) -> str:
+        response = await llm_client.achat_completion(messages, task="draft", stream=True)
+        parts = []
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    emit_event("chapter_delta", chapter=index + 1, total=len(entries), text=parts[-1])
+        finally:
+            await response.close()
+        return ''.join(parts)
+
+    async def draft(index: int) -> None:
+        background = ""
+        try:
+            if context is not None and previous is not None:
+                background = context.build(index, previous, budget, recent_chars, hashes=hashes)
+            if retriever is not None:
+                # 检索读取 SQLite 索引，放到线程中执行，不阻塞其他章节的请求；只检索本章之前的章节
+                passages = await asyncio.to_thread(retriever.search, entries[index], top_k,
+                                                   before_position=index + 1)
+                background = '\n\n'.join(part for part in (background, retrieval_index.format_passages(passages)) if part)
+        except (OSError, sqlite3.Error) as e:
+            # 前文文件或索引读取失败只影响本章的上下文，不中断其他章节
+            print(f"第 {index + 1} 章读取前文失败，不附带前情：{str(e)}")
+        messages = builder.messages(background, f"请根据以上信息撰写本章正文，只输出正文：\n{entries[index]}")
+        key = DraftJournal.key(messages)
+        if journal is not None:
+            text = journal.get(key)
+            if text is not None:
+                await finish(index, text)
+                return
+        for attempt in range(retries + 1):
+            try:
+                async with semaphore:
+                    text = await (stream_chapter(index, messages) if stream else request_chapter(messages))
+            except (call_governor.CircuitOpenError, llm_cache.CacheMissError):
+                raise
+            except Exception as e:
+                print(f"第 {index + 1} 章生成出错：{str(e)}")
+                return
+            if not text.strip():
+                print(f"第 {index + 1} 章输出为空（第 {attempt + 1} 次）")
+                continue
+            if journal is not None:
+                journal.put(key, text)
+            print(f"第 {index + 1}/{len(entries)} 章初稿完成")
+            await finish(index, text)
+            return
+
+    await asyncio.gather(*(draft(i) for i in (range(len(entries)) if indices is None else indices)))
+    return results
+
+def _project_store(state: NovelState) -> project_store.ProjectStore:
+    """状态对应的项目存储"""
+    working_dir = state.get('working_dir') or os.getenv("NOVEL_WORKING_DIR", "./novels")
+    title = state['concept'].title if state.get('concept') else state.get('project_name', '')
+    return project_store.get_store(project_store.project_dir(working_dir, title))
+
+def chapter_handle(state: NovelState) -> ChapterHandle:
+    """状态中的章节句柄；旧版状态中的正文列表（或整段 draft_content）先写入项目目录再转换为句柄"""
+    chapters = state.get('chapters')
+    if isinstance(chapters, ChapterHandle):
+        return chapters
+    if not chapters:
+        content = state.get('draft_content') or state.get('content') or ''
+        chapters = [content] if content else []
+    store = _project_store(state)
+    return ChapterHandle(store.root, [store.write_chapter(text) for text in chapters])
+
+def _open_retriever(state: NovelState) -> Optional[retrieval_index.RetrievalIndex]:
+    """项目已有检索索引时返回它"""
+    if not retrieval_enabled() or not state.get('concept'):
+        return None
+    working_dir = state.get('working_dir') or os.getenv("NOVEL_WORKING_DIR", "./novels")
+    directory = project_store.project_dir(working_dir, state['concept'].title)
+    if not os.path.exists(os.path.join(directory, retrieval_index.INDEX_FILE)):
+        return None
+    return retrieval_index.get_index(directory)
+
+def create_initial_draft(state: NovelState, config: "Optional[RunnableConfig]" = None) -> NovelState:
+    """根据大纲创建初稿
+
+    每个章节作为独立任务并发生成，并发数由 NOVEL_DRAFT_CONCURRENCY 控制，
+    单章失败按 NOVEL_CHAPTER_RETRIES 单独重试，结果按大纲顺序写回。
+    带检查点运行时，已完成的章节会记入 DraftJournal，中断后重新运行不会再次生成。
+    每章完成后立即写入项目目录，状态中只保留章节句柄。
+    config 的 configurable 中 stream_chapters 为 True 时（服务模式）以流式生成，边生成边推送正文片段。
+    """
+    tree = OutlineTree.parse(state.get('outline', ''))
+    entries = tree.chapter_entries()
+    if not entries:
+        return state
+
+    # 只重新生成大纲输入有变化的章节，其余章节沿用已有正文（文件已不存在的除外）
+    current = chapter_handle(state)
+    store = project_store.get_store(current.root)
+    drafts = [entry if current.exists(i) else None for i, entry in enumerate(current.entries)]
+    previous = state.get('outline_tree') or {}
+    reused, stale = plan_regeneration(previous.get('chapters', []), tree, drafts)
+
+    concurrency = int(os.getenv("NOVEL_DRAFT_CONCURRENCY", "4"))
+    retries = int(os.getenv("NOVEL_CHAPTER_RETRIES", "2"))
+    if len(stale) < len(entries):
+        print(f"\n=== 大纲变更影响 {len(stale)}/{len(entries)} 章，只重新生成：{[i + 1 for i in stale]} ===")
+    else:
+        print(f"\n=== 正在生成初稿（共 {len(entries)} 章，并发 {concurrency}）===")
+    results: List[Optional[Dict]] = list(reused)
+    if stale:
+        configurable = (config or {}).get("configurable") or {}
+        thread_id = configurable.get("thread_id")
+        journal = DraftJournal(checkpoint_path(), thread_id) if thread_id else None
+        builder = PromptBuilder(format_concept(state['concept']), state['outline'])
+        try:
+            # 前文按新大纲的位置排列：沿用的章节取自已有正文，需要重新生成的位置为空
+            context = StoryContext.from_dict(state.get('story_context'))
+            previous_chapters = project_store.PartialChapters(current.root, list(reused))
+            with prompt_builder.project(os.path.basename(current.root), builder):
+                drafted = llm_client.run(_draft_chapters(state['concept'], state['outline'], entries,
+                                                         concurrency, retries, journal,
+                                                         context, previous_chapters, _open_retriever(state),
+                                                         indices=stale,
+                                                         on_chapter=lambda i, text: store.write_chapter(text),
+                                                         builder=builder,
+                                                         stream=bool(configurable.get("stream_chapters"))))
+        finally:
+            if journal is not None:
+                journal.close()
+        for i in stale:
+            results[i] = drafted[i]
+
+    state['failed_chapters'] = [i + 1 for i, entry in enumerate(results) if entry is None]
+    state['chapters'] = ChapterHandle(current.root, [entry or store.write_chapter("") for entry in results])
+    state['total_chapters'] = len(entries)
+    state['draft_content'] = ''
+    state['outline_tree'] = {"tree": tree.to_dict(), "chapters": chapter_records(tree, results)}
+    if state['failed_chapters']:
+        print(f"以下章节生成失败，可稍后单独重新生成：{state['failed_chapters']}")
     return state
 
 def modify_outline(state: NovelState) -> NovelState:
-    """修改小说大纲"""
-    # TODO: 实现大纲修改逻辑
+    """修改小说大纲
+
+    修改要求取自 user_feedback，大纲按行交给模型，只返回针对具体行的编辑操作（见 content_patch）。
+    修改后回到初稿节点，由大纲树比较各章输入，只重新生成受影响的章节。
+    无论修改是否成功都会清空 user_feedback 与 current_section，保存后不会再次进入本节点。
+    """
+    instruction = state.get('user_feedback')
+    state['user_feedback'] = ''
+    state['current_section'] = ''
+    outline = state.get('outline') or ''
+    if not outline:
+        print("还没有可修改的大纲")
+        return state
+    instruction = instruction or input_provider.ask("请说明需要修改的大纲内容：")
+    background = f"小说概念：\n{format_concept(state['concept'])}" if state.get('concept') else ""
+
+    try:
+        outline, edits = content_patch.revise(outline, instruction, background, subject="小说大纲")
+    except Exception as e:
+        print(f"大纲修改失败：{str(e)}")
+        return state
+
+    print(f"\n=== 已修改大纲（{len(edits)} 处编辑）===")
+    print(outline)
+    state['outline'] = outline
     return state
 
 def modify_content(state: NovelState) -> NovelState:
-    """修改小说内容"""
-    # TODO: 实现内容修改逻辑
+    """修改小说内容
+
+    只把目标章节按段落编号后交给模型，模型返回针对具体段落的编辑操作，在本地校验并应用，
+    输出 token 只与改动规模相关。修改要求取自 user_feedback，目标章节取自 current_chapter（从 1 开始）。
+    无论修改是否成功都会清空 user_feedback，保存后不会再次进入本节点。
+    """
+    instruction = state.get('user_feedback')
+    state['user_feedback'] = ''
+    chapters = chapter_handle(state)
+    if not chapters:
+        print("还没有可修改的章节")
+        return state
+    instruction = instruction or input_provider.ask("请说明需要修改的内容：")
+    index = min(max(state.get('current_chapter') or 1, 1), len(chapters)) - 1
+
+    # 与初稿请求相同的固定前缀（概念与大纲），修改时也能命中服务端缓存
+    builder = PromptBuilder(format_concept(state['concept']), state.get('outline', '')) if state.get('concept') else None
+    background = ""
+    retriever = _open_retriever(state)
+    if retriever is not None:
+        passages = retriever.search(instruction, int(os.getenv("NOVEL_RETRIEVAL_K", "3")),
+                                    exclude_positions=[index + 1])
+        background = retrieval_index.format_passages(passages)
+
+    try:
+        with prompt_builder.project(os.path.basename(chapters.root), builder):
+            text, edits = content_patch.revise(chapters[index], instruction, background, builder=builder)
+    except Exception as e:
+        print(f"修改失败：{str(e)}")
+        return state
+
+    print(f"已修改第 {index + 1} 章（{len(edits)} 处编辑）")
+    emit_event("chapter", chapter=index + 1, total=len(chapters), text=text)
+    state['chapters'] = chapters.replace(index, project_store.get_store(chapters.root).write_chapter(text))
+    state['draft_content'] = ''
     return state
 
 def should_continue(state: NovelState) -> str:
-    """决定下一步操作"""
-    # TODO: 实现决策逻辑
-    return "continue"
+    """保存后的下一步：有待处理的修改要求（user_feedback）时按 current_section 修改大纲或内容，
+    修改大纲后重新生成受影响的章节，修改内容后再次保存；否则结束"""
+    if (state.get('user_feedback') or '').strip():
+        return "modify_outline" if state.get('current_section') == "outline" else "modify_content"
+    return "completed"
 
-def generate_concept_with_ai(state: ConceptState) -> ConceptState:
-    """使用 AI 生成小说概念"""
-    print("\n=== AI 正在生成小说概念 ===")
+# 概念文本中单行字段的前缀与对应属性
+CONCEPT_LINE_FIELDS = {
+    '标题：': 'title',
+    '类型：': 'genre',
+    '主题：': 'logline',
+    '目标读者：': 'target_audience',
+    '背景设定：': 'setting',
+    '写作风格：': 'style_and_tone',
+}
+
+# 概念文本的结束标记：补充说明可能有多行，只有看到它才能确定输出已完整、可以提前关闭流
+CONCEPT_END = "【概念结束】"
+
+class ConceptStreamParser:
+    """小说概念的增量解析器
+
+    按块喂入模型输出，每当一行完整时立即解析并填充 NovelConcept 的对应字段，
+    同时通过 on_field(标签, 值) 回调通知调用方。列表字段（人物、情节点）在 close() 时写回。
+    补充说明可以有多行，在遇到结束标记 CONCEPT_END 或 close() 时整体通知。
+    """
+
+    def __init__(self, concept: NovelConcept, on_field=None, max_unrecognized: int = 5):
+        self.concept = concept
+        self.on_field = on_field
+        self.max_unrecognized = max_unrecognized
+        self.section = ""
+        self.characters: List[Dict] = []  # 临时存储人物列表
+        self.plot_points: List[str] = []  # 临时存储情节点列表
+        self.seen = set()  # 已解析到的字段标签
+        self.unrecognized = 0  # 连续无法识别的行数
+        self.done = False  # 已遇到结束标记，输出完整
+        self.broken = False  # 输出明显偏离约定格式
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> None:
+        """喂入一段文本，解析其中所有已完整的行"""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split('\n')
+        for line in lines:
+            self._parse_line(line)
+
+    def close(self) -> NovelConcept:
+        """解析剩余的不完整行并写回列表字段（已完成时丢弃结束标记之后的内容）"""
+        if self._buffer and not self.done:
+            self._parse_line(self._buffer)
+            self._buffer = ""
+        self._end_notes()
+        self.concept.main_characters = self.characters
+        self.concept.key_plot_points = self.plot_points
+        return self.concept
 
-    # 构建提示词
-    prompt = """请帮我生成一个完整的小说概念，包括以下要素：
+    def _emit(self, label: str, value) -> None:
+        self.seen.add(label)
+        if self.on_field:
+            self.on_field(label, value)
+
+    def _end_notes(self) -> None:
+        if self.section == 'notes':
+            self.section = ""
+            self._emit('补充说明', self.concept.additional_notes)
+
+    def _parse_line(self, line: str) -> None:
+        line = line.strip()
+        if not line or self.done:
+            return
+        if line == CONCEPT_END:
+            self._end_notes()
+            self.done = True
+            return
+
+        recognized = True
+        concept = self.concept
+        prefix = next((p for p in CONCEPT_LINE_FIELDS if line.startswith(p)), None)
+        if prefix:
+            value = line[len(prefix):].strip()
+            setattr(concept, CONCEPT_LINE_FIELDS[prefix], value)
+            self._end_notes()
+            self._emit(prefix[:-1], value)
+        elif line.startswith('预计字数：'):
+            try:
+                concept.word_count_target = int(''.join(filter(str.isdigit, line[5:].strip())))
+            except ValueError:
+                concept.word_count_target = 50000  # 默认值
+            self._end_notes()
+            self._emit('预计字数', concept.word_count_target)
+        elif line == '主要人物：':
+            self._end_notes()
+            self.section = 'characters'
+        elif line == '关键情节点：':
+            self._end_notes()
+            self.section = 'plot'
+        elif line.startswith('补充说明：'):
+            self.section = 'notes'
+            concept.additional_notes = line[5:].strip()  # 补充说明的第一行，其余行在下面追加
+        elif self.section == 'characters' and ' - ' in line and '：' in line:
+            try:
+                parts = line.split('：', 1)
+                name_role = parts[0].strip()
+                traits = parts[1].strip() if len(parts) > 1 else ""
+                name, role = name_role.split(' - ', 1)
+                character = {"name": name.strip(), "role": role.strip(), "traits": traits}
+                self.characters.append(character)
+                self._emit('主要人物', character)
+            except ValueError:
+                recognized = False  # 忽略格式不符的行
+        elif self.section == 'plot' and line.startswith('- '):
+            self.plot_points.append(line[2:].strip())
+            self._emit('关键情节点', self.plot_points[-1])
+        elif self.section == 'notes':
+            concept.additional_notes = '\n'.join(part for part in (concept.additional_notes, line) if part)
+        else:
+            recognized = False
+
+        if recognized:
+            self.unrecognized = 0
+        else:
+            self.unrecognized += 1
+            if self.unrecognized > self.max_unrecognized:
+                self.broken = True
+
+CONCEPT_PROMPT = f"""请帮我生成一个完整的小说概念，包括以下要素：
 1. 标题
 2. 类型（如：奇幻、科幻、言情等）
 3. 主要主题
@@ -97,7 +551,8 @@ def generate_concept_with_ai(state: ConceptState) -> ConceptState:
 9. 关键情节点（至少5个）
 10. 其他补充说明
 
-请严格按照以下格式输出，确保每个字段都有对应的值，即使没有也用占位符表示（如：补充说明：无）：
+请严格按照以下格式输出，确保每个字段都有对应的值，即使没有也用占位符表示（如：补充说明：无），
+全部输出完后单独一行输出 {CONCEPT_END}：
 标题：[标题]
 类型：[类型]
 主题：[主题]
@@ -120,104 +575,174 @@ def generate_concept_with_ai(state: ConceptState) -> ConceptState:
 - [情节点5]
 （如果少于5个，列出所有情节点）
 
-补充说明：[补充说明]
+补充说明：[补充说明，可以有多行]
+{CONCEPT_END}
+"""
+
+def concept_messages() -> List[Dict]:
+    """生成小说概念的对话消息"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": CONCEPT_PROMPT}
+    ]
+
+CONCEPT_JSON_PROMPT = """请帮我生成一个完整的小说概念，只输出一个 JSON 对象，字段如下：
+{
+  "title": "标题",
+  "genre": "类型（如：奇幻、科幻、言情等）",
+  "logline": "一句话概括故事主题",
+  "target_audience": "目标读者群体",
+  "setting": "故事背景设定",
+  "style_and_tone": "写作风格",
+  "word_count_target": 预计字数（整数）,
+  "main_characters": [{"name": "姓名", "role": "角色", "traits": "特点"}],
+  "key_plot_points": ["情节点"],
+  "additional_notes": "补充说明，没有时填“无”"
+}
+主要人物至少 3 个，关键情节点至少 5 个。
 """
 
+# 结构化输出中必须给出的字段，以及比 NovelConcept 更严格的字段校验类型
+CONCEPT_REQUIRED_FIELDS = ("title", "genre", "logline", "target_audience", "setting",
+                           "style_and_tone", "word_count_target", "main_characters", "key_plot_points")
+CONCEPT_FIELD_TYPES = {"main_characters": List[ConceptCharacter]}
+
+def concept_json_messages() -> List[Dict]:
+    """以 JSON 模式生成小说概念的对话消息"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": CONCEPT_JSON_PROMPT}
+    ]
+
+def generate_structured_concept() -> Tuple[NovelConcept, Dict[str, str]]:
+    """以 JSON 模式生成概念并逐字段校验，只对不合法的字段发起修复请求
+
+    返回 (概念, 修复后仍不合法的字段及原因)。
+    """
+    return structured_output.generate_model(NovelConcept, concept_json_messages(),
+                                            required=CONCEPT_REQUIRED_FIELDS, types=CONCEPT_FIELD_TYPES,
+                                            task="concept")
+
+def parse_concept(text: str) -> NovelConcept:
+    """把按约定格式输出的概念文本解析为新的 NovelConcept"""
+    parser = ConceptStreamParser(NovelConcept())
+    parser.feed(text)
+    return parser.close()
+
+def _concept_fingerprint(concept: NovelConcept) -> str:
+    """用于去重的概念文本：标题、一句话概括与关键情节"""
+    return '\n'.join([concept.title, concept.logline, *concept.key_plot_points])
+
+async def agenerate_concepts(n: int, concurrency: int = 8,
+                             threshold: float = 0.6) -> AsyncIterator[NovelConcept]:
+    """并发生成 n 个候选概念，按完成顺序逐个产出，与已产出概念近似重复的会被丢弃
+
+    每个请求带不同的 seed，既让模型给出不同的候选，也避免响应缓存把它们当成同一请求。
+    单个请求失败只跳过该候选。
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    seen = near_duplicates.NearDuplicateFilter(threshold)
+
+    async def generate(seed: int) -> Optional[NovelConcept]:
+        try:
+            async with semaphore:
+                response = await llm_client.achat_completion(concept_messages(), task="concept", seed=seed)
+        except Exception as e:
+            print(f"第 {seed + 1} 个候选概念生成出错：{str(e)}")
+            return None
+        content = response.choices[0].message.content if response.choices else ""
+        concept = parse_concept(content or "")
+        return concept if concept.title else None
+
+    for future in asyncio.as_completed([generate(i) for i in range(n)]):
+        concept = await future
+        if concept is not None and seen.add(_concept_fingerprint(concept)):
+            yield concept
+
+def generate_concepts(n: int, concurrency: int = 8, threshold: float = 0.6) -> List[NovelConcept]:
+    """批量生成候选概念，返回去重后的列表（见 agenerate_concepts）"""
+    async def collect() -> List[NovelConcept]:
+        return [concept async for concept in agenerate_concepts(n, concurrency, threshold)]
+    return llm_client.run(collect())
+
+def _print_concept_field(label: str, value) -> None:
+    """流式生成时即时展示已解析的字段"""
+    if isinstance(value, dict):
+        print(f"{label}：{value['name']}（{value['role']}）：{value['traits']}")
+    else:
+        print(f"{label}：{value}")
+    emit_event("concept_field", label=label, value=value)
+
+def generate_concept_with_ai(state: ConceptState, stream: Optional[bool] = None,
+                             structured: Optional[bool] = None) -> ConceptState:
+    """使用 AI 生成小说概念
+
+    stream 为 True 时以流式方式调用模型，边接收边解析；为 None 时读取环境变量 QWEN_STREAM。
+    非流式时默认使用结构化输出（JSON 模式 + 逐字段修复），structured 为 None 时读取 QWEN_STRUCTURED_OUTPUT。
+    生成失败时 state['user_input'] 以 "AI生成" 开头记录原因，由调用方决定重试或改为手动输入。
+    """
+    print("\n=== AI 正在生成小说概念 ===")
+
+    if stream is None:
+        stream = os.getenv("QWEN_STREAM", "false").lower() in ("1", "true", "yes")
+    if structured is None:
+        structured = os.getenv("QWEN_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+
     try:
-        # 使用 OpenAI 兼容模式调用 Qwen 模型
-        client = openai.OpenAI(
-            api_key=os.getenv("QWEN_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
-
-        response = client.chat.completions.create(
-            model=os.getenv("QWEN_MODEL_NAME", "qwen3-235b-a22b"),
-            messages=[
-                {"role": "system", "content": "你是一个善于创作小说的AI助手。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=float(os.getenv("QWEN_TEMPERATURE", "0.7")),
-            max_tokens=int(os.getenv("QWEN_MAX_TOKENS", "2048")),
-            extra_body={"enable_thinking": False},
-        )
-
-        if response.choices and response.choices[0].message.content:
-            # 解析 AI 生成的文本
-            generated_text = response.choices[0].message.content
-            lines = generated_text.split('\n')
-
-            concept = state['concept']
-            current_section = ""
-            temp_characters = [] # 临时存储人物列表
-            temp_plot_points = [] # 临时存储情节点列表
-
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-
-                if line.startswith('标题：'):
-                    concept.title = line[3:].strip()
-                elif line.startswith('类型：'):
-                    concept.genre = line[3:].strip()
-                elif line.startswith('主题：'):
-                    concept.logline = line[3:].strip()
-                elif line.startswith('目标读者：'):
-                    concept.target_audience = line[5:].strip()
-                elif line.startswith('背景设定：'):
-                    concept.setting = line[5:].strip()
-                elif line.startswith('写作风格：'):
-                    concept.style_and_tone = line[5:].strip()
-                elif line.startswith('预计字数：'):
-                    try:
-                        concept.word_count_target = int(''.join(filter(str.isdigit, line[5:].strip())))
-                    except ValueError:
-                        concept.word_count_target = 50000  # 默认值
-                elif line == '主要人物：':
-                    current_section = 'characters'
-                elif line == '关键情节点：':
-                    current_section = 'plot'
-                elif line.startswith('补充说明：'):
-                    current_section = 'notes'
-                    concept.additional_notes = line[5:].strip() # 直接获取补充说明的第一行
-                elif current_section == 'characters' and ' - ' in line and '：' in line:
-                     try:
-                         parts = line.split('：', 1)
-                         name_role = parts[0].strip()
-                         traits = parts[1].strip() if len(parts) > 1 else ""
-                         name, role = name_role.split(' - ', 1)
-                         temp_characters.append({
-                             "name": name.strip(),
-                             "role": role.strip(),
-                             "traits": traits
-                         })
-                     except ValueError:
-                         continue # 忽略格式不符的行
-                elif current_section == 'plot' and line.startswith('- '):
-                    temp_plot_points.append(line[2:].strip())
-                elif current_section == 'notes':
-                     concept.additional_notes += '\n' + line # 追加补充说明的其他行
-
-            # 更新列表字段
-            concept.main_characters = temp_characters
-            concept.key_plot_points = temp_plot_points
+        # 通过共享客户端以 OpenAI 兼容模式调用 Qwen 模型
+        messages = concept_messages()
 
+        concept = state['concept']
+        if stream:
+            # 流式模式：每收到一段就送入增量解析器，字段一旦完整立即展示
+            parser = ConceptStreamParser(concept, on_field=_print_concept_field)
+            response = llm_client.chat_completion(messages, task="concept", stream=True)
+            try:
+                for chunk in response:
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    parser.feed(chunk.choices[0].delta.content)
+                    if parser.done or parser.broken:
+                        # 已输出结束标记或输出格式已乱，提前结束以免为多余 token 付费
+                        break
+            finally:
+                # 已读到结束标记时收到的内容即完整概念，照常写入响应缓存
+                response.close(complete=parser.done and not parser.broken)
+            parser.close()
+            generated = bool(concept.title) and not parser.broken
+        elif structured:
+            # 结构化模式：部分字段不合法时只修复这些字段，已生成的内容不会丢弃
+            result, invalid = generate_structured_concept()
+            for name in NovelConcept.model_fields:
+                setattr(concept, name, getattr(result, name))
+            generated = bool(concept.title)
+            if generated and invalid:
+                print(f"以下字段修复后仍不完整，可在确认环节手动修改：{'、'.join(invalid)}")
+        else:
+            response = llm_client.chat_completion(messages, task="concept")
+            generated = bool(response.choices and response.choices[0].message.content)
+            if generated:
+                # 解析 AI 生成的文本
+                parser = ConceptStreamParser(concept)
+                parser.feed(response.choices[0].message.content)
+                parser.close()
+
+        if generated:
             print("AI 已生成小说概念，请查看并确认。")
         else:
-            print("AI 生成失败，请手动输入小说概念。")
-            # 恢复到手动输入流程
+            print("AI 生成失败。")
             state['user_input'] = "AI生成失败"
-            return collect_initial_concept(state)
 
     except Exception as e:
         print(f"AI 生成出错：{str(e)}")
-        print("请手动输入小说概念。")
-        # 恢复到手动输入流程
         state['user_input'] = f"AI生成出错：{str(e)}"
-        return collect_initial_concept(state)
 
     return state
 
+def _concept_attempts() -> int:
+    """AI 生成概念的最多尝试次数（环境变量 NOVEL_CONCEPT_ATTEMPTS，默认 3）"""
+    return max(1, int(os.getenv("NOVEL_CONCEPT_ATTEMPTS", "3")))
+
 def collect_initial_concept(state: ConceptState) -> ConceptState:
     """收集用户初始概念"""
     print("\n=== 小说概念收集 ===")
@@ -225,24 +750,34 @@ def collect_initial_concept(state: ConceptState) -> ConceptState:
     print("1. 手动输入")
     print("2. AI 自动生成")
     
-    choice = input("\n请选择（1-2）：")
-    
-    if choice == "2":
-        return generate_concept_with_ai(state)
+    attempts = 0
+    while input_provider.ask("\n请选择（1-2）：") == "2":
+        state['user_input'] = ""
+        state = generate_concept_with_ai(state)
+        if not state['user_input'].startswith("AI生成"):
+            return state
+        attempts += 1
+        if attempts >= _concept_attempts():
+            if input_provider.get_provider().unattended:
+                # 无人值守时没有人能改为手动输入，直接让任务失败
+                raise RuntimeError(f"AI 生成小说概念连续失败 {attempts} 次：{state['user_input']}")
+            print("AI 多次生成失败，请手动输入小说概念。")
+            break
+        print("请重新选择概念收集方式。")
     
     print("\n请回答以下问题来帮助我们理解您的小说构想：")
     
-    state['concept'].title = input("1. 小说的暂定标题是什么？")
-    state['concept'].genre = input("2. 您期望的小说类型是什么？（如：奇幻、科幻、言情等）")
-    state['concept'].logline = input("3. 故事的一句话概括是什么？")
-    state['concept'].target_audience = input("4. 目标读者群体是？")
-    state['concept'].setting = input("5. 故事发生的背景设定是？")
-    state['concept'].style_and_tone = input("6. 期望的写作风格是？（如：轻松、严肃、悬疑等）")
-    state['concept'].word_count_target = int(input("7. 预计字数目标是多少？"))
+    state['concept'].title = input_provider.ask("1. 小说的暂定标题是什么？")
+    state['concept'].genre = input_provider.ask("2. 您期望的小说类型是什么？（如：奇幻、科幻、言情等）")
+    state['concept'].logline = input_provider.ask("3. 故事的一句话概括是什么？")
+    state['concept'].target_audience = input_provider.ask("4. 目标读者群体是？")
+    state['concept'].setting = input_provider.ask("5. 故事发生的背景设定是？")
+    state['concept'].style_and_tone = input_provider.ask("6. 期望的写作风格是？（如：轻松、严肃、悬疑等）")
+    state['concept'].word_count_target = int(input_provider.ask("7. 预计字数目标是多少？"))
     
     print("\n8. 请描述主要人物（每行一个，格式：姓名,角色,特点）：")
     while True:
-        char_input = input("输入人物信息（直接回车结束）：")
+        char_input = input_provider.ask("输入人物信息（直接回车结束）：")
         if not char_input:
             break
         name, role, traits = char_input.split(',')
@@ -254,12 +789,12 @@ def collect_initial_concept(state: ConceptState) -> ConceptState:
     
     print("\n9. 请描述关键情节点（每行一个）：")
     while True:
-        plot_point = input("输入情节点（直接回车结束）：")
+        plot_point = input_provider.ask("输入情节点（直接回车结束）：")
         if not plot_point:
             break
         state['concept'].key_plot_points.append(plot_point)
     
-    state['user_input'] = input("\n10. 其他补充说明：")
+    state['user_input'] = input_provider.ask("\n10. 其他补充说明：")
     return state
 
 def summarize_concept(state: ConceptState) -> ConceptState:
@@ -284,7 +819,13 @@ def summarize_concept(state: ConceptState) -> ConceptState:
     
     if concept.additional_notes:
         print(f"\n补充说明：{concept.additional_notes}")
-    
+
+    emit_event("concept", concept=concept.model_dump())
+    if speculative_outline_enabled() and concept.title:
+        # 用户阅读总结时在后台生成大纲；以副本生成，之后对概念的修改不会影响它
+        snapshot = concept.model_copy(deep=True)
+        outline_prefetch.get_prefetcher().start(outline_prefetch.concept_hash(snapshot),
+                                                lambda: agenerate_outline(snapshot))
     return state
 
 def get_user_feedback(state: ConceptState) -> ConceptState:
@@ -295,14 +836,17 @@ def get_user_feedback(state: ConceptState) -> ConceptState:
     print("2. 需要修改")
     print("3. 重新开始")
     
-    choice = input("\n请选择（1-3）：")
+    choice = input_provider.ask("\n请选择（1-3）：")
+    if choice != "1" and speculative_outline_enabled():
+        # 概念将被修改或重新收集，按当前概念预取的大纲不会再用到
+        outline_prefetch.get_prefetcher().discard(outline_prefetch.concept_hash(state['concept']))
     
     if choice == "1":
         state['feedback_needed'] = False
         state['user_input'] = "用户确认概念"
     elif choice == "2":
         state['feedback_needed'] = True
-        state['user_input'] = input("请说明需要修改的部分：")
+        state['user_input'] = input_provider.ask("请说明需要修改的部分：")
     else:
         state['feedback_needed'] = True
         state['user_input'] = "重新开始"
@@ -328,23 +872,23 @@ def modify_concept(state: ConceptState) -> ConceptState:
     print("9. 关键情节点")
     print("10. 补充说明")
     
-    choice = input("\n请选择要修改的项目（1-10）：")
+    choice = input_provider.ask("\n请选择要修改的项目（1-10）：")
     concept = state['concept']
     
     if choice == "1":
-        concept.title = input("新的标题：")
+        concept.title = input_provider.ask("新的标题：")
     elif choice == "2":
-        concept.genre = input("新的类型：")
+        concept.genre = input_provider.ask("新的类型：")
     elif choice == "3":
-        concept.logline = input("新的主题：")
+        concept.logline = input_provider.ask("新的主题：")
     elif choice == "4":
-        concept.target_audience = input("新的目标读者：")
+        concept.target_audience = input_provider.ask("新的目标读者：")
     elif choice == "5":
-        concept.setting = input("新的背景设定：")
+        concept.setting = input_provider.ask("新的背景设定：")
     elif choice == "6":
-        concept.style_and_tone = input("新的写作风格：")
+        concept.style_and_tone = input_provider.ask("新的写作风格：")
     elif choice == "7":
-        concept.word_count_target = int(input("新的目标字数："))
+        concept.word_count_target = int(input_provider.ask("新的目标字数："))
     elif choice == "8":
         print("当前人物列表：")
         for i, char in enumerate(concept.main_characters, 1):
@@ -352,20 +896,20 @@ def modify_concept(state: ConceptState) -> ConceptState:
         print("\n1. 添加新人物")
         print("2. 修改现有人物")
         print("3. 删除人物")
-        sub_choice = input("请选择操作（1-3）：")
+        sub_choice = input_provider.ask("请选择操作（1-3）：")
         if sub_choice == "1":
-            name = input("姓名：")
-            role = input("角色：")
-            traits = input("特点：")
+            name = input_provider.ask("姓名：")
+            role = input_provider.ask("角色：")
+            traits = input_provider.ask("特点：")
             concept.main_characters.append({"name": name, "role": role, "traits": traits})
         elif sub_choice == "2":
-            idx = int(input("要修改的人物编号：")) - 1
+            idx = int(input_provider.ask("要修改的人物编号：")) - 1
             if 0 <= idx < len(concept.main_characters):
-                concept.main_characters[idx]["name"] = input("新的姓名：")
-                concept.main_characters[idx]["role"] = input("新的角色：")
-                concept.main_characters[idx]["traits"] = input("新的特点：")
+                concept.main_characters[idx]["name"] = input_provider.ask("新的姓名：")
+                concept.main_characters[idx]["role"] = input_provider.ask("新的角色：")
+                concept.main_characters[idx]["traits"] = input_provider.ask("新的特点：")
         elif sub_choice == "3":
-            idx = int(input("要删除的人物编号：")) - 1
+            idx = int(input_provider.ask("要删除的人物编号：")) - 1
             if 0 <= idx < len(concept.main_characters):
                 concept.main_characters.pop(idx)
     elif choice == "9":
@@ -375,19 +919,19 @@ def modify_concept(state: ConceptState) -> ConceptState:
         print("\n1. 添加新情节点")
         print("2. 修改现有情节点")
         print("3. 删除情节点")
-        sub_choice = input("请选择操作（1-3）：")
+        sub_choice = input_provider.ask("请选择操作（1-3）：")
         if sub_choice == "1":
-            concept.key_plot_points.append(input("新的情节点："))
+            concept.key_plot_points.append(input_provider.ask("新的情节点："))
         elif sub_choice == "2":
-            idx = int(input("要修改的情节点编号：")) - 1
+            idx = int(input_provider.ask("要修改的情节点编号：")) - 1
             if 0 <= idx < len(concept.key_plot_points):
-                concept.key_plot_points[idx] = input("新的情节点：")
+                concept.key_plot_points[idx] = input_provider.ask("新的情节点：")
         elif sub_choice == "3":
-            idx = int(input("要删除的情节点编号：")) - 1
+            idx = int(input_provider.ask("要删除的情节点编号：")) - 1
             if 0 <= idx < len(concept.key_plot_points):
                 concept.key_plot_points.pop(idx)
     elif choice == "10":
-        concept.additional_notes = input("新的补充说明：")
+        concept.additional_notes = input_provider.ask("新的补充说明：")
     
     return state
 
@@ -398,24 +942,24 @@ def should_continue_concept(state: ConceptState) -> str:
     return "confirmed"
 
 # 创建工作流图
-def create_novel_workflow() -> StateGraph:
+def create_novel_workflow() -> "StateGraph":
     """创建小说创作工作流"""
+    from langgraph.graph import StateGraph, END
+
     workflow = StateGraph(NovelState)
     
     # 添加节点
-    workflow.add_node("discuss_outline", discuss_outline)
-    workflow.add_node("create_draft", create_initial_draft)
-    workflow.add_node("save", save_draft)
-    workflow.add_node("modify_outline", modify_outline)
-    workflow.add_node("modify_content", modify_content)
-    workflow.add_node("should_continue", should_continue)
+    workflow.add_node("discuss_outline", tracing.traced("discuss_outline", "node")(discuss_outline))
+    workflow.add_node("create_draft", tracing.traced("create_draft", "node")(create_initial_draft))
+    workflow.add_node("save", tracing.traced("save", "node")(save_novel))
+    workflow.add_node("modify_outline", tracing.traced("modify_outline", "node")(modify_outline))
+    workflow.add_node("modify_content", tracing.traced("modify_content", "node")(modify_content))
     
     # 设置边
     workflow.add_edge("discuss_outline", "create_draft")
     workflow.add_edge("create_draft", "save")
-    workflow.add_edge("save", "should_continue")
     workflow.add_conditional_edges(
-        "should_continue",
+        "save",
         should_continue,
         {
             "modify_outline": "modify_outline",
@@ -431,29 +975,36 @@ def create_novel_workflow() -> StateGraph:
     
     return workflow
 
-def create_concept_workflow() -> StateGraph:
+def create_concept_workflow() -> "StateGraph":
     """创建概念收集工作流"""
+    from langgraph.graph import StateGraph, END
+
     workflow = StateGraph(ConceptState)
     
     # 添加节点
-    workflow.add_node("collect_concept", collect_initial_concept)
-    workflow.add_node("summarize", summarize_concept)
-    workflow.add_node("get_feedback", get_user_feedback)
-    workflow.add_node("modify", modify_concept)
-    workflow.add_node("should_continue", should_continue_concept)
+    workflow.add_node("collect_concept", tracing.traced("collect_concept", "node")(collect_initial_concept))
+    workflow.add_node("summarize", tracing.traced("summarize", "node")(summarize_concept))
+    workflow.add_node("get_feedback", tracing.traced("get_feedback", "node")(get_user_feedback))
+    workflow.add_node("modify", tracing.traced("modify", "node")(modify_concept))
     
     # 设置边
     workflow.add_edge("collect_concept", "summarize")
-    workflow.add_edge("summarize", "should_continue")
     workflow.add_conditional_edges(
-        "should_continue",
+        "summarize",
         should_continue_concept,
         {
             "need_feedback": "get_feedback",
             "confirmed": END # 使用END表示终止
         }
     )
-    workflow.add_edge("get_feedback", "modify")
+    workflow.add_conditional_edges(
+        "get_feedback",
+        should_continue_concept,
+        {
+            "need_feedback": "modify",
+            "confirmed": END
+        }
+    )
     workflow.add_edge("modify", "summarize")
     
     # 设置入口
@@ -461,57 +1012,283 @@ def create_concept_workflow() -> StateGraph:
     
     return workflow
 
+@functools.lru_cache(maxsize=None)
+def _compiled(factory):
+    return factory().compile()
+
+def get_novel_graph(checkpointer=None):
+    """编译后的小说工作流，首次使用时编译并在进程内复用；指定 checkpointer 时返回绑定它的副本"""
+    graph = _compiled(create_novel_workflow)
+    return graph.copy(update={"checkpointer": checkpointer}) if checkpointer is not None else graph
+
+def get_concept_graph(checkpointer=None):
+    """编译后的概念收集工作流，复用方式同 get_novel_graph"""
+    graph = _compiled(create_concept_workflow)
+    return graph.copy(update={"checkpointer": checkpointer}) if checkpointer is not None else graph
+
+def retrieval_enabled() -> bool:
+    """是否维护章节检索索引（NOVEL_RETRIEVAL，默认开启）"""
+    return os.getenv("NOVEL_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+
+def versioning_enabled() -> bool:
+    """是否在保存时记录版本历史（NOVEL_VERSIONING，默认开启）"""
+    return os.getenv("NOVEL_VERSIONING", "true").lower() in ("1", "true", "yes")
+
+@tracing.traced("save_concept", "save")
 def save_concept(concept: NovelConcept) -> str:
     """保存小说概念到文件"""
     # 确保工作目录存在
     working_dir = os.getenv("NOVEL_WORKING_DIR", "./novels")
     os.makedirs(working_dir, exist_ok=True)
     
-    # 生成文件名
-    filename = f"{concept.title}_concept.txt"
+    # 生成文件名；概念文件、项目索引与项目目录使用同一个标题
+    title = project_store.project_title(concept.title)
+    filename = f"{title}{project_catalog.CONCEPT_SUFFIX}"
     filepath = os.path.join(working_dir, filename)
     
-    # 写入文件
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(f"标题：{concept.title}\n")
-        f.write(f"类型：{concept.genre}\n")
-        f.write(f"目标读者：{concept.target_audience}\n")
-        f.write(f"背景设定：{concept.setting}\n")
-        f.write(f"写作风格：{concept.style_and_tone}\n")
-        f.write(f"目标字数：{concept.word_count_target}\n\n")
-        
-        f.write("主要人物：\n")
-        for character in concept.main_characters:
-            f.write(f"- {character['name']}：{character['description']}\n")
-        
-        f.write("\n关键情节点：\n")
-        for point in concept.key_plot_points:
-            f.write(f"- {point}\n")
-        
-        if concept.additional_notes:
-            f.write(f"\n补充说明：{concept.additional_notes}\n")
-    
+    # 生成文件内容
+    lines = [
+        f"标题：{concept.title}",
+        f"类型：{concept.genre}",
+        f"目标读者：{concept.target_audience}",
+        f"背景设定：{concept.setting}",
+        f"写作风格：{concept.style_and_tone}",
+        f"目标字数：{concept.word_count_target}",
+        "",
+        "主要人物：",
+    ]
+    for character in concept.main_characters:
+        lines.append(f"- {character['name']}：{character.get('description', character.get('traits', ''))}")
+    lines += ["", "关键情节点："]
+    lines += [f"- {point}" for point in concept.key_plot_points]
+    if concept.additional_notes:
+        lines += ["", f"补充说明：{concept.additional_notes}"]
+    text = '\n'.join(lines) + '\n'
+
+    # 写入文件并更新项目索引，再记录一个概念修订
+    project_store.atomic_write(filepath, text)
+    project_catalog.get_catalog(working_dir).record_concept(title, concept.genre,
+                                                            concept.word_count_target, filepath)
+    if versioning_enabled():
+        version_store.get_version_store(project_store.project_dir(working_dir, title)).commit("concept", text)
+
     print(f"小说概念已保存到：{filepath}")
     return filepath
 
+@tracing.traced("save_draft", "save")
 def save_draft(state: NovelState) -> str:
-    """保存小说草稿到文件"""
+    """保存小说草稿到项目目录
+
+    大纲与各章分文件保存，只写入有改动的章节，返回项目目录路径。
+    """
     # 确保工作目录存在
-    working_dir = os.getenv("NOVEL_WORKING_DIR", "./novels")
+    working_dir = state.get('working_dir') or os.getenv("NOVEL_WORKING_DIR", "./novels")
     os.makedirs(working_dir, exist_ok=True)
-    
-    # 生成文件名
-    filename = f"{state['concept'].title}_draft.txt"
-    filepath = os.path.join(working_dir, filename)
-    
-    # 写入文件
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(f"=== {state['concept'].title} ===\n\n")
-        f.write(f"大纲：\n{state['outline']}\n\n")
-        f.write(f"内容：\n{state['draft_content']}\n")
-        
-    print(f"小说草稿已保存到：{filepath}")
-    return filepath
+
+    title = project_store.project_title(state['concept'].title if state.get('concept') else state.get('project_name', ''))
+    directory = project_store.project_dir(working_dir, title)
+    store = project_store.get_store(directory)
+    store.set_title(title)
+    store.set_outline(state.get('outline', ''))
+    chapters = state.get('chapters')
+    if isinstance(chapters, ChapterHandle) and chapters.root == store.root:
+        # 章节已在生成时写入项目目录，只需让 manifest 引用它们
+        store.set_entries(chapters.entries)
+    else:
+        if not chapters:
+            content = state.get('draft_content') or state.get('content') or ''
+            chapters = [content] if content else []
+        store.set_chapters(list(chapters))
+    written = store.flush()
+    project_catalog.get_catalog(working_dir).record_draft(directory)
+    if written and versioning_enabled():
+        # 每章按位置单独记录修订，修订说明记下来源的章节文件；该位置仍是同一文件且本次未写入时不读取正文。
+        # 草稿修订只记录各章的修订 ID，可用 get_draft / restore_draft / diff_draft 按整本书读取、恢复与比较
+        versions = version_store.get_version_store(directory)
+        versions.commit("outline", store.read_outline())
+        written_paths = set(written)
+        revisions = []
+        for i, chapter_id in enumerate(store.chapter_ids):
+            doc = version_store.chapter_doc(i)
+            source = f"章节文件 {chapter_id}"
+            latest = versions.list(doc, limit=1)
+            if latest and latest[0].message == source and store.chapter_path(chapter_id) not in written_paths:
+                revisions.append(latest[0].id)
+            else:
+                revisions.append(versions.commit(doc, store.read_chapter(i), source) or versions.latest(doc))
+        versions.commit(version_store.DRAFT_DOC, json.dumps(revisions))
+    if written and store.chapter_count and retrieval_enabled():
+        # 只重建内容有变化的章节的索引，其余章节不读取正文
+        hashes = [entry["hash"] for entry in store.manifest["chapters"]]
+        readers = [(chapter_id, functools.partial(store.read_chapter, i))
+                   for i, chapter_id in enumerate(store.chapter_ids)]
+        retrieval_index.get_index(directory).sync(readers, hashes)
+
+    print(f"小说草稿已保存到：{directory}（写入 {len(written)} 个文件）")
+    return directory
+
+def summaries_enabled() -> bool:
+    """是否在保存时维护章节摘要（NOVEL_SUMMARIES，默认开启）"""
+    return os.getenv("NOVEL_SUMMARIES", "true").lower() in ("1", "true", "yes")
+
+# 项目目录中大纲树（含各章生成记录）与章节摘要的文件名
+OUTLINE_TREE_FILE = "outline_tree.json"
+CONTEXT_FILE = "context.json"
+
+def save_novel(state: NovelState) -> NovelState:
+    """工作流中的保存节点：保存草稿并记录保存路径，同时增量更新章节摘要"""
+    state['save_path'] = save_draft(state)
+    if state.get('outline_tree'):
+        project_store.atomic_write(os.path.join(state['save_path'], OUTLINE_TREE_FILE),
+                                   json.dumps(state['outline_tree'], ensure_ascii=False, indent=2))
+    chapters = state['chapters'] = project_store.get_store(state['save_path']).handle()
+    if chapters and summaries_enabled():
+        context = StoryContext.from_dict(state.get('story_context'))
+        concurrency = int(os.getenv("NOVEL_DRAFT_CONCURRENCY", "4"))
+        try:
+            updated = llm_client.run(context.update(chapters, concurrency=concurrency, hashes=chapters.hashes))
+        except Exception as e:
+            # 草稿已保存，摘要更新失败时沿用上次的摘要，下次保存会重新处理这些章节
+            print(f"章节摘要更新失败，沿用上次的摘要：{str(e)}")
+            return state
+        state['story_context'] = context.to_dict()
+        if updated:
+            project_store.atomic_write(os.path.join(state['save_path'], CONTEXT_FILE),
+                                       json.dumps(state['story_context'], ensure_ascii=False, indent=2))
+    return state
+
+def checkpoint_path() -> str:
+    """检查点数据库路径（NOVEL_CHECKPOINT_DB，默认在工作目录下）"""
+    working_dir = os.getenv("NOVEL_WORKING_DIR", "./novels")
+    return os.getenv("NOVEL_CHECKPOINT_DB", os.path.join(working_dir, ".checkpoints.sqlite"))
+
+def open_checkpointer(path: Optional[str] = None):
+    """打开本地 SQLite 检查点存储，工作流每完成一个节点都会持久化状态"""
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    path = path or checkpoint_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    serde = JsonPlusSerializer(allowed_msgpack_modules=[(NovelConcept.__module__, "NovelConcept"),
+                                                        (ChapterHandle.__module__, "ChapterHandle")])
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False), serde=serde)
+
+class DraftJournal:
+    """按项目记录已生成的章节正文
+
+    初稿节点整体完成前被中断时，检查点里还没有它的输出；重新运行该节点时从这里取回已完成的章节。
+    """
+
+    def __init__(self, path: str, thread_id: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.thread_id = thread_id
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS draft_journal ("
+                " thread_id TEXT NOT NULL, key TEXT NOT NULL, text TEXT NOT NULL,"
+                " PRIMARY KEY (thread_id, key))"
+            )
+
+    @staticmethod
+    def key(messages: List[Dict]) -> str:
+        return hashlib.sha256(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT text FROM draft_journal WHERE thread_id = ? AND key = ?", (self.thread_id, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, text: str) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO draft_journal (thread_id, key, text) VALUES (?, ?, ?)",
+                (self.thread_id, key, text),
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+def _resume_or_invoke(graph, state: Optional[Dict], config: Dict, resume: bool) -> Dict:
+    """有检查点时从上次完成的节点继续，否则从头运行"""
+    if resume:
+        snapshot = graph.get_state(config)
+        if snapshot.values:
+            return graph.invoke(None, config) if snapshot.next else snapshot.values
+    return graph.invoke(state, config)
+
+def reopen_project(state: NovelState) -> NovelState:
+    """项目目录中已有保存的草稿时，把大纲、章节句柄、大纲树与章节摘要载入状态
+
+    重新打开的项目修改大纲后只重新生成受影响的章节，未改动章节的正文与摘要直接沿用。
+    状态中已有的大纲（调用方指定的新大纲）不会被覆盖。
+    """
+    store = _project_store(state)
+    if not store.chapter_count:
+        return state
+    state['outline'] = state.get('outline') or store.read_outline()
+    state['chapters'] = store.handle()
+    state['total_chapters'] = store.chapter_count
+    state['mode'] = 'edit'
+    for key, filename in (('outline_tree', OUTLINE_TREE_FILE), ('story_context', CONTEXT_FILE)):
+        path = os.path.join(store.root, filename)
+        if not state.get(key) and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                state[key] = json.load(f)
+    return state
+
+def initial_novel_state(concept: NovelConcept, outline: str = "", working_dir: str = "") -> Dict:
+    """小说工作流的初始状态，项目已保存过草稿时载入已有内容（见 reopen_project）"""
+    state = {
+        'concept': concept,
+        'outline': outline,
+        'draft_content': '',
+        'current_section': '',
+        'save_path': '',
+        'user_feedback': ''
+    }
+    if working_dir:
+        state['working_dir'] = working_dir
+    return reopen_project(state)
+
+def run_workflows(project_id: str, resume: bool = False, concept: Optional[NovelConcept] = None,
+                  outline: str = "", working_dir: str = "", checkpointer=None) -> Optional[Dict]:
+    """以持久化检查点依次运行概念与小说工作流，返回小说工作流的结果
+
+    提供 concept 时跳过概念工作流；outline 与 working_dir 作为小说工作流的初始大纲与工作目录。
+    未提供 checkpointer 时打开一个，运行结束后关闭；批量运行时可传入共享的检查点存储。
+    """
+    if checkpointer is None:
+        checkpointer = open_checkpointer()
+        try:
+            return run_workflows(project_id, resume, concept, outline, working_dir, checkpointer)
+        finally:
+            checkpointer.conn.close()
+    compiled_concept_workflow = get_concept_graph(checkpointer)
+    compiled_novel_workflow = get_novel_graph(checkpointer)
+    concept_config = {"configurable": {"thread_id": f"{project_id}:concept"}}
+    novel_config = {"configurable": {"thread_id": f"{project_id}:novel"}}
+    print(f"项目 ID：{project_id}（中断后可使用 --resume {project_id} 继续）")
+
+    # 小说工作流已开始时直接从它的检查点继续
+    if resume and compiled_novel_workflow.get_state(novel_config).values:
+        return _resume_or_invoke(compiled_novel_workflow, None, novel_config, resume)
+
+    if concept is None:
+        # 运行概念工作流
+        concept_state = {
+            'concept': NovelConcept(),
+            'user_input': '',
+            'feedback_needed': True
+        }
+        concept_result = _resume_or_invoke(compiled_concept_workflow, concept_state, concept_config, resume)
+
+        # 如果概念被确认，运行小说工作流
+        if concept_result.get('feedback_needed', True):
+            return None
+        concept = concept_result['concept']
+    return compiled_novel_workflow.invoke(initial_novel_state(concept, outline, working_dir), novel_config)
 
 # 导出所有需要的函数和类
 __all__ = [
@@ -519,39 +1296,53 @@ __all__ = [
     "NovelState",
     "create_concept_workflow",
     "create_novel_workflow",
+    "get_concept_graph",
+    "get_novel_graph",
+    "create_initial_draft",
+    "split_outline",
+    "ConceptStreamParser",
     "generate_concept_with_ai",
+    "agenerate_concepts",
+    "generate_concepts",
+    "parse_concept",
+    "generate_structured_concept",
+    "agenerate_outline",
     "save_concept",
-    "save_draft"
+    "save_draft",
+    "open_checkpointer",
+    "chapter_handle",
+    "emit_event",
+    "initial_novel_state",
+    "reopen_project",
+    "run_workflows"
 ]
 
 if __name__ == "__main__":
-    # 创建概念工作流
-    concept_workflow = create_concept_workflow()
-    compiled_concept_workflow = concept_workflow.compile()
-    
-    # 创建小说工作流
-    novel_workflow = create_novel_workflow()
-    compiled_novel_workflow = novel_workflow.compile()
-    
-    # 运行概念工作流
-    concept_state = {
-        'concept': NovelConcept(),
-        'user_input': '',
-        'feedback_needed': True
-    }
-    concept_result = compiled_concept_workflow.invoke(concept_state)
-    
-    # 如果概念被确认，运行小说工作流
-    if not concept_result.get('feedback_needed', True):
-        novel_state = {
-            'concept': concept_result['concept'],
-            'outline': '',
-            'draft_content': '',
-            'current_section': '',
-            'save_path': '',
-            'user_feedback': ''
-        }
-        novel_result = compiled_novel_workflow.invoke(novel_state)
+    parser = argparse.ArgumentParser(description="NovAgent 智能小说创作助手")
+    parser.add_argument("--project", help="项目 ID，用于保存检查点（默认按当前时间生成）")
+    parser.add_argument("--resume", metavar="PROJECT", help="从上次中断处继续指定的项目")
+    parser.add_argument("--concepts", type=int, metavar="N", help="批量生成 N 个候选概念并列出后退出")
+    parser.add_argument("--trace", metavar="PATH", help="把节点与模型调用的追踪记录以 JSONL 写入该文件")
+    parser.add_argument("--profile", action="store_true", help="退出时打印各节点的耗时与 token 用量汇总")
+    args = parser.parse_args()
+
+    if args.trace or args.profile:
+        tracer = tracing.Tracer(args.trace or os.getenv("NOVEL_TRACE_FILE"))
+        tracing.configure(tracer)
+        if args.profile:
+            atexit.register(lambda: print("\n=== 性能汇总 ===\n" + tracing.format_summary(tracer.summary())
+                                          + ("\n\n=== 上下文缓存命中 ===\n" + prompt_builder.format_snapshot(prompt_builder.snapshot())
+                                             if prompt_builder.snapshot() else "")))
+
+    if args.concepts:
+        candidates = generate_concepts(args.concepts, int(os.getenv("NOVEL_CONCEPT_CONCURRENCY", "8")))
+        for i, candidate in enumerate(candidates, 1):
+            print(f"{i}. 《{candidate.title}》（{candidate.genre}）{candidate.logline}")
+        raise SystemExit(0)
+
+    project_id = args.resume or args.project or datetime.now().strftime("novel-%Y%m%d-%H%M%S")
+    novel_result = run_workflows(project_id, resume=bool(args.resume))
+    if novel_result:
         print("\n=== 小说创作完成 ===")
         print(f"大纲：\n{novel_result['outline']}")
-        print(f"\n内容：\n{novel_result['draft_content']}") 
\ No newline at end of file
+        print(f"\n内容：\n{chapter_handle(novel_result).text()}")
@@ -0,0 +1,354 @@
+"""NovAgent 的异步 HTTP 服务
+
+在一个进程中承载多个写作会话。每个会话有独立的检查点线程（会话 ID 即项目 ID，可用
+novel_agent.py --resume 继续），需要用户回答的提示词以 interrupt() 暂停工作流：等待回答期间
+会话只占用检查点中的状态和少量内存，不占用线程。工作流只在两次回答之间运行时才借用一个工作线程，
+同时运行的会话数由 NOVEL_SERVER_WORKERS 限制。
+
+接口：
+    POST   /sessions               创建会话 {"id"?, "concept"?, "outline"?}；
+                                   提供 concept 时跳过概念收集，使用已有 id 时从其检查点继续；
+                                   项目保存在 NOVEL_WORKING_DIR 下，标题不能包含路径分隔符或 ..
+    GET    /sessions               列出会话
+    GET    /sessions/{id}          会话状态：阶段、等待回答的提示词、结果
+    POST   /sessions/{id}/answer   回答当前提示词 {"answer": "..."}
+    GET    /sessions/{id}/events   SSE 事件流，支持 Last-Event-ID（或 ?after=N）续传
+    DELETE /sessions/{id}          移除会话并停止其工作流（检查点保留）
+
+事件：prompt（等待回答）、concept / concept_field（概念）、chapter_delta（章节生成中的正文片段）、
+chapter（每章生成或修改完成即推送正文）、node（节点完成）、phase（概念确认后进入小说阶段）、done（结果）、error。
+某章的完整正文推送后，其 chapter_delta 事件不再保留供续传。
+
+已结束的会话在 NOVEL_SERVER_SESSION_TTL 秒（默认 3600）后移除。
+
+    python novel_server.py --port 8080
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+import input_provider
+import novel_agent
+import project_store
+
+def _dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+class Session:
+    """一个写作会话的服务端状态，只在事件循环线程中修改"""
+
+    def __init__(self, session_id: str, concept: Optional[novel_agent.NovelConcept] = None,
+                 outline: str = "", max_events: int = 1000):
+        self.id = session_id
+        self.phase = "concept" if concept is None else "novel"  # concept / novel / done / failed
+        self.concept = concept
+        self.outline = outline
+        self.prompt: Optional[str] = None
+        self.running = False
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.events: List[Dict] = []
+        self.max_events = max_events
+        self.last_event_id = 0
+        self.finished_at: Optional[float] = None  # 结束时间（time.monotonic()），用于过期移除
+        self.task: Optional[asyncio.Task] = None  # 正在推进工作流的任务
+        self.cancelled = threading.Event()  # 会话被移除，工作线程应尽快停止
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.phase in ("done", "failed")
+
+    def config(self, phase: Optional[str] = None) -> Dict:
+        return {"configurable": {"thread_id": f"{self.id}:{phase or self.phase}", "stream_chapters": True}}
+
+    def publish(self, event: str, data: Dict) -> None:
+        self.last_event_id += 1
+        if event == "chapter":
+            # 完整正文已送达，该章此前的增量片段不再保留
+            self.events = [e for e in self.events
+                           if e["event"] != "chapter_delta" or e["data"].get("chapter") != data.get("chapter")]
+        self.events.append({"id": self.last_event_id, "event": event, "data": data})
+        if len(self.events) > self.max_events:
+            del self.events[0]
+        if event in ("done", "error"):
+            self.finished_at = time.monotonic()
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def events_after(self, event_id: int) -> List[Dict]:
+        return self.events[bisect.bisect_right(self.events, event_id, key=lambda e: e["id"]):]
+
+    async def wait(self, timeout: float) -> None:
+        """等待新事件，超时后返回"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "phase": self.phase,
+            "prompt": self.prompt,
+            "running": self.running,
+            "last_event_id": self.last_event_id,
+            "concept": self.concept.model_dump() if self.concept else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+class NovelService:
+    """管理会话并在工作线程中推进各会话的工作流"""
+
+    def __init__(self, checkpointer=None, workers: Optional[int] = None, session_ttl: Optional[float] = None):
+        self.checkpointer = checkpointer or novel_agent.open_checkpointer()
+        self.graphs = {
+            "concept": novel_agent.get_concept_graph(self.checkpointer),
+            "novel": novel_agent.get_novel_graph(self.checkpointer),
+        }
+        self.sessions: Dict[str, Session] = {}
+        self._workers = asyncio.Semaphore(workers or int(os.getenv("NOVEL_SERVER_WORKERS", "8")))
+        self.session_ttl = session_ttl if session_ttl is not None else float(os.getenv("NOVEL_SERVER_SESSION_TTL", "3600"))
+        self._tasks = set()
+
+    def create(self, session_id: Optional[str] = None, concept: Optional[novel_agent.NovelConcept] = None,
+               outline: str = "") -> Session:
+        session_id = session_id or uuid.uuid4().hex[:12]
+        if session_id in self.sessions:
+            raise ValueError(f"会话已存在：{session_id}")
+        if concept is not None:
+            project_store.check_title(concept.title)
+        session = Session(session_id, concept, outline)
+        self.sessions[session_id] = session
+        self._start(session, self._initial_input)
+        return session
+
+    def answer(self, session_id: str, answer: str) -> Session:
+        from langgraph.types import Command
+
+        session = self.sessions[session_id]
+        if session.running or session.prompt is None:
+            raise ValueError("会话当前没有等待回答的提示词")
+        session.publish("answer", {"prompt": session.prompt, "answer": answer})
+        session.prompt = None
+        self._start(session, lambda _: (session.phase, Command(resume=answer)))
+        return session
+
+    def remove(self, session_id: str) -> Session:
+        """移除会话；工作流仍在运行时取消其任务，工作线程在当前节点完成后停止"""
+        session = self.sessions.pop(session_id)
+        session.cancelled.set()
+        if session.task is not None and not session.task.done():
+            session.task.cancel()
+        return session
+
+    def evict_expired(self) -> List[str]:
+        """移除结束超过 session_ttl 秒的会话，返回被移除的会话 ID"""
+        now = time.monotonic()
+        expired = [session.id for session in self.sessions.values()
+                   if session.finished_at is not None and now - session.finished_at >= self.session_ttl]
+        for session_id in expired:
+            self.remove(session_id)
+        return expired
+
+    def _initial_input(self, session: Session):
+        """返回 (阶段, 工作流输入)：新会话从头开始，检查点中已有进度时从中继续（服务重启后可用原会话 ID 恢复）"""
+        if self.graphs["novel"].get_state(session.config("novel")).values:
+            return "novel", None
+        if session.phase == "novel":
+            return "novel", novel_agent.initial_novel_state(session.concept, session.outline)
+        if self.graphs["concept"].get_state(session.config("concept")).values:
+            return "concept", None
+        return "concept", {'concept': novel_agent.NovelConcept(), 'user_input': '', 'feedback_needed': True}
+
+    def _start(self, session: Session, make_input) -> None:
+        session.running = True
+        task = session.task = asyncio.create_task(self._advance(session, make_input))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _advance(self, session: Session, make_input) -> None:
+        """运行工作流直到需要用户回答或全部完成"""
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._workers:
+                session.phase, graph_input = await asyncio.to_thread(make_input, session)
+                while True:
+                    snapshot = await asyncio.to_thread(self._stream, session, graph_input, loop)
+                    if snapshot.interrupts:
+                        session.prompt = snapshot.interrupts[0].value["prompt"]
+                        session.publish("prompt", {"prompt": session.prompt})
+                        return
+                    if session.phase == "concept":
+                        session.concept = snapshot.values["concept"]
+                        project_store.check_title(session.concept.title)
+                        session.phase = "novel"
+                        session.publish("phase", {"phase": "novel"})
+                        graph_input = novel_agent.initial_novel_state(session.concept, session.outline)
+                        continue
+                    values = snapshot.values
+                    session.concept = values.get("concept", session.concept)
+                    session.result = {
+                        "save_path": values.get("save_path", ""),
+                        "chapters": len(values.get("chapters") or []),
+                        "failed_chapters": values.get("failed_chapters") or [],
+                    }
+                    session.phase = "done"
+                    session.publish("done", session.result)
+                    return
+        except Exception as e:
+            session.phase = "failed"
+            session.error = f"{type(e).__name__}: {e}"
+            session.publish("error", {"error": session.error})
+        finally:
+            session.running = False
+
+    def _stream(self, session: Session, graph_input, loop: asyncio.AbstractEventLoop):
+        """在工作线程中运行当前阶段的工作流，把节点推送的事件转发到事件循环，返回运行后的快照"""
+        graph = self.graphs[session.phase]
+        config = session.config()
+
+        def publish(event: str, data: Dict) -> None:
+            loop.call_soon_threadsafe(session.publish, event, data)
+
+        with input_provider.using(input_provider.InterruptInput()):
+            for mode, chunk in graph.stream(graph_input, config, stream_mode=["updates", "custom"]):
+                if session.cancelled.is_set():
+                    break  # 会话已移除：关闭工作流的迭代，不再进入后续节点
+                if mode == "custom":
+                    data = dict(chunk)
+                    publish(data.pop("event", "message"), data)
+                else:
+                    for node in chunk:
+                        if node != "__interrupt__":
+                            publish("node", {"node": node})
+        return graph.get_state(config)
+
+# HTTP 接口
+
+SERVICE = web.AppKey("service", NovelService)
+HEARTBEAT = web.AppKey("heartbeat", float)  # SSE 空闲保活间隔（秒）
+EVICTOR = web.AppKey("evictor", asyncio.Task)  # 定期移除过期会话的任务
+
+def _json(data, status: int = 200) -> web.Response:
+    return web.json_response(data, status=status, dumps=_dumps)
+
+def _session(request: web.Request) -> Session:
+    session = request.app[SERVICE].sessions.get(request.match_info["session_id"])
+    if session is None:
+        raise web.HTTPNotFound(text=_dumps({"error": "会话不存在"}), content_type="application/json")
+    return session
+
+async def _body(request: web.Request) -> Dict:
+    if not request.can_read_body:
+        return {}
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text=_dumps({"error": "请求体不是合法的 JSON"}), content_type="application/json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=_dumps({"error": "请求体必须是 JSON 对象"}), content_type="application/json")
+    return body
+
+async def create_session(request: web.Request) -> web.Response:
+    body = await _body(request)
+    try:
+        concept = novel_agent.NovelConcept(**body["concept"]) if body.get("concept") else None
+        session = request.app[SERVICE].create(body.get("id"), concept, body.get("outline", ""))
+    except (TypeError, ValueError) as e:
+        return _json({"error": str(e)}, status=400)
+    return _json(session.to_dict(), status=201)
+
+async def list_sessions(request: web.Request) -> web.Response:
+    return _json([session.to_dict() for session in request.app[SERVICE].sessions.values()])
+
+async def get_session(request: web.Request) -> web.Response:
+    return _json(_session(request).to_dict())
+
+async def answer_session(request: web.Request) -> web.Response:
+    session = _session(request)
+    body = await _body(request)
+    try:
+        request.app[SERVICE].answer(session.id, str(body.get("answer", "")))
+    except ValueError as e:
+        return _json({"error": str(e)}, status=409)
+    return _json(session.to_dict())
+
+async def delete_session(request: web.Request) -> web.Response:
+    session = _session(request)
+    request.app[SERVICE].remove(session.id)
+    return _json(session.to_dict())
+
+async def session_events(request: web.Request) -> web.StreamResponse:
+    """以 SSE 推送会话事件，会话结束后关闭；空闲时定期发送注释行保活"""
+    session = _session(request)
+    last_id = request.headers.get("Last-Event-ID") or request.query.get("after") or "0"
+    position = int(last_id) if last_id.isdigit() else 0
+    heartbeat = request.app[HEARTBEAT]
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    while True:
+        for event in session.events_after(position):
+            position = event["id"]
+            await response.write(
+                f"id: {event['id']}\nevent: {event['event']}\ndata: {_dumps(event['data'])}\n\n".encode("utf-8"))
+        if session.finished or request.app[SERVICE].sessions.get(session.id) is not session:
+            break
+        pending = session.last_event_id
+        await session.wait(heartbeat)
+        if session.last_event_id == pending and not session.finished:
+            await response.write(b": ping\n\n")
+    await response.write_eof()
+    return response
+
+def create_app(service: Optional[NovelService] = None, heartbeat: float = 15.0) -> web.Application:
+    """创建 HTTP 应用；未提供 service 时在应用启动时创建"""
+    app = web.Application()
+    app[HEARTBEAT] = heartbeat
+
+    async def evict_loop(service: NovelService) -> None:
+        while True:
+            await asyncio.sleep(min(max(service.session_ttl, 1.0), 60.0))
+            service.evict_expired()
+
+    async def on_startup(app: web.Application) -> None:
+        app[SERVICE] = service or NovelService()
+        app[EVICTOR] = asyncio.create_task(evict_loop(app[SERVICE]))
+
+    async def on_cleanup(app: web.Application) -> None:
+        app[EVICTOR].cancel()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.add_routes([
+        web.post("/sessions", create_session),
+        web.get("/sessions", list_sessions),
+        web.get("/sessions/{session_id}", get_session),
+        web.post("/sessions/{session_id}/answer", answer_session),
+        web.get("/sessions/{session_id}/events", session_events),
+        web.delete("/sessions/{session_id}", delete_session),
+    ])
+    return app
+
+__all__ = [
+    "NovelService",
+    "Session",
+    "create_app",
+]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NovAgent HTTP 服务")
+    parser.add_argument("--host", default=os.getenv("NOVEL_SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("NOVEL_SERVER_PORT", "8080")))
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,137 @@
+"""大纲的推测式预取
+
+概念总结展示后，用户多半会直接确认。开启预取（NOVEL_SPECULATIVE_OUTLINE）时，总结节点在后台
+事件循环中提前生成大纲，结果按概念内容的哈希保存：用户确认且概念未变时，discuss_outline 直接取用
+（仍在生成时等待其完成）；用户选择修改或重新开始时取消对应的生成，修改后的概念哈希不同，
+旧结果也不会被误用。
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Optional
+
+import llm_client
+
+def concept_hash(concept) -> str:
+    """概念内容的哈希，与字段顺序无关"""
+    data = concept.model_dump() if hasattr(concept, "model_dump") else concept
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+class OutlinePrefetcher:
+    """在后台事件循环中运行预取任务，按键保存结果；取消会真正中止进行中的请求"""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries  # 超出时取消最早的预取
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._futures: "OrderedDict[str, Future]" = OrderedDict()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._run, args=(self._loop,), name="outline-prefetch", daemon=True).start()
+        return self._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop) -> None:
+        loop.run_forever()
+        loop.close()
+
+    @staticmethod
+    async def _shutdown() -> None:
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await llm_client.aclose_async_client()
+        asyncio.get_running_loop().stop()
+
+    def start(self, key: str, factory: Callable[[], Awaitable[str]]) -> bool:
+        """开始预取，同一个键已在预取时不重复开始"""
+        with self._lock:
+            if key in self._futures:
+                self._futures.move_to_end(key)
+                return False
+            self._futures[key] = asyncio.run_coroutine_threadsafe(factory(), self._ensure_loop())
+            self.started += 1
+            while len(self._futures) > self.max_entries:
+                _, oldest = self._futures.popitem(last=False)
+                self.cancelled += int(oldest.cancel())
+        return True
+
+    def take(self, key: str, timeout: Optional[float] = None) -> Optional[str]:
+        """取走键对应的预取结果，仍在生成时等待完成；没有预取或预取失败时返回 None"""
+        with self._lock:
+            future = self._futures.pop(key, None)
+        try:
+            result = future.result(timeout) if future is not None else None
+        except Exception:
+            result = None
+            if future is not None:
+                future.cancel()
+        with self._lock:
+            if result:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return result or None
+
+    def discard(self, key: str) -> bool:
+        """取消并丢弃键对应的预取，返回是否存在"""
+        with self._lock:
+            future = self._futures.pop(key, None)
+            if future is not None:
+                self.cancelled += int(future.cancel())
+        return future is not None
+
+    def pending(self, key: str) -> bool:
+        with self._lock:
+            return key in self._futures
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"started": self.started, "hits": self.hits, "misses": self.misses,
+                    "cancelled": self.cancelled, "pending": len(self._futures)}
+
+    def close(self) -> None:
+        """取消所有预取并停止后台事件循环"""
+        with self._lock:
+            futures, self._futures = list(self._futures.values()), OrderedDict()
+            loop, self._loop = self._loop, None
+        for future in futures:
+            future.cancel()
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop)
+
+_prefetcher: Optional[OutlinePrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+def configure(prefetcher: Optional[OutlinePrefetcher] = None) -> None:
+    """替换全局预取器；传入 None 时下次使用前重新创建"""
+    global _prefetcher
+    with _prefetcher_lock:
+        old, _prefetcher = _prefetcher, prefetcher
+    if old is not None and old is not prefetcher:
+        old.close()
+
+def get_prefetcher() -> OutlinePrefetcher:
+    """获取进程内共享的预取器"""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = OutlinePrefetcher()
+        return _prefetcher
+
+__all__ = [
+    "OutlinePrefetcher",
+    "concept_hash",
+    "configure",
+    "get_prefetcher",
+]
@@ -0,0 +1,156 @@
+"""层级大纲树
+
+把大纲文本解析为 卷 → 章 → 场景 的树，每个节点有内容哈希。每章的输入哈希由所在卷的
+标题与说明加上本章子树决定；生成初稿时记录每章的输入哈希和生成的正文哈希，
+大纲修改后只有输入哈希变化的章节需要重新生成，其余章节保持原样。
+"""
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, TypeVar, Union
+
+T = TypeVar("T")
+
+VOLUME_HEADING = re.compile(r'^\s*第[0-9零一二三四五六七八九十百千]+[卷部]')
+CHAPTER_HEADING = re.compile(r'^\s*第[0-9零一二三四五六七八九十百千]+章')
+SCENE_MARKER = re.compile(r'^\s*([-*·•]\s+|场景[0-9零一二三四五六七八九十]*[：:])')
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+@dataclass
+class OutlineNode:
+    """大纲节点，kind 为 root / volume / chapter / scene"""
+    kind: str
+    heading: str = ""
+    body: List[str] = field(default_factory=list)
+    children: List["OutlineNode"] = field(default_factory=list)
+
+    def own_text(self) -> str:
+        """节点自身（不含子节点）的文本"""
+        return '\n'.join(line for line in [self.heading, *self.body] if line)
+
+    def text(self) -> str:
+        """节点子树的完整文本"""
+        return '\n'.join(part for part in [self.own_text(), *(c.text() for c in self.children)] if part)
+
+    @property
+    def hash(self) -> str:
+        return _hash(self.text())
+
+    def to_dict(self) -> Dict:
+        return {"kind": self.kind, "heading": self.heading, "body": self.body,
+                "hash": self.hash, "children": [c.to_dict() for c in self.children]}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "OutlineNode":
+        return cls(data["kind"], data.get("heading", ""), list(data.get("body", [])),
+                   [cls.from_dict(c) for c in data.get("children", [])])
+
+class OutlineTree:
+    """卷、章、场景组成的大纲树"""
+
+    def __init__(self, root: Optional[OutlineNode] = None):
+        self.root = root or OutlineNode("root")
+
+    @classmethod
+    def parse(cls, text: str) -> "OutlineTree":
+        """解析大纲文本；没有任何章节标题时整体视为一章"""
+        lines = text.splitlines()
+        if not any(CHAPTER_HEADING.match(line) for line in lines):
+            root = OutlineNode("root")
+            if text.strip():
+                root.children.append(OutlineNode("chapter", body=[text.strip()]))
+            return cls(root)
+
+        root = OutlineNode("root")
+        volume: Optional[OutlineNode] = None
+        chapter: Optional[OutlineNode] = None
+        current = root
+        for line in lines:
+            if VOLUME_HEADING.match(line):
+                volume = OutlineNode("volume", line.strip())
+                root.children.append(volume)
+                current = volume
+            elif CHAPTER_HEADING.match(line):
+                chapter = OutlineNode("chapter", line.strip())
+                (volume or root).children.append(chapter)
+                current = chapter
+            elif current.kind in ("chapter", "scene") and SCENE_MARKER.match(line):
+                current = OutlineNode("scene", line.strip())
+                chapter.children.append(current)
+            elif line.strip():
+                current.body.append(line.strip())
+        return cls(root)
+
+    def to_text(self) -> str:
+        return self.root.text()
+
+    def to_dict(self) -> Dict:
+        return self.root.to_dict()
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "OutlineTree":
+        return cls(OutlineNode.from_dict(data))
+
+    def chapters(self) -> List[Tuple[Optional[OutlineNode], OutlineNode]]:
+        """按顺序返回 (所在卷, 章节) 列表"""
+        result = []
+        for node in self.root.children:
+            if node.kind == "volume":
+                result.extend((node, chapter) for chapter in node.children)
+            elif node.kind == "chapter":
+                result.append((None, node))
+        return result
+
+    def chapter_entries(self) -> List[str]:
+        """各章的大纲条目（章节子树的文本）"""
+        return [chapter.text() for _, chapter in self.chapters()]
+
+    def input_hashes(self) -> List[str]:
+        """各章的输入哈希：所在卷的自身文本 + 章节子树"""
+        return [_hash((volume.own_text() if volume else "") + "\n" + chapter.text())
+                for volume, chapter in self.chapters()]
+
+def _draft_hash(draft: Union[str, Dict, None]) -> str:
+    if not draft:
+        return ""
+    return draft["hash"] if isinstance(draft, dict) else _hash(draft)
+
+def chapter_records(tree: OutlineTree, drafts: List[Union[str, Dict, None]]) -> List[Dict]:
+    """记录每章的输入哈希及其生成的正文哈希
+
+    drafts 为各章正文，或已写入磁盘的章节条目（带 hash，如 ChapterHandle.entries）。
+    """
+    return [{"input_hash": input_hash, "draft_hash": _draft_hash(draft)}
+            for input_hash, draft in zip(tree.input_hashes(), drafts)]
+
+def plan_regeneration(records: List[Dict], tree: OutlineTree,
+                      drafts: List[T]) -> Tuple[List[Optional[T]], List[int]]:
+    """根据上次的生成记录决定哪些章节需要重新生成
+
+    返回 (可沿用的各章正文或章节条目，需要重新生成的为 None；需要重新生成的章节序号)。
+    输入哈希未变的章节沿用其正文（即使章节位置因增删而移动）。
+    """
+    available: Dict[str, List[T]] = {}
+    for record, draft in zip(records or [], drafts or []):
+        if record.get("input_hash") and draft:
+            available.setdefault(record["input_hash"], []).append(draft)
+
+    reused: List[Optional[T]] = []
+    stale: List[int] = []
+    for i, input_hash in enumerate(tree.input_hashes()):
+        candidates = available.get(input_hash)
+        if candidates:
+            reused.append(candidates.pop(0))
+        else:
+            reused.append(None)
+            stale.append(i)
+    return reused, stale
+
+__all__ = [
+    "OutlineNode",
+    "OutlineTree",
+    "chapter_records",
+    "plan_regeneration",
+]
@@ -0,0 +1,268 @@
+"""项目目录索引
+
+在工作目录下用 SQLite（{working_dir}/.catalog.sqlite）记录每个项目的标题、类型、目标字数、正文字数、
+章节数、最后修改时间与文件路径。save_concept / save_draft 每次保存后在一个事务中更新对应的行，
+列出、筛选和打开项目只需查询索引，不必扫描并解析工作目录中的每个文件。
+
+索引与磁盘不一致（例如保存中途崩溃、手动删除了文件）时，可以用 verify 检查、rebuild 从磁盘重建：
+
+    python project_catalog.py list --genre 悬疑
+    python project_catalog.py show 雾港来信
+    python project_catalog.py verify
+    python project_catalog.py rebuild
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from dataclasses import asdict, dataclass, fields
+from typing import Dict, List, Optional
+
+import project_store
+
+CATALOG = ".catalog.sqlite"
+CONCEPT_SUFFIX = "_concept.txt"
+LEGACY_DRAFT_SUFFIX = "_draft.txt"  # 早期版本保存的整本草稿
+
+@dataclass
+class CatalogEntry:
+    title: str
+    genre: str = ""
+    word_count_target: int = 0
+    word_count: int = 0  # 正文字数
+    chapter_count: int = 0
+    concept_path: Optional[str] = None
+    project_dir: Optional[str] = None
+    updated_at: float = 0.0  # 概念文件与 manifest 中较新的修改时间（时间戳）
+
+COLUMNS = [f.name for f in fields(CatalogEntry)]
+
+def _read_concept_header(path: str) -> Dict:
+    """只读取概念文件开头的单行字段（类型、目标字数）"""
+    info: Dict = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                break
+            if line.startswith("类型："):
+                info["genre"] = line[3:]
+            elif line.startswith("目标字数："):
+                try:
+                    info["word_count_target"] = int(line[5:])
+                except ValueError:
+                    pass
+    return info
+
+def _count_chars(path: str) -> int:
+    count = 0
+    with open(path, encoding="utf-8") as f:
+        for block in iter(lambda: f.read(1 << 16), ""):
+            count += len(block)
+    return count
+
+def _draft_info(directory: str) -> Optional[Dict]:
+    """项目目录的章节统计，取自 manifest，不读取正文"""
+    manifest_path = os.path.join(directory, project_store.MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    chapters = manifest.get("chapters", [])
+    return {"word_count": sum(entry.get("chars", 0) for entry in chapters), "chapter_count": len(chapters),
+            "project_dir": os.path.abspath(directory), "updated_at": os.path.getmtime(manifest_path)}
+
+def scan(working_dir: str) -> Dict[str, CatalogEntry]:
+    """扫描工作目录，得到每个项目应有的索引内容"""
+    projects: Dict[str, CatalogEntry] = {}
+    if not os.path.isdir(working_dir):
+        return projects
+    for item in os.scandir(working_dir):
+        if item.is_file() and item.name.endswith(CONCEPT_SUFFIX):
+            entry = projects.setdefault(item.name[:-len(CONCEPT_SUFFIX)], CatalogEntry(item.name[:-len(CONCEPT_SUFFIX)]))
+            for key, value in _read_concept_header(item.path).items():
+                setattr(entry, key, value)
+            entry.concept_path = os.path.abspath(item.path)
+            entry.updated_at = max(entry.updated_at, item.stat().st_mtime)
+        elif item.is_file() and item.name.endswith(LEGACY_DRAFT_SUFFIX):
+            entry = projects.setdefault(item.name[:-len(LEGACY_DRAFT_SUFFIX)],
+                                        CatalogEntry(item.name[:-len(LEGACY_DRAFT_SUFFIX)]))
+            if entry.project_dir is None:
+                entry.word_count = _count_chars(item.path)
+                entry.chapter_count = int(entry.word_count > 0)
+                entry.project_dir = os.path.abspath(item.path)
+                entry.updated_at = max(entry.updated_at, item.stat().st_mtime)
+        elif item.is_dir() and not item.name.startswith("."):
+            info = _draft_info(item.path)
+            if info is not None:
+                entry = projects.setdefault(item.name, CatalogEntry(item.name))
+                entry.word_count, entry.chapter_count = info["word_count"], info["chapter_count"]
+                entry.project_dir = info["project_dir"]
+                entry.updated_at = max(entry.updated_at, info["updated_at"])
+    return projects
+
+class ProjectCatalog:
+    """工作目录的项目索引"""
+
+    def __init__(self, working_dir: str):
+        self.working_dir = os.path.abspath(working_dir)
+        os.makedirs(self.working_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.working_dir, CATALOG), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS projects ("
+                " title TEXT PRIMARY KEY, genre TEXT NOT NULL DEFAULT '',"
+                " word_count_target INTEGER NOT NULL DEFAULT 0, word_count INTEGER NOT NULL DEFAULT 0,"
+                " chapter_count INTEGER NOT NULL DEFAULT 0, concept_path TEXT, project_dir TEXT,"
+                " updated_at REAL NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_projects_genre ON projects (genre)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_projects_updated ON projects (updated_at)")
+
+    def _upsert(self, title: str, values: Dict) -> None:
+        """在一个事务中插入或更新项目的部分字段，updated_at 只会前进"""
+        columns = ["title", *values]
+        updates = ", ".join(
+            "updated_at = MAX(updated_at, excluded.updated_at)" if column == "updated_at" else f"{column} = excluded.{column}"
+            for column in values)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO projects ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+                f" ON CONFLICT (title) DO UPDATE SET {updates}",
+                [title, *values.values()],
+            )
+
+    def record_concept(self, title: str, genre: str, word_count_target: int, concept_path: str) -> None:
+        """记录 save_concept 写入的概念文件"""
+        self._upsert(title, {"genre": genre, "word_count_target": word_count_target,
+                             "concept_path": os.path.abspath(concept_path),
+                             "updated_at": os.path.getmtime(concept_path)})
+
+    def record_draft(self, project_dir: str) -> None:
+        """按项目目录的 manifest 记录 save_draft 保存的章节统计"""
+        info = _draft_info(project_dir)
+        if info is not None:
+            self._upsert(os.path.basename(os.path.abspath(project_dir)), info)
+
+    def get(self, title: str) -> Optional[CatalogEntry]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM projects WHERE title = ?", (title,)).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def list(self, genre: Optional[str] = None, search: Optional[str] = None,
+             limit: Optional[int] = None) -> List[CatalogEntry]:
+        """按最后修改时间倒序列出项目，可按类型与标题关键字筛选"""
+        where, params = [], []
+        if genre:
+            where.append("genre = ?")
+            params.append(genre)
+        if search:
+            where.append("instr(title, ?) > 0")
+            params.append(search)
+        sql = f"SELECT {', '.join(COLUMNS)} FROM projects"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY updated_at DESC, title"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [CatalogEntry(*row) for row in self._conn.execute(sql, params)]
+
+    def remove(self, title: str) -> bool:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM projects WHERE title = ?", (title,)).rowcount > 0
+
+    def rebuild(self) -> int:
+        """扫描工作目录并在一个事务中替换整个索引，返回项目数"""
+        projects = scan(self.working_dir)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM projects")
+            self._conn.executemany(
+                f"INSERT INTO projects ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [tuple(asdict(entry).values()) for entry in projects.values()],
+            )
+        return len(projects)
+
+    def verify(self) -> Dict[str, List[str]]:
+        """比较索引与磁盘：missing 为磁盘上有而索引中没有的项目，orphaned 为文件已不存在的索引项，
+        stale 为字段与磁盘不一致的项目"""
+        expected = scan(self.working_dir)
+        with self._lock:
+            actual = {row[0]: CatalogEntry(*row)
+                      for row in self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM projects")}
+        return {
+            "missing": sorted(set(expected) - set(actual)),
+            "orphaned": sorted(set(actual) - set(expected)),
+            "stale": sorted(title for title in set(expected) & set(actual) if expected[title] != actual[title]),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+_catalogs: Dict[str, ProjectCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(working_dir: str) -> ProjectCatalog:
+    """获取工作目录的项目索引，进程内共享"""
+    working_dir = os.path.abspath(working_dir)
+    with _catalogs_lock:
+        if working_dir not in _catalogs:
+            _catalogs[working_dir] = ProjectCatalog(working_dir)
+        return _catalogs[working_dir]
+
+def _print_entry(entry: CatalogEntry) -> None:
+    print(f"{entry.title:<24}{entry.genre:<10}{entry.chapter_count:>6} 章{entry.word_count:>10} 字"
+          f"  {entry.project_dir or entry.concept_path or ''}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="NovAgent 项目索引")
+    parser.add_argument("--working-dir", default=os.getenv("NOVEL_WORKING_DIR", "./novels"), help="工作目录")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="列出项目（按最后修改时间倒序）")
+    listing.add_argument("--genre", help="只列出该类型的项目")
+    listing.add_argument("--search", help="标题包含的关键字")
+    listing.add_argument("--limit", type=int, help="最多列出的项目数")
+    show = commands.add_parser("show", help="显示单个项目的索引记录与文件路径")
+    show.add_argument("title")
+    commands.add_parser("verify", help="检查索引与磁盘是否一致")
+    commands.add_parser("rebuild", help="扫描工作目录重建索引")
+    args = parser.parse_args(argv)
+
+    catalog = get_catalog(args.working_dir)
+    if args.command == "list":
+        for entry in catalog.list(args.genre, args.search, args.limit):
+            _print_entry(entry)
+    elif args.command == "show":
+        entry = catalog.get(args.title)
+        if entry is None:
+            print(f"索引中没有项目：{args.title}", file=sys.stderr)
+            return 1
+        print(json.dumps(asdict(entry), ensure_ascii=False, indent=2))
+    elif args.command == "verify":
+        report = catalog.verify()
+        for kind, titles in report.items():
+            if titles:
+                print(f"{kind}: {'、'.join(titles)}")
+        if any(report.values()):
+            print("索引与磁盘不一致，可运行 rebuild 重建", file=sys.stderr)
+            return 1
+        print("索引与磁盘一致")
+    else:
+        print(f"已重建索引，共 {catalog.rebuild()} 个项目")
+    return 0
+
+__all__ = [
+    "CatalogEntry",
+    "ProjectCatalog",
+    "get_catalog",
+    "scan",
+]
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+"""按章节分片的项目存储
+
+每个项目一个目录，大纲与每一章各占一个文件，另有一个记录章节顺序与哈希的 manifest.json：
+
+    {working_dir}/{title}/
+        manifest.json
+        outline.txt
+        chapters/000001.txt
+        ...
+
+保存时只写入内容发生变化的章节，所有写入都先写临时文件再原子重命名，崩溃不会留下半截文件。
+
+工作流状态中不保存章节正文，只保存 ChapterHandle（章节 ID、哈希与长度）：生成或修改的章节立即
+以新 ID 写入章节文件（不覆盖已有文件），需要正文时再按需从磁盘读取，大文件经 mmap 读取。
+保存节点把 manifest 指向句柄中的章节，并删除不再引用的旧文件。
+"""
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Union
+
+import tracing
+
+MANIFEST = "manifest.json"
+OUTLINE = "outline.txt"
+CHAPTER_DIR = "chapters"
+MMAP_THRESHOLD = 1 << 20  # 不小于该字节数的章节文件经 mmap 读取
+
+def atomic_write(path: str, data: Union[str, bytes]) -> int:
+    """先写同目录下的临时文件再原子替换目标文件，返回写入的字节数"""
+    encoded = data.encode("utf-8") if isinstance(data, str) else data
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    tracing.current_span().add(bytes_written=len(encoded))
+    return len(encoded)
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def read_text(path: str) -> str:
+    """读取 UTF-8 文本文件，大文件映射到内存后直接解码，不经过额外的读缓冲"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return f.read().decode("utf-8")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return str(mapped, "utf-8")
+
+def check_title(title: str) -> str:
+    """检查来自不可信输入的项目标题可以安全地作为工作目录下的目录名，不合法时抛出 ValueError"""
+    if not isinstance(title, str):
+        raise ValueError("项目标题必须是字符串")
+    if (os.path.isabs(title) or "/" in title or "\\" in title or os.sep in title
+            or ".." in title or "\0" in title):
+        raise ValueError(f"项目标题不能是绝对路径，也不能包含路径分隔符或 ..：{title!r}")
+    return title
+
+def project_title(title: str) -> str:
+    """项目在工作目录、概念文件与项目索引中使用的标题，空标题统一为“未命名”"""
+    return title or "未命名"
+
+def project_dir(working_dir: str, title: str) -> str:
+    """项目目录路径"""
+    return os.path.join(working_dir, project_title(title))
+
+@dataclass(eq=False)
+class ChapterHandle(Sequence):
+    """按需读取正文的章节列表
+
+    只保存项目目录与各章条目 {"id", "hash", "chars"}，体积与书的长度无关，可以直接放入工作流状态
+    与检查点。按序号取得的是从磁盘读取的正文；与字符串列表比较时按哈希比较。
+    """
+    root: str
+    entries: List[Dict] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return read_text(self.path(index))
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ChapterHandle):
+            return self.hashes == other.hashes
+        if isinstance(other, (list, tuple)):
+            return len(other) == len(self) and all(
+                isinstance(text, str) and text_hash(text) == digest for text, digest in zip(other, self.hashes))
+        return NotImplemented
+
+    def path(self, index: int) -> str:
+        return os.path.join(self.root, CHAPTER_DIR, f"{self.entries[index]['id']}.txt")
+
+    @property
+    def ids(self) -> List[str]:
+        return [entry["id"] for entry in self.entries]
+
+    @property
+    def hashes(self) -> List[str]:
+        return [entry["hash"] for entry in self.entries]
+
+    @property
+    def chars(self) -> int:
+        return sum(entry["chars"] for entry in self.entries)
+
+    def exists(self, index: int) -> bool:
+        return os.path.exists(self.path(index))
+
+    def replace(self, index: int, entry: Dict) -> "ChapterHandle":
+        """返回把第 index 章换成 entry 的新句柄"""
+        entries = list(self.entries)
+        entries[index] = entry
+        return ChapterHandle(self.root, entries)
+
+    def text(self, separator: str = "\n\n") -> str:
+        """拼接全部正文（会把整本书读入内存，仅用于展示或导出）"""
+        return separator.join(self)
+
+class PartialChapters(ChapterHandle):
+    """部分位置尚无正文的章节句柄（例如重新生成时按新大纲排列的沿用章节）
+
+    条目为 None 的位置读作空文本，哈希为 None。
+    """
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) and self.entries[index] is None:
+            return ""
+        return super().__getitem__(index)
+
+    @property
+    def hashes(self) -> List[Optional[str]]:
+        return [entry["hash"] if entry else None for entry in self.entries]
+
+class ProjectStore:
+    """单个项目的章节分片存储，记录脏章节并只写入它们"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.RLock()
+        self._texts: Dict[str, str] = {}  # 章节 ID -> 待写入或刚设置的文本，写入后释放
+        self._dirty: set = set()  # 待写入的章节 ID
+        self._outline: Optional[str] = None
+        self._outline_dirty = False
+        self._orphans: List[str] = []  # 待删除的旧章节文件
+        self.manifest = self._load_manifest()
+        self._manifest_dirty = False
+
+    def _load_manifest(self) -> Dict:
+        path = os.path.join(self.root, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"version": 1, "title": "", "outline_hash": "", "next_id": 1, "chapters": [], "updated_at": ""}
+
+    @property
+    def chapter_count(self) -> int:
+        return len(self.manifest["chapters"])
+
+    @property
+    def chapter_ids(self) -> List[str]:
+        return [entry["id"] for entry in self.manifest["chapters"]]
+
+    def chapter_path(self, chapter_id: str) -> str:
+        return os.path.join(self.root, CHAPTER_DIR, f"{chapter_id}.txt")
+
+    def _allocate_id(self) -> str:
+        """分配新的章节 ID，跳过已存在的文件（可能是其他进程写入、尚未记入 manifest 的章节）"""
+        while True:
+            chapter_id = f"{self.manifest['next_id']:06d}"
+            self.manifest["next_id"] += 1
+            self._manifest_dirty = True
+            if not os.path.exists(self.chapter_path(chapter_id)):
+                return chapter_id
+
+    def _new_entry(self, text: str, digest: str) -> Dict:
+        chapter_id = self._allocate_id()
+        self._texts[chapter_id] = text
+        self._dirty.add(chapter_id)
+        return {"id": chapter_id, "hash": digest, "chars": len(text)}
+
+    def set_title(self, title: str) -> None:
+        with self._lock:
+            if self.manifest.get("title") != title:
+                self.manifest["title"] = title
+                self._manifest_dirty = True
+
+    def set_outline(self, outline: str) -> None:
+        with self._lock:
+            if outline is self._outline:
+                return
+            digest = text_hash(outline)
+            self._outline = outline
+            if digest != self.manifest.get("outline_hash"):
+                self.manifest["outline_hash"] = digest
+                self._outline_dirty = True
+
+    def set_chapter(self, index: int, text: str) -> None:
+        """修改单个章节，index 等于章节数时追加新章节"""
+        with self._lock:
+            chapters = self.manifest["chapters"]
+            if index == len(chapters):
+                chapters.append(self._new_entry(text, text_hash(text)))
+                self._manifest_dirty = True
+                return
+            entry = chapters[index]
+            if self._texts.get(entry["id"]) is text:
+                return
+            digest = text_hash(text)
+            self._texts[entry["id"]] = text
+            if digest != entry["hash"]:
+                entry.update(hash=digest, chars=len(text))
+                self._dirty.add(entry["id"])
+                self._manifest_dirty = True
+
+    def set_chapters(self, texts: List[str]) -> None:
+        """整体设置章节列表，内容未变的章节（包括位置移动的）沿用原文件"""
+        with self._lock:
+            old = self.manifest["chapters"]
+            unused: Dict[str, List[Dict]] = {}
+            for entry in old:
+                unused.setdefault(entry["hash"], []).append(entry)
+
+            # 先按哈希匹配内容未变的章节（同一位置的文本对象未变时无需计算哈希）
+            digests = [
+                old[i]["hash"] if i < len(old) and self._texts.get(old[i]["id"]) is text else text_hash(text)
+                for i, text in enumerate(texts)
+            ]
+            chapters: List[Optional[Dict]] = [None] * len(texts)
+            for i, (text, digest) in enumerate(zip(texts, digests)):
+                candidates = unused.get(digest)
+                if candidates:
+                    entry = old[i] if i < len(old) and old[i] in candidates else candidates[0]
+                    candidates.remove(entry)
+                    self._texts[entry["id"]] = text
+                    chapters[i] = entry
+
+            # 其余章节优先沿用同一位置未被匹配的旧章节 ID 就地重写，否则新建
+            for i, (text, digest) in enumerate(zip(texts, digests)):
+                if chapters[i] is not None:
+                    continue
+                if i < len(old) and old[i] in unused.get(old[i]["hash"], []):
+                    entry = old[i]
+                    unused[entry["hash"]].remove(entry)
+                    entry.update(hash=digest, chars=len(text))
+                    self._texts[entry["id"]] = text
+                    self._dirty.add(entry["id"])
+                    self._manifest_dirty = True
+                else:
+                    entry = self._new_entry(text, digest)
+                chapters[i] = entry
+
+            removed = [entry["id"] for entries in unused.values() for entry in entries]
+            for chapter_id in removed:
+                self._texts.pop(chapter_id, None)
+                self._dirty.discard(chapter_id)
+                self._orphans.append(self.chapter_path(chapter_id))
+            if [e["id"] for e in chapters] != [e["id"] for e in old]:
+                self._manifest_dirty = True
+            self.manifest["chapters"] = chapters
+
+    def read_outline(self) -> str:
+        with self._lock:
+            if self._outline is None:
+                path = os.path.join(self.root, OUTLINE)
+                self._outline = ""
+                if os.path.exists(path):
+                    with open(path, encoding="utf-8") as f:
+                        self._outline = f.read()
+            return self._outline
+
+    def read_chapter(self, index: int) -> str:
+        with self._lock:
+            chapter_id = self.manifest["chapters"][index]["id"]
+            if chapter_id in self._texts:
+                return self._texts[chapter_id]
+        return read_text(self.chapter_path(chapter_id))
+
+    def read_chapters(self) -> List[str]:
+        return [self.read_chapter(i) for i in range(self.chapter_count)]
+
+    def write_chapter(self, text: str) -> Dict:
+        """立即以新 ID 写入一章并返回其条目，不改变 manifest 中的章节列表（保存时由 set_entries 引用）"""
+        with self._lock:
+            chapter_id = self._allocate_id()
+        atomic_write(self.chapter_path(chapter_id), text)
+        return {"id": chapter_id, "hash": text_hash(text), "chars": len(text)}
+
+    def set_entries(self, entries: List[Dict]) -> None:
+        """把章节列表设为已写入磁盘的条目（例如 ChapterHandle.entries），不再引用的旧章节在 flush 时删除"""
+        with self._lock:
+            old = self.manifest["chapters"]
+            keep = {entry["id"] for entry in entries}
+            for entry in old:
+                if entry["id"] not in keep:
+                    self._texts.pop(entry["id"], None)
+                    self._dirty.discard(entry["id"])
+                    self._orphans.append(self.chapter_path(entry["id"]))
+            entries = [dict(entry) for entry in entries]
+            if entries != old:
+                self.manifest["chapters"] = entries
+                self._manifest_dirty = True
+
+    def handle(self) -> ChapterHandle:
+        """当前章节列表的句柄（有未写入的章节时先 flush）"""
+        with self._lock:
+            if self._dirty:
+                self.flush()
+            return ChapterHandle(self.root, [dict(entry) for entry in self.manifest["chapters"]])
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._dirty or self._outline_dirty or self._manifest_dirty or self._orphans)
+
+    def flush(self) -> List[str]:
+        """写入所有脏章节与大纲，最后原子替换 manifest，返回写入的文件路径"""
+        with self._lock:
+            if not self.dirty:
+                return []
+            written = []
+            for chapter_id in sorted(self._dirty):
+                path = self.chapter_path(chapter_id)
+                atomic_write(path, self._texts[chapter_id])
+                written.append(path)
+            if self._outline_dirty:
+                path = os.path.join(self.root, OUTLINE)
+                atomic_write(path, self._outline or "")
+                written.append(path)
+            self.manifest["updated_at"] = datetime.now().isoformat(timespec="seconds")
+            path = os.path.join(self.root, MANIFEST)
+            atomic_write(path, json.dumps(self.manifest, ensure_ascii=False, indent=2))
+            written.append(path)
+            # manifest 已指向新文件后再删除不再引用的旧章节
+            for orphan in self._orphans:
+                if os.path.exists(orphan):
+                    os.remove(orphan)
+            self._dirty.clear()
+            self._texts.clear()  # 正文已在磁盘上，需要时再读取
+            self._orphans.clear()
+            self._outline_dirty = self._manifest_dirty = False
+            return written
+
+_stores: Dict[str, ProjectStore] = {}
+_stores_lock = threading.Lock()
+
+def get_store(root: str) -> ProjectStore:
+    """获取项目存储，同一目录在进程内共享一个实例以保留脏章节记录"""
+    root = os.path.abspath(root)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = ProjectStore(root)
+        return _stores[root]
+
+__all__ = [
+    "ChapterHandle",
+    "PartialChapters",
+    "ProjectStore",
+    "atomic_write",
+    "check_title",
+    "get_store",
+    "project_dir",
+    "project_title",
+    "read_text",
+]
@@ -0,0 +1,117 @@
+"""前缀稳定的提示词构建与上下文缓存统计
+
+同一项目的每次章节生成与修改请求都带着相同的大段前缀：系统提示词、小说概念与完整大纲。
+服务端的上下文缓存只复用逐字节相同的前缀，因此 PromptBuilder 把这三部分规范化（统一换行、去掉行尾空白）
+后按固定顺序放进 system 消息，前情概要、检索片段、章节要求等每次不同的内容一律放在其后的 user 消息中。
+概念或大纲不变时前缀不变，revision 为前缀的哈希。
+
+llm_client 把响应 usage 中的输入 token 与缓存命中 token 记到当前项目（project() 设置）名下，
+snapshot() 按项目给出命中率。
+"""
+import contextlib
+import contextvars
+import hashlib
+import threading
+from typing import Dict, Iterator, List, Optional
+
+SYSTEM_PROMPT = "你是一个善于创作小说的AI助手。"
+
+def normalize(text: str) -> str:
+    """统一换行并去掉行尾空白与首尾空行，使相同内容得到相同的字节"""
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip('\n')
+
+class PromptBuilder:
+    """按项目修订（概念 + 大纲）构建前缀固定的对话消息"""
+
+    def __init__(self, concept_text: str, outline: str = "", system: str = SYSTEM_PROMPT):
+        parts = [normalize(system), f"小说概念：\n{normalize(concept_text)}"]
+        if outline.strip():
+            parts.append(f"完整大纲：\n{normalize(outline)}")
+        self.prefix = '\n\n'.join(parts)
+        self.revision = hashlib.sha256(self.prefix.encode("utf-8")).hexdigest()[:16]
+
+    def system_message(self) -> Dict:
+        return {"role": "system", "content": self.prefix}
+
+    def messages(self, *volatile: str) -> List[Dict]:
+        """固定前缀之后接本次请求特有的内容（空段落会被跳过）"""
+        content = '\n\n'.join(part for part in volatile if part)
+        return [self.system_message(), {"role": "user", "content": content}]
+
+class CacheStats:
+    """按项目统计输入 token 与服务端缓存命中的 token"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._projects: Dict[str, Dict] = {}
+
+    def record(self, project: str, prompt_tokens: int, cached_tokens: int,
+               revision: Optional[str] = None) -> None:
+        with self._lock:
+            stats = self._projects.setdefault(project, {
+                "requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "revision": None})
+            stats["requests"] += 1
+            stats["prompt_tokens"] += prompt_tokens or 0
+            stats["cached_tokens"] += cached_tokens or 0
+            if revision is not None:
+                stats["revision"] = revision
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                project: {**stats, "hit_rate": stats["cached_tokens"] / stats["prompt_tokens"]
+                          if stats["prompt_tokens"] else 0.0}
+                for project, stats in self._projects.items()
+            }
+
+_current: contextvars.ContextVar = contextvars.ContextVar("novel_prompt_project", default=None)
+_stats = CacheStats()
+
+@contextlib.contextmanager
+def project(project_id: str, builder: Optional[PromptBuilder] = None) -> Iterator[None]:
+    """把上下文中的模型调用记到 project_id 名下（子任务与 to_thread 线程继承该设置）"""
+    token = _current.set((project_id, builder.revision if builder else None))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def current_project() -> Optional[str]:
+    current = _current.get()
+    return current[0] if current else None
+
+def record_usage(prompt_tokens: int, cached_tokens: int) -> None:
+    """记录一次模型调用的 token 用量，不在任何项目上下文中时忽略"""
+    current = _current.get()
+    if current is not None:
+        _stats.record(current[0], prompt_tokens, cached_tokens, current[1])
+
+def snapshot() -> Dict[str, Dict]:
+    """各项目的请求数、输入 token、缓存命中 token 与命中率"""
+    return _stats.snapshot()
+
+def format_snapshot(stats: Dict[str, Dict]) -> str:
+    """把 snapshot() 的结果整理成表格"""
+    lines = [f"{'项目':<24}{'修订':<18}{'请求':>6}{'输入tok':>10}{'缓存tok':>10}{'命中率':>8}"]
+    for project_id, row in sorted(stats.items()):
+        lines.append(f"{project_id:<24}{row['revision'] or '-':<18}{row['requests']:>6}{row['prompt_tokens']:>10}"
+                     f"{row['cached_tokens']:>10}{row['hit_rate']:>8.1%}")
+    return '\n'.join(lines)
+
+def reset_stats() -> None:
+    global _stats
+    _stats = CacheStats()
+
+__all__ = [
+    "CacheStats",
+    "PromptBuilder",
+    "SYSTEM_PROMPT",
+    "current_project",
+    "format_snapshot",
+    "normalize",
+    "project",
+    "record_usage",
+    "reset_stats",
+    "snapshot",
+]
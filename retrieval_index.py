@@ -0,0 +1,197 @@
+"""章节正文的本地检索索引
+
+把各章切成段落级片段，以汉字二元组（英文按单词）建立倒排索引并用 BM25 排序，
+索引保存在项目目录下的 SQLite 文件中，保存章节时只重建内容有变化的章节。
+生成或修改章节时可以只取回最相关的几个片段，而不必把大段正文放进提示词。
+"""
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+INDEX_FILE = "index.sqlite"
+
+_CJK_RUN = re.compile(r'[㐀-鿿豈-﫿]+')
+_WORD = re.compile(r'[0-9A-Za-z]+')
+
+def tokenize(text: str) -> List[str]:
+    """汉字按相邻二元组切分（单字成段时保留单字），字母数字按单词切分"""
+    terms = []
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    terms.extend(word.lower() for word in _WORD.findall(text))
+    return terms
+
+def split_passages(text: str, target_chars: int = 300) -> List[str]:
+    """按段落切分片段，过短的相邻段落合并到约 target_chars 字"""
+    passages: List[str] = []
+    current = ""
+    for paragraph in (p.strip() for p in text.split('\n')):
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) > target_chars:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+@dataclass
+class Passage:
+    """检索结果"""
+    chapter_id: str
+    position: int  # 章节序号（从 1 开始）
+    text: str
+    score: float
+
+class RetrievalIndex:
+    """基于汉字二元组倒排索引与 BM25 的检索索引"""
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chapters (chapter_id TEXT PRIMARY KEY, hash TEXT NOT NULL, position INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS passages (passage_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " chapter_id TEXT NOT NULL, text TEXT NOT NULL, length INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_passages_chapter ON passages (chapter_id)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, passage_id INTEGER NOT NULL,"
+                " tf INTEGER NOT NULL, PRIMARY KEY (term, passage_id)) WITHOUT ROWID"
+            )
+
+    def _remove_chapter(self, chapter_id: str) -> None:
+        ids = [row[0] for row in self._conn.execute(
+            "SELECT passage_id FROM passages WHERE chapter_id = ?", (chapter_id,))]
+        self._conn.executemany("DELETE FROM postings WHERE passage_id = ?", [(i,) for i in ids])
+        self._conn.execute("DELETE FROM passages WHERE chapter_id = ?", (chapter_id,))
+        self._conn.execute("DELETE FROM chapters WHERE chapter_id = ?", (chapter_id,))
+
+    def _add_chapter(self, chapter_id: str, text_hash: str, position: int, text: str) -> None:
+        self._conn.execute("INSERT INTO chapters (chapter_id, hash, position) VALUES (?, ?, ?)",
+                           (chapter_id, text_hash, position))
+        for passage in split_passages(text):
+            terms = Counter(tokenize(passage))
+            cursor = self._conn.execute(
+                "INSERT INTO passages (chapter_id, text, length) VALUES (?, ?, ?)",
+                (chapter_id, passage, sum(terms.values())),
+            )
+            self._conn.executemany(
+                "INSERT INTO postings (term, passage_id, tf) VALUES (?, ?, ?)",
+                [(term, cursor.lastrowid, tf) for term, tf in terms.items()],
+            )
+
+    def sync(self, chapters: Iterable[Tuple[str, Union[str, Callable[[], str]]]],
+             hashes: Optional[List[str]] = None) -> List[str]:
+        """按章节顺序同步索引，chapters 为 (章节 ID, 正文)，返回重新索引的章节 ID
+
+        传入 hashes（例如项目 manifest 中已有的哈希）时不再重复计算；此时正文也可以是
+        读取正文的函数，只有需要重新索引的章节才会被读取。
+        """
+        if hashes is None:
+            chapters = list(chapters)
+            hashes = [hashlib.sha1(text.encode("utf-8")).hexdigest() for _, text in chapters]
+        reindexed = []
+        with self._lock, self._conn:
+            known = dict(self._conn.execute("SELECT chapter_id, hash FROM chapters"))
+            for position, ((chapter_id, text), text_hash) in enumerate(zip(chapters, hashes), 1):
+                if known.pop(chapter_id, None) == text_hash:
+                    self._conn.execute("UPDATE chapters SET position = ? WHERE chapter_id = ?",
+                                       (position, chapter_id))
+                    continue
+                self._remove_chapter(chapter_id)
+                self._add_chapter(chapter_id, text_hash, position, text() if callable(text) else text)
+                reindexed.append(chapter_id)
+            for chapter_id in known:
+                self._remove_chapter(chapter_id)
+        return reindexed
+
+    def search(self, query: str, k: int = 3, exclude_positions: Iterable[int] = (),
+               before_position: Optional[int] = None) -> List[Passage]:
+        """返回与 query 最相关的 k 个片段
+
+        exclude_positions 中的章节不参与检索；提供 before_position 时只检索位置在它之前的章节。
+        """
+        terms = Counter(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            total, avg_length = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(AVG(length), 0) FROM passages").fetchone()
+            if not total:
+                return []
+            scores: Dict[int, float] = {}
+            for term, query_tf in terms.items():
+                postings = self._conn.execute(
+                    "SELECT p.passage_id, p.tf, s.length FROM postings p"
+                    " JOIN passages s ON s.passage_id = p.passage_id WHERE p.term = ?", (term,)
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for passage_id, tf, length in postings:
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[passage_id] = scores.get(passage_id, 0.0) + query_tf * idf * tf * (self.k1 + 1) / norm
+
+            excluded = set(exclude_positions)
+            results = []
+            for passage_id, score in sorted(scores.items(), key=lambda item: -item[1]):
+                chapter_id, position, text = self._conn.execute(
+                    "SELECT s.chapter_id, c.position, s.text FROM passages s"
+                    " JOIN chapters c ON c.chapter_id = s.chapter_id WHERE s.passage_id = ?", (passage_id,)
+                ).fetchone()
+                if position in excluded or (before_position is not None and position >= before_position):
+                    continue
+                results.append(Passage(chapter_id, position, text, score))
+                if len(results) >= k:
+                    break
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+def format_passages(passages: List[Passage]) -> str:
+    """把检索结果整理成提示词中的参考片段"""
+    if not passages:
+        return ""
+    return "相关前文片段：\n" + '\n'.join(f"[第{p.position}章] {p.text}" for p in passages)
+
+_indexes: Dict[str, RetrievalIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_index(project_root: str) -> RetrievalIndex:
+    """获取项目的检索索引，进程内共享"""
+    root = os.path.abspath(project_root)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = RetrievalIndex(os.path.join(root, INDEX_FILE))
+        return _indexes[root]
+
+__all__ = [
+    "Passage",
+    "RetrievalIndex",
+    "format_passages",
+    "get_index",
+    "split_passages",
+    "tokenize",
+]
@@ -0,0 +1,175 @@
+"""滚动摘要上下文
+
+随小说增长维护两级摘要：每章一段摘要，每 arc_size 章再合并为一段篇章摘要。
+章节保存时只为内容有变化的章节重新生成摘要；生成某一章时，用小说概念、相关摘要
+和上一章末尾的一段原文拼出上下文，并控制在固定的 token 预算内，使每章的提示词成本基本恒定。
+"""
+import asyncio
+import hashlib
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+import llm_client
+from prompt_builder import SYSTEM_PROMPT
+
+# 异步摘要函数：(待摘要文本, 目标字数) -> 摘要
+Summarizer = Callable[[str, int], Awaitable[str]]
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+async def llm_summarize(text: str, max_chars: int) -> str:
+    """调用模型生成摘要"""
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": (
+            f"请用不超过{max_chars}字概括以下小说内容，保留人物、地点、事件和伏笔，只输出概要：\n{text}"
+        )},
+    ]
+    response = await llm_client.achat_completion(messages, task="summary", max_tokens=max_chars * 2)
+    return (response.choices[0].message.content or "").strip()
+
+class StoryContext:
+    """章节摘要与篇章摘要的层级结构，可序列化后随 NovelState 保存"""
+
+    def __init__(self, arc_size: int = 10, summary_chars: int = 200):
+        self.arc_size = arc_size
+        self.summary_chars = summary_chars
+        self.chapters: List[Dict] = []  # 每章 {"hash": 正文哈希, "summary": 摘要}
+        self.arcs: List[Dict] = []  # 每个完整篇章 {"hash": 所含章节摘要的哈希, "summary": 摘要}
+
+    @classmethod
+    def from_env(cls) -> "StoryContext":
+        return cls(
+            arc_size=int(os.getenv("NOVEL_ARC_SIZE", "10")),
+            summary_chars=int(os.getenv("NOVEL_SUMMARY_CHARS", "200")),
+        )
+
+    def to_dict(self) -> Dict:
+        return {"arc_size": self.arc_size, "summary_chars": self.summary_chars,
+                "chapters": self.chapters, "arcs": self.arcs}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> "StoryContext":
+        if not data:
+            return cls.from_env()
+        context = cls(data.get("arc_size", 10), data.get("summary_chars", 200))
+        context.chapters = list(data.get("chapters", []))
+        context.arcs = list(data.get("arcs", []))
+        return context
+
+    def stale_chapters(self, chapters: Sequence[str], hashes: Optional[List[str]] = None) -> List[int]:
+        """摘要缺失或已过期的章节序号（从 0 开始）"""
+        if hashes is None:
+            hashes = [_hash(text) for text in chapters]
+        return [
+            i for i, digest in enumerate(hashes)
+            if i >= len(self.chapters) or self.chapters[i]["hash"] != digest
+        ]
+
+    async def update(self, chapters: Sequence[str], summarize: Summarizer = llm_summarize,
+                     concurrency: int = 4, hashes: Optional[List[str]] = None) -> List[int]:
+        """增量更新摘要，只处理有变化的章节及其所在篇章，返回重新摘要的章节序号
+
+        chapters 可以是按需读取正文的序列（如 ChapterHandle），提供各章哈希 hashes 时
+        只读取需要重新摘要的章节，且每章在取得并发名额后才读取。
+        """
+        if hashes is None:
+            hashes = [_hash(text) for text in chapters]
+        stale = self.stale_chapters(chapters, hashes)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(read: Callable[[], str], max_chars: int) -> str:
+            async with semaphore:
+                return await summarize(read(), max_chars)
+
+        summaries = await asyncio.gather(*(run(lambda i=i: chapters[i], self.summary_chars) for i in stale))
+        del self.chapters[len(chapters):]
+        for i, summary in zip(stale, summaries):
+            entry = {"hash": hashes[i], "summary": summary}
+            if i < len(self.chapters):
+                self.chapters[i] = entry
+            else:
+                self.chapters.append(entry)
+
+        # 只为完整的篇章生成篇章摘要，未满的最后一个篇章直接使用章节摘要
+        arc_count = len(chapters) // self.arc_size
+        del self.arcs[arc_count:]
+        jobs = []
+        for a in range(arc_count):
+            joined = '\n'.join(c["summary"] for c in self.chapters[a * self.arc_size:(a + 1) * self.arc_size])
+            if a >= len(self.arcs) or self.arcs[a]["hash"] != _hash(joined):
+                jobs.append((a, joined))
+        arc_summaries = await asyncio.gather(*(run(lambda joined=joined: joined, self.summary_chars * 2)
+                                               for _, joined in jobs))
+        for (a, joined), summary in zip(jobs, arc_summaries):
+            entry = {"hash": _hash(joined), "summary": summary}
+            if a < len(self.arcs):
+                self.arcs[a] = entry
+            else:
+                self.arcs.append(entry)
+        return stale
+
+    def build(self, index: int, chapters: Sequence[str], budget_tokens: int = 3000,
+              recent_chars: int = 1500, hashes: Optional[Sequence[Optional[str]]] = None) -> str:
+        """为第 index 章（从 0 开始）构建前情提要
+
+        上一章末尾 recent_chars 字原文始终保留；其余预算从近到远依次放入当前篇章的章节摘要
+        和之前各篇章的摘要，超出预算的较早内容被舍弃。
+
+        提供 chapters 各位置当前正文的哈希 hashes 时按哈希查找章节摘要（None 表示该位置尚无正文），
+        章节增删或移动后仍能取到对应章节的摘要；篇章摘要只在该篇章各章与记录完全一致时使用。
+        """
+        recent = (chapters[index - 1] or "")[-recent_chars:] if 0 < index <= len(chapters) else ""
+        remaining = budget_tokens - llm_client.estimate_tokens(recent)
+
+        if hashes is None:
+            summaries: List[Optional[str]] = [c["summary"] for c in self.chapters]
+        else:
+            by_hash = {c["hash"]: c["summary"] for c in self.chapters}
+            summaries = [by_hash.get(digest) if digest else None for digest in hashes]
+
+        def arc_summary(a: int) -> Optional[str]:
+            if a >= len(self.arcs):
+                return None
+            span = slice(a * self.arc_size, (a + 1) * self.arc_size)
+            if hashes is not None and [c["hash"] for c in self.chapters[span]] != list(hashes[span]):
+                return None
+            return self.arcs[a]["summary"]
+
+        # 候选摘要，按由近及远的顺序排列
+        candidates = []
+        current_arc = index // self.arc_size
+        for i in range(index - 1, current_arc * self.arc_size - 1, -1):
+            if i < len(summaries) and summaries[i]:
+                candidates.append(f"第{i + 1}章概要：{summaries[i]}")
+        for a in range(current_arc - 1, -1, -1):
+            first, last = a * self.arc_size + 1, (a + 1) * self.arc_size
+            summary = arc_summary(a)
+            if summary is not None:
+                candidates.append(f"第{first}-{last}章概要：{summary}")
+            else:
+                candidates.extend(
+                    f"第{i + 1}章概要：{summaries[i]}"
+                    for i in range(last - 1, first - 2, -1) if i < len(summaries) and summaries[i]
+                )
+
+        selected = []
+        for line in candidates:
+            cost = llm_client.estimate_tokens(line)
+            if cost > remaining:
+                break
+            selected.append(line)
+            remaining -= cost
+
+        parts = []
+        if selected:
+            parts.append("前情概要：\n" + '\n'.join(reversed(selected)))
+        if recent:
+            parts.append(f"上一章结尾：\n{recent}")
+        return '\n\n'.join(parts)
+
+__all__ = [
+    "StoryContext",
+    "llm_summarize",
+]
@@ -0,0 +1,108 @@
+"""结构化输出与逐字段修复
+
+让模型以 JSON 模式输出 pydantic 模型的各个字段，并逐字段校验：只有部分字段缺失或不合法时，
+追加一次小请求只重新生成这些字段，而不是整体重新生成或放弃已生成的内容。
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+import llm_client
+
+Model = TypeVar("Model", bound=BaseModel)
+
+class StructuredOutputError(ValueError):
+    """模型输出无法解析为 JSON 对象"""
+
+def load_json_object(content: str) -> Dict:
+    """解析模型输出的 JSON 对象，允许外层包裹代码块"""
+    text = (content or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.index('\n') + 1:] if '\n' in text else text
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise StructuredOutputError(f"无法解析 JSON：{e}") from e
+    if not isinstance(data, dict):
+        raise StructuredOutputError("输出不是 JSON 对象")
+    return data
+
+def validate_fields(model: Type[Model], data: Dict, required: Iterable[str] = (),
+                    types: Optional[Dict[str, Any]] = None) -> Tuple[Dict, Dict[str, str]]:
+    """逐字段校验，返回 (合法字段的值, {不合法字段: 原因})
+
+    required 中的字段缺失或为空时视为不合法；types 可为个别字段指定比模型更严格的校验类型，
+    校验通过后转换回普通的 Python 值。
+    """
+    types = types or {}
+    valid: Dict = {}
+    errors: Dict[str, str] = {}
+    for name, field in model.model_fields.items():
+        if name not in data or data[name] in (None, "", [], {}):
+            if name in required:
+                errors[name] = "缺失"
+            continue
+        adapter = TypeAdapter(types.get(name, field.annotation))
+        try:
+            valid[name] = adapter.dump_python(adapter.validate_python(data[name]))
+        except ValidationError as e:
+            errors[name] = "; ".join(err["msg"] for err in e.errors())
+    return valid, errors
+
+def generate_model(model: Type[Model], messages: List[Dict], required: Iterable[str] = (),
+                   types: Optional[Dict[str, Any]] = None, repairs: int = 2,
+                   **kwargs) -> Tuple[Model, Dict[str, str]]:
+    """以 JSON 模式生成模型实例，返回 (实例, 修复后仍不合法的字段)
+
+    整体无法解析时带着错误重试一次；之后每轮只请求重新生成不合法的字段，最多 repairs 轮。
+    仍不合法的字段保留模型默认值，由调用方决定如何处理。修复请求以 "repair" 任务路由，
+    可以交给更快的模型。
+    """
+    required = list(required)
+    messages = list(messages)
+    data: Optional[Dict] = None
+    for attempt in range(2):
+        response = llm_client.chat_completion(messages, response_format={"type": "json_object"}, **kwargs)
+        content = response.choices[0].message.content or ""
+        try:
+            data = load_json_object(content)
+            break
+        except StructuredOutputError as e:
+            if attempt:
+                raise
+            messages += [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": f"{e}。请只输出一个完整的 JSON 对象。"},
+            ]
+
+    valid, errors = validate_fields(model, data, required, types)
+    messages.append({"role": "assistant", "content": content})
+    for _ in range(repairs):
+        if not errors:
+            break
+        problems = '\n'.join(f"- {name}：{reason}" for name, reason in errors.items())
+        messages.append({"role": "user", "content": (
+            f"以下字段缺失或不合法：\n{problems}\n"
+            f"请只输出包含这些字段（{', '.join(errors)}）的 JSON 对象，其余字段不要重复输出。"
+        )})
+        response = llm_client.chat_completion(messages, response_format={"type": "json_object"},
+                                              **{**kwargs, "task": "repair"})
+        content = response.choices[0].message.content or ""
+        messages.append({"role": "assistant", "content": content})
+        try:
+            patch = load_json_object(content)
+        except StructuredOutputError:
+            continue
+        fixed, still = validate_fields(model, {name: patch.get(name) for name in errors}, required, types)
+        valid.update(fixed)
+        errors = {name: still.get(name, "缺失") for name in errors if name not in fixed}
+    return model(**valid), errors
+
+__all__ = [
+    "StructuredOutputError",
+    "generate_model",
+    "load_json_object",
+    "validate_fields",
+]
@@ -1,15 +1,43 @@
+import asyncio
+import json
 import os
+import tempfile
+import threading
 import unittest
+from types import SimpleNamespace
+from unittest import mock
 from novel_agent import (
+    ConceptStreamParser,
+    _draft_chapters,
+    collect_initial_concept,
     NovelConcept,
+    create_initial_draft,
+    discuss_outline,
+    get_user_feedback,
+    generate_concepts,
+    open_checkpointer,
+    split_outline,
     NovelState,
     create_concept_workflow,
     create_novel_workflow,
+    get_novel_graph,
+    initial_novel_state,
     generate_concept_with_ai,
     save_concept,
     save_draft,
+    save_novel,
     summarize_concept
 )
+import call_governor
+import input_provider
+import llm_client
+import outline_prefetch
+import retrieval_index
+import version_store
+from input_provider import ScriptedInput
+from mock_qwen_server import MockQwenServer
+from project_store import ChapterHandle, PartialChapters
+from story_context import StoryContext
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -42,6 +70,16 @@ class TestNovelAgent(unittest.TestCase):
             'user_feedback': ''
         }
 
+        # 模型请求发往本地模拟服务，测试不依赖网络与 API 密钥
+        self.qwen = MockQwenServer(latency=0, tokens_per_second=1e6, seed=0).start()
+        llm_client.configure(base_url=self.qwen.url, api_key="mock")
+        call_governor.configure(call_governor.CallGovernor(call_governor.GovernorSettings(max_retries=0)))
+
+    def tearDown(self):
+        call_governor.configure()
+        llm_client.configure()
+        self.qwen.stop()
+
     def test_concept_workflow(self):
         """测试概念工作流"""
         concept_workflow = create_concept_workflow()
@@ -64,14 +102,15 @@ class TestNovelAgent(unittest.TestCase):
         # 但这通常用于 stream 或 async stream，对于 invoke 直接指定节点可能需要另一种方式
         # 或者我们直接在 invoke config 中设置起始节点 (虽然文档不完全明确支持所有情况)
         
-        # 尝试直接在 invoke config 中指定起始节点和模拟输入
-        result = compiled_concept_workflow.invoke(
-            state_after_summary, 
-            {
-                'get_feedback': {'user_input': '1'},
-                'configurable': {'keys': ['should_continue']} # 尝试指定起始节点，可能不完全生效
-            }
-        )
+        # 尝试直接在 invoke config 中指定起始节点；工作流中的提问由 AutoConfirmInput 回答（AI 生成并确认）
+        with input_provider.using(input_provider.AutoConfirmInput()):
+            result = compiled_concept_workflow.invoke(
+                state_after_summary,
+                {
+                    'get_feedback': {'user_input': '1'},
+                    'configurable': {'keys': ['should_continue']} # 尝试指定起始节点，可能不完全生效
+                }
+            )
         
         self.assertIsNotNone(result)
         self.assertIn('concept', result)
@@ -161,5 +200,571 @@ class TestNovelAgent(unittest.TestCase):
         # 例如：
         # self.assertTrue(os.path.exists(novel_result.get('save_path', '')))
 
+class TestConceptStreamParser(unittest.TestCase):
+    SAMPLE = (
+        "标题：星河彼岸\n类型：科幻\n主题：寻找归途\n目标读者：青年读者\n"
+        "背景设定：二十三世纪的星际殖民地\n写作风格：冷峻\n预计字数：120000字\n\n"
+        "主要人物：\n林远 - 主角：沉默的领航员\n苏晴 - 配角：机械师\n\n"
+        "关键情节点：\n- 飞船失事\n- 发现信号\n\n补充说明：无\n【概念结束】\n"
+        "以下内容不应被读取\n"
+    )
+
+    def test_fields_emitted_as_lines_complete(self):
+        """测试字段在行完整时即被解析"""
+        fields = []
+        parser = ConceptStreamParser(NovelConcept(), on_field=lambda k, v: fields.append(k))
+        parser.feed("标题：星河")
+        self.assertEqual(fields, [])
+        parser.feed("彼岸\n类")
+        self.assertEqual(fields, ['标题'])
+        self.assertEqual(parser.concept.title, "星河彼岸")
+
+    def test_done_after_end_marker(self):
+        """测试遇到结束标记后标记完成，且分块方式不影响结果"""
+        parser = ConceptStreamParser(NovelConcept())
+        for i in range(0, len(self.SAMPLE), 7):
+            parser.feed(self.SAMPLE[i:i + 7])
+            if parser.done:
+                break
+        concept = parser.close()
+        self.assertTrue(parser.done)
+        self.assertFalse(parser.broken)
+        self.assertEqual(concept.word_count_target, 120000)
+        self.assertEqual([c['name'] for c in concept.main_characters], ["林远", "苏晴"])
+        self.assertEqual(concept.key_plot_points, ["飞船失事", "发现信号"])
+        self.assertEqual(concept.additional_notes, "无")
+
+    def test_multiline_notes_are_kept(self):
+        """测试多行补充说明完整保留，不会在第一行后结束"""
+        fields = {}
+        parser = ConceptStreamParser(NovelConcept(), on_field=fields.__setitem__)
+        parser.feed(self.SAMPLE.replace("补充说明：无\n", "补充说明：双线叙事\n\n结局开放\n"))
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.close().additional_notes, "双线叙事\n结局开放")
+        self.assertEqual(fields['补充说明'], "双线叙事\n结局开放")
+
+        parser = ConceptStreamParser(NovelConcept())
+        parser.feed("补充说明：第一行\n第二行")
+        self.assertFalse(parser.done)  # 没有结束标记时读到流结束为止
+        self.assertEqual(parser.close().additional_notes, "第一行\n第二行")
+
+    def test_streamed_concept_from_server(self):
+        """测试从模拟服务流式生成概念时多行补充说明完整，结束标记之后不再读取"""
+        server = MockQwenServer(latency=0, tokens_per_second=1e6, seed=0).start()
+        llm_client.configure(base_url=server.url, api_key="mock")
+        call_governor.configure(call_governor.CallGovernor(call_governor.GovernorSettings(max_retries=0)))
+        try:
+            state = {'concept': NovelConcept(), 'user_input': '', 'feedback_needed': True}
+            result = generate_concept_with_ai(state, stream=True)
+        finally:
+            call_governor.configure()
+            llm_client.configure()
+            server.stop()
+        self.assertEqual(result['concept'].title, "雾港来信")
+        self.assertEqual(result['concept'].additional_notes, "全书以沈默的第一人称叙述\n每章开头引用一封旧信")
+        self.assertEqual(len(result['concept'].key_plot_points), 5)
+
+    def test_streaming_generation_stops_early(self):
+        """测试流式生成在输出结束标记后提前关闭流，并把已收到的内容标记为完整响应"""
+        pieces = [self.SAMPLE[i:i + 5] for i in range(0, len(self.SAMPLE), 5)] + ["多余"] * 50
+        consumed = []
+
+        class FakeStream:
+            closed = None
+            def __iter__(self):
+                for piece in pieces:
+                    consumed.append(piece)
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+            def close(self, complete=False):
+                FakeStream.closed = complete
+
+        state = {'concept': NovelConcept(), 'user_input': '', 'feedback_needed': True}
+        with mock.patch("llm_client.chat_completion", return_value=FakeStream()):
+            result = generate_concept_with_ai(state, stream=True)
+        self.assertIs(FakeStream.closed, True)
+        self.assertLess(len(consumed), len(pieces) - 40)
+        self.assertEqual(result['concept'].title, "星河彼岸")
+
+    def test_broken_format(self):
+        """测试输出偏离格式时标记为损坏"""
+        parser = ConceptStreamParser(NovelConcept(), max_unrecognized=3)
+        parser.feed("好的，下面是一个概念。\n" * 4)
+        self.assertTrue(parser.broken)
+
+class TestStructuredConcept(unittest.TestCase):
+    def test_partial_failure_is_repaired_without_manual_input(self):
+        """测试结构化输出中个别字段不合法时只修复这些字段，不转入手动输入"""
+        first = ('{"title": "雾港来信", "genre": "悬疑", "logline": "旧信揭开旧案", "target_audience": "成年读者",'
+                 ' "setting": "港口小城", "style_and_tone": "冷静", "word_count_target": "十二万",'
+                 ' "main_characters": [{"name": "沈默"}], "key_plot_points": ["发现旧信"]}')
+        repair = ('{"word_count_target": 120000,'
+                  ' "main_characters": [{"name": "沈默", "role": "主角", "traits": "分拣员"}]}')
+        replies = [SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=c))])
+                   for c in (first, repair)]
+        state = {'concept': NovelConcept(), 'user_input': '', 'feedback_needed': True}
+        with mock.patch("llm_client.chat_completion", side_effect=replies) as completion, \
+                mock.patch("builtins.input", side_effect=AssertionError("不应转入手动输入")):
+            result = generate_concept_with_ai(state, stream=False, structured=True)
+
+        self.assertEqual(completion.call_count, 2)
+        concept = result['concept']
+        self.assertEqual(concept.title, "雾港来信")
+        self.assertEqual(concept.word_count_target, 120000)
+        self.assertEqual(concept.main_characters, [{"name": "沈默", "role": "主角", "traits": "分拣员"}])
+        self.assertEqual(concept.key_plot_points, ["发现旧信"])
+
+    def test_unattended_failures_are_bounded(self):
+        """测试无人值守时 AI 生成概念反复失败会在有限次数后报错，而不是无限重试"""
+        state = {'concept': NovelConcept(), 'user_input': '', 'feedback_needed': True}
+        with mock.patch.dict(os.environ, {"NOVEL_CONCEPT_ATTEMPTS": "3"}), \
+                mock.patch("llm_client.chat_completion", side_effect=RuntimeError("服务不可用")) as completion, \
+                input_provider.using(input_provider.AutoConfirmInput()):
+            with self.assertRaisesRegex(RuntimeError, "连续失败 3 次"):
+                collect_initial_concept(state)
+        self.assertEqual(completion.call_count, 3)
+
+    def test_interactive_failures_fall_back_to_manual_input(self):
+        """测试交互输入时多次生成失败后转为手动输入"""
+        state = {'concept': NovelConcept(), 'user_input': '', 'feedback_needed': True}
+        provider = ScriptedInput({"请选择（1-2）": "2", "标题": "手写标题", "字数": "1000"})
+        provider.unattended = False
+        with mock.patch.dict(os.environ, {"NOVEL_CONCEPT_ATTEMPTS": "2"}), \
+                mock.patch("llm_client.chat_completion", side_effect=RuntimeError("服务不可用")) as completion, \
+                input_provider.using(provider):
+            result = collect_initial_concept(state)
+        self.assertEqual(completion.call_count, 2)
+        self.assertEqual(result['concept'].title, "手写标题")
+
+class TestBatchConcepts(unittest.TestCase):
+    CONCEPTS = {
+        0: "标题：雾港谜案\n主题：分拣员追查一封寄给死者的信\n关键情节点：\n- 收到信件\n- 追查寄信人",
+        1: "标题：雾港谜案\n主题：分拣员追查一封寄给死者的来信\n关键情节点：\n- 收到信件\n- 追查寄信人",
+        2: "标题：星海远征\n主题：舰队在银河边缘遭遇未知文明\n关键情节点：\n- 跃迁失败\n- 首次接触",
+        3: "无法解析的输出",
+    }
+
+    def test_generate_concepts_concurrently_without_duplicates(self):
+        """测试批量概念并发生成、各自解析并去除近似重复"""
+        seeds, running, peak = [], [0], [0]
+
+        async def fake_completion(messages, seed=None, **kwargs):
+            seeds.append(seed)
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.01)
+            running[0] -= 1
+            if seed == 4:
+                raise RuntimeError("timeout")
+            content = self.CONCEPTS.get(seed, "")
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+        with mock.patch("llm_client.achat_completion", fake_completion):
+            concepts = generate_concepts(5, concurrency=3)
+
+        self.assertEqual(sorted(seeds), [0, 1, 2, 3, 4])
+        self.assertEqual(peak[0], 3)
+        self.assertEqual(sorted(c.title for c in concepts), ["星海远征", "雾港谜案"])
+        self.assertEqual(len({id(c) for c in concepts}), 2)
+
+class TestDraftGeneration(unittest.TestCase):
+    OUTLINE = "总述\n第一章 启程\n离开故乡\n第二章 风暴\n第三章 归来"
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {"NOVEL_WORKING_DIR": self.tmpdir.name})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def test_split_outline(self):
+        """测试按章节标题拆分大纲"""
+        self.assertEqual(split_outline(self.OUTLINE), ["第一章 启程\n离开故乡", "第二章 风暴", "第三章 归来"])
+        self.assertEqual(split_outline(""), [])
+
+    def test_chapters_drafted_concurrently_in_order(self):
+        """测试并发生成的章节按大纲顺序写回，输出为空的章节单独重新生成"""
+        calls = []
+
+        async def fake_completion(messages, **kwargs):
+            chapter = messages[-1]['content'].split("只输出正文：\n", 1)[1]
+            calls.append(chapter)
+            content = "" if chapter == "第二章 风暴" and calls.count(chapter) == 1 else f"正文：{chapter[:3]}"
+            await asyncio.sleep(0.01 if chapter.startswith("第一章") else 0)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+        state = {'concept': NovelConcept(title="测试"), 'outline': self.OUTLINE}
+        env = {"NOVEL_DRAFT_CONCURRENCY": "2", "NOVEL_CHAPTER_RETRIES": "1"}
+        with mock.patch.dict(os.environ, env), \
+                mock.patch("llm_client.achat_completion", fake_completion):
+            result = create_initial_draft(state)
+
+        self.assertEqual(result['chapters'], ["正文：第一章", "正文：第二章", "正文：第三章"])
+        self.assertEqual(result['failed_chapters'], [])
+        self.assertEqual(calls.count("第二章 风暴"), 2)
+        self.assertIsInstance(result['chapters'], ChapterHandle)
+        self.assertEqual(result['chapters'].text(), "正文：第一章\n\n正文：第二章\n\n正文：第三章")
+
+    def test_retrieval_runs_off_event_loop(self):
+        """测试检索在工作线程中执行，不阻塞事件循环，检索到的片段附在章节提示词中"""
+        index = retrieval_index.RetrievalIndex(os.path.join(self.tmpdir.name, "index.sqlite"))
+        index.sync([("000001", "沈默的左手有一道旧伤疤。"), ("000002", "林晚回到雾港。")])
+        threads, prompts = [], []
+        search = index.search
+
+        def tracking_search(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return search(*args, **kwargs)
+
+        async def fake_completion(messages, **kwargs):
+            prompts.append(messages[-1]['content'])
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="正文"))])
+
+        entries = ["第三章 雾港", "第四章 伤疤的来历"]
+        try:
+            with mock.patch.object(index, "search", side_effect=tracking_search), \
+                    mock.patch("llm_client.achat_completion", fake_completion):
+                asyncio.run(_draft_chapters(NovelConcept(title="测试"), '\n'.join(entries), entries,
+                                            concurrency=2, retries=0, retriever=index))
+        finally:
+            index.close()
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertTrue(any("旧伤疤" in prompt for prompt in prompts))
+        # 第 1 章之前没有前文，不会检索到它自己或之后章节的片段
+        self.assertFalse(any("相关前文片段" in prompt for prompt in prompts if prompt.endswith("第三章 雾港")))
+
+    def test_transport_errors_are_not_retried_per_chapter(self):
+        """测试请求错误不在章节层重试（已由 call_governor 重试），熔断时直接中止"""
+        calls = []
+
+        async def failing(messages, **kwargs):
+            calls.append(messages)
+            raise RuntimeError("timeout")
+
+        state = {'concept': NovelConcept(title="测试"), 'outline': self.OUTLINE}
+        with mock.patch.dict(os.environ, {"NOVEL_CHAPTER_RETRIES": "2"}), \
+                mock.patch("llm_client.achat_completion", failing):
+            result = create_initial_draft(dict(state))
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(result['failed_chapters'], [1, 2, 3])
+
+        async def circuit_open(messages, **kwargs):
+            raise call_governor.CircuitOpenError("熔断")
+
+        with mock.patch("llm_client.achat_completion", circuit_open), \
+                self.assertRaises(call_governor.CircuitOpenError):
+            create_initial_draft(dict(state))
+
+    def test_outline_edit_regenerates_only_changed_chapters(self):
+        """测试修改大纲后只重新生成受影响的章节"""
+        calls = []
+
+        async def fake_completion(messages, **kwargs):
+            chapter = messages[-1]['content'].split("只输出正文：\n", 1)[1]
+            calls.append(chapter)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"正文：{chapter}"))])
+
+        state = {'concept': NovelConcept(title="测试"), 'outline': self.OUTLINE}
+        with mock.patch("llm_client.achat_completion", fake_completion):
+            state = create_initial_draft(state)
+            state['outline'] = "第一章 启程\n离开故乡\n第二章 暴雨\n第三章 归来"
+            calls.clear()
+            state = create_initial_draft(state)
+
+        self.assertEqual(calls, ["第二章 暴雨"])
+        self.assertEqual(state['chapters'], ["正文：第一章 启程\n离开故乡", "正文：第二章 暴雨", "正文：第三章 归来"])
+
+    def test_context_follows_chapter_identity(self):
+        """测试插入章节后按新位置取前文：需要重新生成的章节不会拿到自己旧版本的正文"""
+        prompts = {}
+
+        async def fake_completion(messages, **kwargs):
+            chapter = messages[-1]['content'].split("只输出正文：\n", 1)[1]
+            prompts[chapter] = messages[-1]['content']
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"正文：{chapter}"))])
+
+        state = {'concept': NovelConcept(title="测试"), 'outline': self.OUTLINE}
+        with mock.patch.dict(os.environ, {"NOVEL_RETRIEVAL": "false"}), \
+                mock.patch("llm_client.achat_completion", fake_completion):
+            state = create_initial_draft(state)
+            state['outline'] = "第一章 启程\n离开故乡\n第二章 插曲\n第三章 风暴\n第四章 归来"
+            prompts.clear()
+            create_initial_draft(state)
+
+        self.assertIn("上一章结尾：\n正文：第一章 启程", prompts["第二章 插曲"])
+        self.assertNotIn("正文：第二章 风暴", prompts["第三章 风暴"])
+
+    def test_missing_previous_chapter_does_not_abort_other_chapters(self):
+        """测试前文文件读取失败时该章不附带前情，其他章节照常生成"""
+        async def fake_completion(messages, **kwargs):
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="正文"))])
+
+        entries = ["第一章 起", "第二章 承", "第三章 转"]
+        previous = PartialChapters(self.tmpdir.name, [{"id": "c9999", "hash": "x", "chars": 1}, None, None])
+        with mock.patch("llm_client.achat_completion", fake_completion):
+            results = asyncio.run(_draft_chapters(NovelConcept(title="测试"), '\n'.join(entries), entries,
+                                                  concurrency=2, retries=0, context=StoryContext(),
+                                                  previous=previous, indices=[1, 2]))
+        self.assertEqual(results, [None, "正文", "正文"])
+
+    def test_summary_failure_keeps_previous_context(self):
+        """测试保存时摘要更新失败只记录错误，保留上次的摘要"""
+        async def failing(messages, **kwargs):
+            raise RuntimeError("服务不可用")
+
+        previous = {"arc_size": 10, "summary_chars": 200, "chapters": [{"hash": "旧", "summary": "旧摘要"}], "arcs": []}
+        state = {'concept': NovelConcept(title="摘要失败"), 'outline': "第一章 起",
+                 'chapters': ["海雾漫过码头。"], 'story_context': previous}
+        with mock.patch.dict(os.environ, {"NOVEL_SUMMARIES": "true", "NOVEL_VERSIONING": "false"}), \
+                mock.patch("llm_client.achat_completion", failing):
+            result = save_novel(state)
+        self.assertEqual(result['story_context'], previous)
+        self.assertTrue(os.path.exists(os.path.join(result['save_path'], "manifest.json")))
+
+class TestOutlineGeneration(unittest.TestCase):
+    def test_outline_generated_without_prefetch(self):
+        """测试未开启预取时 discuss_outline 当场生成大纲，已有大纲时不调用模型，生成失败时保留原状态"""
+        calls = []
+
+        async def fake_completion(messages, **kwargs):
+            calls.append(kwargs.get("task"))
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="第一章 起\n第二章 落\n"))])
+
+        concept = NovelConcept(title="雾港来信")
+        with mock.patch.dict(os.environ, {"NOVEL_SPECULATIVE_OUTLINE": "false"}), \
+                mock.patch("outline_prefetch.get_prefetcher", side_effect=AssertionError("不应取用预取")), \
+                mock.patch("llm_client.achat_completion", fake_completion):
+            result = discuss_outline({'concept': concept, 'outline': ''})
+            self.assertEqual(discuss_outline({'concept': concept, 'outline': "已有大纲"})['outline'], "已有大纲")
+        self.assertEqual(result['outline'], "第一章 起\n第二章 落")
+        self.assertEqual(calls, ["outline"])
+
+        with mock.patch("llm_client.achat_completion", mock.AsyncMock(side_effect=RuntimeError("down"))):
+            self.assertEqual(discuss_outline({'concept': concept, 'outline': ''})['outline'], '')
+
+class TestSpeculativeOutline(unittest.TestCase):
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ, {"NOVEL_SPECULATIVE_OUTLINE": "true"})
+        self.env.start()
+        self.prefetcher = outline_prefetch.OutlinePrefetcher()
+        outline_prefetch.configure(self.prefetcher)
+        self.calls = []
+
+    def tearDown(self):
+        outline_prefetch.configure()
+        self.env.stop()
+
+    async def fake_completion(self, messages, **kwargs):
+        self.calls.append(messages[-1]['content'])
+        await asyncio.sleep(0.05)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="第一章 起\n第二章 落"))])
+
+    def test_confirmed_concept_uses_prefetched_outline(self):
+        """测试确认概念后直接取用用户阅读总结时预取的大纲"""
+        state = {'concept': NovelConcept(title="雾港来信"), 'user_input': '', 'feedback_needed': True}
+        with mock.patch("llm_client.achat_completion", self.fake_completion):
+            summarize_concept(state)
+            with input_provider.using(ScriptedInput(["1"])):
+                get_user_feedback(state)
+            result = discuss_outline({'concept': state['concept'], 'outline': ''})
+        self.assertEqual(result['outline'], "第一章 起\n第二章 落")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.prefetcher.snapshot()["hits"], 1)
+
+    def test_modified_concept_discards_prefetch(self):
+        """测试用户选择修改概念时取消预取，修改后的概念重新生成大纲"""
+        state = {'concept': NovelConcept(title="雾港来信"), 'user_input': '', 'feedback_needed': True}
+        with mock.patch("llm_client.achat_completion", self.fake_completion):
+            summarize_concept(state)
+            with input_provider.using(ScriptedInput(["2", "换个标题"])):
+                get_user_feedback(state)
+            state['concept'].title = "雾港旧案"
+            result = discuss_outline({'concept': state['concept'], 'outline': ''})
+        self.assertEqual(self.prefetcher.snapshot()["cancelled"] + self.prefetcher.snapshot()["hits"], 1)
+        self.assertEqual(self.prefetcher.snapshot()["hits"], 0)
+        self.assertTrue(any("雾港旧案" in prompt for prompt in self.calls))
+        self.assertEqual(result['outline'], "第一章 起\n第二章 落")
+
+class TestCheckpointing(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {
+            "NOVEL_WORKING_DIR": self.tmpdir.name,
+            "NOVEL_CHECKPOINT_DB": os.path.join(self.tmpdir.name, "checkpoints.sqlite"),
+            "NOVEL_VERSIONING": "false",
+            "NOVEL_SUMMARIES": "false",
+        })
+        self.env.start()
+        self.calls = []
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    async def fake_completion(self, messages, **kwargs):
+        self.calls.append(messages[-1]['content'])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="正文"))])
+
+    def test_compiled_graph_is_reused(self):
+        """测试编译后的工作流在进程内复用，绑定检查点时返回副本"""
+        self.assertIs(get_novel_graph(), get_novel_graph())
+        checkpointer = open_checkpointer()
+        bound = get_novel_graph(checkpointer)
+        self.assertIs(bound.checkpointer, checkpointer)
+        self.assertIsNone(get_novel_graph().checkpointer)
+
+    def test_resume_after_failure_skips_completed_nodes(self):
+        """测试中断后从检查点继续，不再重新生成已完成的章节"""
+        graph = create_novel_workflow().compile(checkpointer=open_checkpointer())
+        config = {"configurable": {"thread_id": "测试项目:novel"}}
+        state = {'concept': NovelConcept(title="检查点测试"), 'outline': "第一章 起\n第二章 落",
+                 'draft_content': '', 'current_section': '', 'save_path': '', 'user_feedback': ''}
+
+        with mock.patch("llm_client.achat_completion", self.fake_completion), \
+                mock.patch("novel_agent.save_draft", side_effect=RuntimeError("磁盘已满")):
+            with self.assertRaises(RuntimeError):
+                graph.invoke(state, config)
+        self.assertEqual(len(self.calls), 2)
+
+        resumed = create_novel_workflow().compile(checkpointer=open_checkpointer())
+        self.assertEqual(resumed.get_state(config).next, ("save",))
+        with mock.patch("llm_client.achat_completion", self.fake_completion):
+            result = resumed.invoke(None, config)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(result['chapters'], ["正文", "正文"])
+        self.assertEqual(result['concept'].title, "检查点测试")
+
+    def test_checkpoint_holds_chapter_handle(self):
+        """测试检查点只保存章节句柄，不随正文长度增长"""
+        async def long_completion(messages, **kwargs):
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="雾" * 20000))])
+
+        checkpointer = open_checkpointer()
+        graph = get_novel_graph(checkpointer)
+        config = {"configurable": {"thread_id": "句柄测试:novel"}}
+        state = {'concept': NovelConcept(title="句柄测试"), 'outline': "第一章 起\n第二章 承\n第三章 转",
+                 'draft_content': '', 'current_section': '', 'save_path': '', 'user_feedback': ''}
+        with mock.patch("llm_client.achat_completion", long_completion):
+            result = graph.invoke(state, config)
+
+        self.assertIsInstance(result['chapters'], ChapterHandle)
+        self.assertEqual(result['chapters'][2], "雾" * 20000)
+        values = checkpointer.get_tuple(config).checkpoint["channel_values"]
+        self.assertLess(len(checkpointer.serde.dumps_typed(values)[1]), 5000)
+
+    def test_feedback_routes_to_modify_content(self):
+        """测试保存后有修改要求时进入 modify_content，修改后再次保存并结束"""
+        async def fake_completion(messages, **kwargs):
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="海雾漫过码头。"))])
+
+        def fake_revise(text, instruction, background="", builder=None):
+            return f"{text}（{instruction}）", [{"op": "replace"}]
+
+        graph = create_novel_workflow().compile()
+        state = {'concept': NovelConcept(title="修改测试"), 'outline': "第一章 起",
+                 'draft_content': '', 'current_section': '', 'save_path': '', 'user_feedback': '加一句对白'}
+        with mock.patch("llm_client.achat_completion", fake_completion), \
+                mock.patch("content_patch.revise", side_effect=fake_revise) as revise:
+            nodes = [node for update in graph.stream(state) for node in update]
+            unchanged = [node for update in graph.stream(dict(state, user_feedback='')) for node in update]
+        self.assertEqual(nodes, ["discuss_outline", "create_draft", "save", "modify_content", "save"])
+        self.assertEqual(unchanged, ["discuss_outline", "create_draft", "save"])
+        self.assertEqual(revise.call_count, 1)
+
+    def test_outline_feedback_redrafts_only_changed_chapters(self):
+        """测试针对大纲的修改要求进入 modify_outline，之后只重新生成大纲有变化的章节"""
+        def fake_revise(text, instruction, background="", subject=""):
+            return text.replace("第二章 落", "第二章 转折"), [{"op": "replace"}]
+
+        graph = create_novel_workflow().compile()
+        state = {'concept': NovelConcept(title="大纲修改"), 'outline': "第一章 起\n第二章 落",
+                 'draft_content': '', 'current_section': 'outline', 'save_path': '', 'user_feedback': '改写结局'}
+        with mock.patch("llm_client.achat_completion", self.fake_completion), \
+                mock.patch("content_patch.revise", side_effect=fake_revise):
+            nodes = [node for update in graph.stream(state, stream_mode="updates") for node in update]
+        self.assertEqual(nodes, ["discuss_outline", "create_draft", "save", "modify_outline", "create_draft", "save"])
+        self.assertEqual(len(self.calls), 3)
+        self.assertIn("第二章 转折", self.calls[-1])
+
+    def test_reopened_project_reuses_saved_chapters(self):
+        """测试重新打开已保存的项目时载入章节、大纲树与摘要，不再重新生成未改动的章节"""
+        tasks = []
+
+        async def fake_completion(messages, task=None, **kwargs):
+            tasks.append(task)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="正文"))])
+
+        concept = NovelConcept(title="重新打开")
+        graph = create_novel_workflow().compile()
+        with mock.patch.dict(os.environ, {"NOVEL_SUMMARIES": "true"}), \
+                mock.patch("llm_client.achat_completion", fake_completion):
+            graph.invoke(initial_novel_state(concept, "第一章 起\n第二章 落"))
+            drafted = tasks.count("draft")
+            state = initial_novel_state(concept)
+            self.assertEqual(state['outline'], "第一章 起\n第二章 落")
+            self.assertEqual(state['chapters'], ["正文", "正文"])
+            self.assertTrue(state['outline_tree'] and state['story_context'])
+            tasks.clear()
+            graph.invoke(state)
+        self.assertEqual(drafted, 2)
+        self.assertEqual(tasks, [])
+
+    def test_journal_reuses_generated_chapters(self):
+        """测试重新运行初稿节点时复用已记录的章节"""
+        state = {'concept': NovelConcept(title="日志测试"), 'outline': "第一章 起\n第二章 落"}
+        config = {"configurable": {"thread_id": "日志测试"}}
+        with mock.patch("llm_client.achat_completion", self.fake_completion):
+            create_initial_draft(dict(state), config)
+            result = create_initial_draft(dict(state), config)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(result['chapters'], ["正文", "正文"])
+
+class TestDraftVersioning(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {
+            "NOVEL_WORKING_DIR": self.tmpdir.name,
+            "NOVEL_VERSIONING": "true",
+            "NOVEL_RETRIEVAL": "false",
+        })
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def test_only_changed_chapters_get_revisions(self):
+        """测试草稿按章记录修订，只有改动的章节新增修订，草稿修订记录各章的修订 ID"""
+        state = {'concept': NovelConcept(title="版本"), 'outline': "第一章\n第二章",
+                 'chapters': ["海雾漫过码头。", "沈默站在邮局门口。"]}
+        directory = save_draft(dict(state))
+        versions = version_store.get_version_store(directory)
+        first = json.loads(versions.get(versions.latest("draft")))
+
+        save_draft(dict(state, chapters=["海雾漫过码头。", "信封上没有署名。"]))
+        second = json.loads(versions.get(versions.latest("draft")))
+        self.assertEqual(second[0], first[0])
+        self.assertNotEqual(second[1], first[1])
+        self.assertEqual(versions.get(second[1]), "信封上没有署名。")
+        self.assertEqual(len(versions.list()), 2 + 3 + 1)  # 两个草稿修订、三个章节修订与大纲
+        versions.close()
+
+    def test_chapter_history_survives_rewrites(self):
+        """测试章节重写后（章节文件 ID 改变）修订仍记在同一位置的文档下，可按草稿恢复整本书"""
+        state = {'concept': NovelConcept(title="历史"), 'outline': "第一章\n第二章",
+                 'chapters': ["海雾漫过码头。", "沈默站在邮局门口。"]}
+        directory = save_draft(dict(state))
+        versions = version_store.get_version_store(directory)
+        first = versions.latest("draft")
+        save_draft(dict(state, chapters=["海雾漫过码头。", "信封上没有署名。"]))
+
+        history = [versions.get(r.id) for r in versions.list(version_store.chapter_doc(1))]
+        self.assertEqual(history, ["信封上没有署名。", "沈默站在邮局门口。"])
+        self.assertIn("+信封上没有署名。", versions.diff_draft(first, versions.latest("draft")))
+        self.assertEqual(versions.restore_draft(first), ["海雾漫过码头。", "沈默站在邮局门口。"])
+        versions.close()
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import batch_runner
+import input_provider
+import novel_agent
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {
+            "NOVEL_WORKING_DIR": self.tmpdir.name,
+            "NOVEL_CHECKPOINT_DB": os.path.join(self.tmpdir.name, "checkpoints.sqlite"),
+            "NOVEL_VERSIONING": "false",
+            "NOVEL_SUMMARIES": "false",
+        })
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def write_jobs(self, jobs):
+        path = os.path.join(self.tmpdir.name, "jobs.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for job in jobs:
+                f.write(json.dumps(job, ensure_ascii=False) + '\n')
+        return path
+
+    @staticmethod
+    async def fake_completion(messages, **kwargs):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="正文"))])
+
+    def test_load_jobs_assigns_ids(self):
+        """测试读取 JSONL 任务文件，缺少 id 的任务按序号命名"""
+        path = self.write_jobs([{"id": "甲", "outline": "第一章 起"}, {"outline": "第一章 落"}])
+        self.assertEqual([job["id"] for job in batch_runner.load_jobs(path)], ["甲", "job-2"])
+
+    def test_load_jobs_rejects_duplicate_ids(self):
+        """测试任务 id 重复（包括与缺省 id 重复）时报错"""
+        for jobs in ([{"id": "甲"}, {"id": "甲"}], [{"id": "job-2"}, {"outline": "第一章"}]):
+            with self.assertRaises(ValueError):
+                batch_runner.load_jobs(self.write_jobs(jobs))
+
+    def test_partial_answers_keep_auto_confirm(self):
+        """测试只覆盖部分提示词时，其余提示词仍自动选择 AI 生成并确认"""
+        answers = {}
+
+        def fake_run(project_id, **kwargs):
+            for prompt in ("\n请选择（1-2）：", "\n请选择（1-3）：", "请输入小说标题："):
+                answers[prompt] = input_provider.ask(prompt)
+            return None
+
+        with mock.patch("novel_agent.run_workflows", side_effect=fake_run):
+            result = batch_runner.run_job({"id": "甲", "answers": {"小说标题": "雾港来信"}})
+        self.assertEqual(result["status"], "unconfirmed")
+        self.assertEqual(list(answers.values()), ["2", "1", "雾港来信"])
+
+    def test_batch_reports_each_job(self):
+        """测试并发运行多个项目，单个任务失败不影响其他任务"""
+        path = self.write_jobs([
+            {"id": "雾港", "concept": {"title": "雾港来信"}, "outline": "第一章 起\n第二章 落"},
+            {"id": "星海", "concept": {"title": "星海"}, "outline": "第一章 启程"},
+            {"id": "坏任务", "concept": "不是对象"},
+        ])
+        report = os.path.join(self.tmpdir.name, "report.jsonl")
+        opened = []
+        real_open = open
+
+        def tracking_open(file, *args, **kwargs):
+            opened.append(real_open(file, *args, **kwargs))
+            return opened[-1]
+
+        with mock.patch("llm_client.achat_completion", self.fake_completion), \
+                mock.patch("builtins.open", side_effect=tracking_open):
+            code = batch_runner.main([path, "--concurrency", "2", "--report", report])
+        self.assertEqual(code, 1)
+        devnull = [f for f in opened if f.name == os.devnull]
+        self.assertTrue(devnull and all(f.closed for f in devnull))  # 屏蔽输出用的文件已关闭
+
+        with open(report, encoding="utf-8") as f:
+            results = {r["id"]: r for r in map(json.loads, f)}
+        self.assertEqual(results["雾港"]["status"], "ok")
+        self.assertEqual(results["雾港"]["chapters"], 2)
+        self.assertTrue(os.path.isdir(results["星海"]["save_path"]))
+        self.assertEqual(results["坏任务"]["status"], "failed")
+        self.assertIn("TypeError", results["坏任务"]["error"])
+
+    def test_checkpointer_shared_and_closed(self):
+        """测试批量运行的任务共用一个检查点存储，结束后关闭连接；单独运行的项目也会关闭自己打开的连接"""
+        opened = []
+        open_checkpointer = novel_agent.open_checkpointer
+
+        def tracking_open(path=None):
+            opened.append(open_checkpointer(path))
+            return opened[-1]
+
+        jobs = [{"id": "雾港", "concept": {"title": "雾港来信"}, "outline": "第一章 起"},
+                {"id": "星海", "concept": {"title": "星海"}, "outline": "第一章 启程"}]
+        with mock.patch("llm_client.achat_completion", self.fake_completion), \
+                mock.patch("novel_agent.open_checkpointer", side_effect=tracking_open):
+            results = batch_runner.run_batch(jobs, concurrency=2)
+            novel_agent.run_workflows("单独", concept=novel_agent.NovelConcept(title="单独"), outline="第一章 起")
+        self.assertEqual([r["status"] for r in results], ["ok", "ok"])
+        self.assertEqual(len(opened), 2)
+        for checkpointer in opened:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                checkpointer.conn.execute("SELECT 1")
+
+if __name__ == '__main__':
+    unittest.main()
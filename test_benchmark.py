@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import call_governor
+import llm_client
+from benchmark_agent import run_benchmark, time_startup
+from mock_qwen_server import MockQwenServer, SAMPLE_CONCEPT
+
+class TestMockQwenServer(unittest.TestCase):
+    def setUp(self):
+        self.server = MockQwenServer(latency=0, tokens_per_second=1e6, seed=0).start()
+        llm_client.configure(base_url=self.server.url, api_key="mock")
+        call_governor.configure(call_governor.CallGovernor(call_governor.GovernorSettings(max_retries=2)))
+
+    def tearDown(self):
+        llm_client.configure()
+        call_governor.configure()
+        self.server.stop()
+
+    def test_completion_and_stream(self):
+        """测试模拟服务的普通与流式响应"""
+        messages = [{"role": "user", "content": "请按以下格式输出：\n标题：[标题]"}]
+        response = llm_client.chat_completion(messages)
+        self.assertEqual(response.choices[0].message.content, SAMPLE_CONCEPT)
+        self.assertGreater(response.usage.completion_tokens, 0)
+
+        stream = llm_client.chat_completion(messages, stream=True)
+        text = ''.join(chunk.choices[0].delta.content or '' for chunk in stream if chunk.choices)
+        self.assertEqual(text, SAMPLE_CONCEPT)
+
+    def test_error_injection(self):
+        """测试按概率注入错误，429 经调用管控重试后仍失败"""
+        self.server.error_rate = 1.0
+        with self.assertRaises(Exception), mock.patch("time.sleep"):
+            llm_client.chat_completion([{"role": "user", "content": "你好"}], max_tokens=10, timeout=5)
+        self.assertEqual(self.server.errors, 3)
+
+class TestBenchmark(unittest.TestCase):
+    def test_benchmark_report(self):
+        """测试离线基准报告包含编译、节点、端到端与吞吐量数据，运行后删除临时工作目录"""
+        created, temporary_directory_cls = [], tempfile.TemporaryDirectory
+
+        def temporary_directory(*args, **kwargs):
+            created.append(temporary_directory_cls(*args, **kwargs))
+            return created[-1]
+
+        with mock.patch("tempfile.TemporaryDirectory", side_effect=temporary_directory):
+            report = run_benchmark(sessions=2, rounds=1, chapters=2, latency=0, tokens_per_second=1e6)
+        self.assertEqual(len(created), 1)
+        self.assertFalse(os.path.exists(created[0].name))
+        self.assertIn("novel", report["compile"])
+        self.assertEqual(report["startup"]["count"], 1)
+        self.assertIn("create_draft", report["nodes"])
+        self.assertEqual(report["end_to_end"]["count"], 2)
+        self.assertGreater(report["throughput_sessions_per_second"], 0)
+        self.assertEqual(report["llm"]["errors"], 0)
+
+class TestStartup(unittest.TestCase):
+    # 冷启动预算（秒），可用 NOVEL_STARTUP_BUDGET 按机器调整
+    BUDGET = float(os.getenv("NOVEL_STARTUP_BUDGET", "1.5"))
+
+    def test_help_starts_within_budget(self):
+        """测试冷启动 novel_agent.py --help 不超过预算"""
+        self.assertLess(time_startup(3)["p95_seconds"], self.BUDGET)
+
+    def test_import_defers_heavy_modules(self):
+        """测试导入 novel_agent 时不加载 langgraph 与 openai"""
+        code = ("import sys, novel_agent; "
+                "print(sorted(m for m in ('langgraph', 'openai', 'dashscope') if m in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        self.assertEqual(output.strip(), "[]")
+
+if __name__ == '__main__':
+    unittest.main()
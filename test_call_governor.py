@@ -0,0 +1,152 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import httpx
+import openai
+
+from call_governor import (
+    CallGovernor,
+    CircuitBreaker,
+    CircuitOpenError,
+    GovernorSettings,
+    TokenBucket,
+    is_retryable,
+)
+
+def rate_limit_error(retry_after=None):
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "http://test/v1/chat/completions"))
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestTokenBucket(unittest.TestCase):
+    def test_reserve_returns_wait_when_exhausted(self):
+        """测试额度用完后返回需要等待的时间"""
+        clock = FakeClock()
+        bucket = TokenBucket(60, clock)  # 每秒补充 1 个
+        self.assertEqual(bucket.reserve(60), 0.0)
+        self.assertAlmostEqual(bucket.reserve(1), 1.0)
+        self.assertAlmostEqual(bucket.reserve(1), 2.0)
+        clock.now = 10.0
+        self.assertEqual(bucket.reserve(1), 0.0)
+
+    def test_unlimited_bucket_never_waits(self):
+        self.assertEqual(TokenBucket(0).reserve(10 ** 6), 0.0)
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_half_open_close(self):
+        """测试连续失败后熔断，冷却后只放行一个试探请求"""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30, clock=clock)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        clock.now = 31
+        breaker.before_call()  # 试探请求
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+class TestCallGovernor(unittest.TestCase):
+    def test_retryable_errors_are_retried_with_backoff(self):
+        """测试可重试的错误按退避重试，Retry-After 优先"""
+        governor = CallGovernor(GovernorSettings(max_retries=2, backoff_base=1.0))
+        fn = mock.Mock(side_effect=[rate_limit_error(), rate_limit_error(retry_after=7), "ok"])
+        with mock.patch("time.sleep") as sleep:
+            self.assertEqual(governor.call(fn), "ok")
+        delays = [c.args[0] for c in sleep.call_args_list]
+        self.assertTrue(0 <= delays[0] <= 1.0)
+        self.assertEqual(delays[1], 7.0)
+        self.assertEqual(governor.snapshot()["retries"], 2)
+
+    def test_non_retryable_errors_fail_immediately(self):
+        governor = CallGovernor(GovernorSettings(max_retries=3))
+        fn = mock.Mock(side_effect=ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            governor.call(fn)
+        self.assertEqual(fn.call_count, 1)
+        self.assertFalse(is_retryable(ValueError()))
+
+    def test_non_retryable_error_does_not_close_circuit(self):
+        """测试半开试探遇到不可重试的错误时只释放试探名额，熔断不关闭，失败计数保留"""
+        clock = FakeClock()
+        governor = CallGovernor(GovernorSettings(max_retries=0, failure_threshold=2, reset_seconds=30))
+        governor.breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30, clock=clock)
+        governor.breaker.record_failure()
+        governor.breaker.record_failure()
+        clock.now = 31
+        with self.assertRaises(ValueError):
+            governor.call(mock.Mock(side_effect=ValueError("bad request")))
+        self.assertNotEqual(governor.breaker.state, "closed")
+        self.assertEqual(governor.breaker.failures, 2)
+        self.assertEqual(governor.call(mock.Mock(return_value="ok")), "ok")  # 下一个请求仍可试探
+        self.assertEqual(governor.breaker.state, "closed")
+
+    def test_breaker_fails_fast_after_repeated_failures(self):
+        """测试服务持续出错时熔断，后续请求不再发出"""
+        governor = CallGovernor(GovernorSettings(max_retries=1, failure_threshold=2, reset_seconds=60))
+        fn = mock.Mock(side_effect=rate_limit_error())
+        with mock.patch("time.sleep"):
+            with self.assertRaises(openai.RateLimitError):
+                governor.call(fn)
+            with self.assertRaises(CircuitOpenError):
+                governor.call(fn)
+        self.assertEqual(fn.call_count, 2)
+        snapshot = governor.snapshot()
+        self.assertEqual((snapshot["circuit_state"], snapshot["rejected"]), ("open", 1))
+
+    def test_cancelled_probe_releases_half_open_slot(self):
+        """测试半开状态的试探请求被取消后，下一个请求仍可试探，熔断器不会一直保持打开"""
+        clock = FakeClock()
+        governor = CallGovernor(GovernorSettings(max_retries=0, failure_threshold=1, reset_seconds=30))
+        governor.breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30, clock=clock)
+        governor.breaker.record_failure()
+        clock.now = 31
+
+        async def probe():
+            started = asyncio.Event()
+
+            async def hang():
+                started.set()
+                await asyncio.sleep(60)
+
+            task = asyncio.create_task(governor.acall(hang))
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            async def ok():
+                return "ok"
+            return await governor.acall(ok)
+
+        self.assertEqual(asyncio.run(probe()), "ok")
+        self.assertEqual(governor.breaker.state, "closed")
+
+    def test_async_calls_queue_on_rate_limit(self):
+        """测试异步调用在 RPM 额度不足时排队等待并记录等待时间"""
+        governor = CallGovernor(GovernorSettings(requests_per_minute=60))
+        governor.requests.reserve(60)
+
+        async def fn():
+            return "ok"
+
+        with mock.patch("asyncio.sleep", mock.AsyncMock()) as sleep:
+            self.assertEqual(asyncio.run(governor.acall(fn)), "ok")
+        self.assertAlmostEqual(sleep.call_args.args[0], 1.0, places=1)
+        self.assertGreater(governor.snapshot()["queue_wait_max_seconds"], 0.9)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from content_patch import PatchError, _parse_edits, apply_edits, paragraph_layout, revise, split_paragraphs
+
+TEXT = "海雾漫过码头。\n\n沈默站在邮局门口。\n\n远处传来汽笛声。"
+
+def completion(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+class TestContentPatch(unittest.TestCase):
+    def test_ids_stable_across_edits(self):
+        """测试未改动段落的 ID 在其他段落变化后保持不变"""
+        before = dict((p, i) for i, p in split_paragraphs(TEXT))
+        after = dict((p, i) for i, p in split_paragraphs("新的开头。\n" + TEXT))
+        for paragraph, pid in before.items():
+            self.assertEqual(after[paragraph], pid)
+
+    def test_apply_edits(self):
+        """测试替换、插入和删除"""
+        paragraphs = split_paragraphs(TEXT)
+        ids = [pid for pid, _ in paragraphs]
+        edits = [
+            {"op": "replace", "id": ids[1], "text": "沈默推开邮局的门。"},
+            {"op": "insert_after", "id": None, "text": "夜深了。"},
+            {"op": "delete", "id": ids[2]},
+        ]
+        self.assertEqual(apply_edits(paragraphs, edits), "夜深了。\n海雾漫过码头。\n沈默推开邮局的门。")
+
+    def test_mixed_separators_are_kept(self):
+        """测试分隔混用时只改动被编辑的段落，其余段落的空行与缩进保持原样"""
+        text = "　　海雾漫过码头。\n\n　　沈默站在邮局门口。\n　　远处传来汽笛声。\n"
+        paragraphs = split_paragraphs(text)
+        ids = [pid for pid, _ in paragraphs]
+        layout = paragraph_layout(text)
+        self.assertEqual(layout, ("　　", ["\n\n　　", "\n　　", "\n"]))
+
+        edits = [{"op": "replace", "id": ids[1], "text": "沈默推开邮局的门。"}]
+        self.assertEqual(apply_edits(paragraphs, edits, "\n\n", layout),
+                         "　　海雾漫过码头。\n\n　　沈默推开邮局的门。\n　　远处传来汽笛声。\n")
+        edits = [{"op": "insert_after", "id": ids[0], "text": "夜深了。"}, {"op": "delete", "id": ids[2]}]
+        self.assertEqual(apply_edits(paragraphs, edits, "\n\n", layout),
+                         "　　海雾漫过码头。\n\n　　夜深了。\n\n　　沈默站在邮局门口。\n")
+
+    def test_invalid_edits_rejected(self):
+        """测试引用不存在的段落、字段类型不对或重复修改同一段落时报错"""
+        paragraphs = split_paragraphs(TEXT)
+        with self.assertRaises(PatchError):
+            apply_edits(paragraphs, [{"op": "replace", "id": "p0000000", "text": "x"}])
+        pid = paragraphs[0][0]
+        with self.assertRaises(PatchError):
+            apply_edits(paragraphs, [{"op": "delete", "id": pid}, {"op": "replace", "id": pid, "text": "x"}])
+        for edit in ({"op": "replace", "id": pid, "text": ["x"]}, {"op": "insert_after", "id": None, "text": 1},
+                     {"op": "delete", "id": [pid]}, {"op": "replace", "id": {"id": pid}, "text": "x"}):
+            with self.assertRaises(PatchError):
+                apply_edits(paragraphs, [edit])
+
+    def test_missing_edits_key_rejected(self):
+        """测试 JSON 对象缺少 edits 字段时报错，而不是当作没有修改"""
+        with self.assertRaises(PatchError):
+            _parse_edits('{"changes": []}')
+        self.assertEqual(_parse_edits('{"edits": []}'), [])
+
+    def test_revise_retries_invalid_output(self):
+        """测试模型输出不合法时带着错误信息重试"""
+        pid = split_paragraphs(TEXT)[2][0]
+        replies = [completion("不是 JSON"),
+                   completion(json.dumps({"edits": [{"op": "replace", "id": pid, "text": "汽笛声停了。"}]}))]
+        with mock.patch("llm_client.chat_completion", side_effect=replies) as call:
+            text, edits = revise(TEXT, "把最后一段改得更安静")
+        self.assertEqual(text, "海雾漫过码头。\n\n沈默站在邮局门口。\n\n汽笛声停了。")
+        self.assertEqual(len(edits), 1)
+        self.assertIn("不合法", call.call_args_list[1].args[0][-1]["content"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import threading
+import unittest
+from unittest import mock
+
+import input_provider
+from input_provider import AutoConfirmInput, ScriptedInput
+
+class TestInputProvider(unittest.TestCase):
+    def test_scripted_list_answers_in_order(self):
+        """测试列表形式的答案按顺序作答，用完后返回默认值"""
+        provider = ScriptedInput(["1", "是"], default="n")
+        self.assertEqual([provider.ask("a"), provider.ask("b"), provider.ask("c")], ["1", "是", "n"])
+        self.assertEqual(provider.prompts, ["a", "b", "c"])
+
+    def test_scripted_dict_matches_prompt(self):
+        """测试字典形式的答案按提示词关键字匹配，列表值依次取用并重复最后一个"""
+        provider = ScriptedInput({"标题": "雾港来信", "确认": ["3", "1"]})
+        self.assertEqual(provider.ask("请输入标题："), "雾港来信")
+        self.assertEqual([provider.ask("请确认：") for _ in range(3)], ["3", "1", "1"])
+        self.assertEqual(provider.ask("其他"), "")
+
+    def test_auto_confirm(self):
+        """测试自动确认选择 AI 生成并确认概念"""
+        provider = AutoConfirmInput()
+        self.assertEqual(provider.ask("\n请选择（1-2）："), "2")
+        self.assertEqual(provider.ask("\n请选择（1-3）："), "1")
+
+    def test_using_is_scoped_per_thread(self):
+        """测试输入来源只在当前上下文生效，其他线程仍使用终端输入"""
+        seen = []
+        with input_provider.using(ScriptedInput(["脚本"])):
+            thread = threading.Thread(target=lambda: seen.append(input_provider.ask("线程：")))
+            with mock.patch("builtins.input", return_value="终端"):
+                thread.start()
+                thread.join()
+                self.assertEqual(input_provider.ask("主线程："), "脚本")
+        self.assertEqual(seen, ["终端"])
+        self.assertIsInstance(input_provider.get_provider(), input_provider.InteractiveInput)
+
+if __name__ == '__main__':
+    unittest.main()
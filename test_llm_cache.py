@@ -0,0 +1,101 @@
+import itertools
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+import llm_cache
+import llm_client
+
+def make_completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "test", "object": "chat.completion", "created": 0, "model": "qwen3-235b-a22b",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    })
+
+def make_chunk(content: str) -> ChatCompletionChunk:
+    return ChatCompletionChunk.model_validate({
+        "id": "test", "object": "chat.completion.chunk", "created": 0, "model": "qwen3-235b-a22b",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+    })
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite")
+        llm_client.configure(llm_client.LLMSettings(api_key="test-key"))
+
+    def tearDown(self):
+        llm_cache.configure(None)
+        llm_client.configure()
+        self.tmpdir.cleanup()
+
+    def test_key_ignores_stream_flag(self):
+        """测试缓存键与是否流式无关、与参数相关"""
+        request = {"model": "m", "messages": [{"role": "user", "content": "你好"}], "temperature": 0.7}
+        key = llm_cache.ResponseCache.key(request)
+        self.assertEqual(key, llm_cache.ResponseCache.key({**request, "stream": True}))
+        self.assertNotEqual(key, llm_cache.ResponseCache.key({**request, "temperature": 0.8}))
+
+    def test_lru_eviction_by_size(self):
+        """测试超出容量时按最近访问时间淘汰"""
+        cache = llm_cache.ResponseCache(self.path, max_bytes=250)
+        for name in ("a", "b"):
+            cache.put(name, {"text": "x" * 100})
+        cache.get("a")  # a 比 b 更近被访问
+        cache.put("c", {"text": "x" * 100})
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        cache.close()
+
+    def test_expired_entries_miss(self):
+        """测试过期条目视为未命中"""
+        cache = llm_cache.ResponseCache(self.path, max_age=60)
+        cache.put("a", {"text": "x"})
+        with mock.patch("time.time", return_value=llm_cache.time.time() + 120):
+            self.assertIsNone(cache.get("a"))
+        cache.close()
+
+    def test_readwrite_then_replay(self):
+        """测试读写模式记录后可离线回放（包括流式请求）"""
+        messages = [{"role": "user", "content": "写一句开头"}]
+        llm_cache.configure(llm_cache.ResponseCache(self.path, mode="readwrite"))
+        completions = llm_client.get_client().chat.completions
+        with mock.patch.object(completions, "create", return_value=make_completion("夜色很深。")) as create:
+            llm_client.chat_completion(messages)
+            cached = llm_client.chat_completion(messages)
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(cached.choices[0].message.content, "夜色很深。")
+
+        llm_cache.configure(llm_cache.ResponseCache(self.path, mode="replay"))
+        with mock.patch.object(completions, "create", side_effect=AssertionError("不应访问网络")):
+            chunks = list(llm_client.chat_completion(messages, stream=True))
+            self.assertEqual(chunks[0].choices[0].delta.content, "夜色很深。")
+            with self.assertRaises(llm_cache.CacheMissError):
+                llm_client.chat_completion([{"role": "user", "content": "未缓存"}])
+
+    def test_stream_closed_complete_is_cached(self):
+        """测试读到结束标记后以 complete=True 关闭的流照常写入缓存，普通提前关闭则不写入"""
+        messages = [{"role": "user", "content": "写一个概念"}]
+        llm_cache.configure(llm_cache.ResponseCache(self.path, mode="readwrite"))
+        completions = llm_client.get_client().chat.completions
+        for complete in (False, True):
+            stream = mock.MagicMock()
+            stream.__iter__.return_value = iter([make_chunk("标题："), make_chunk("雾港"), make_chunk("多余")])
+            with mock.patch.object(completions, "create", return_value=stream) as create:
+                response = llm_client.chat_completion(messages, stream=True)
+                received = list(itertools.islice(response, 2))
+                response.close(complete=complete)
+            self.assertEqual(len(received), 2)
+            self.assertEqual(create.call_count, 1)  # 第一次关闭未写缓存，第二次仍需请求
+
+        llm_cache.configure(llm_cache.ResponseCache(self.path, mode="replay"))
+        with mock.patch.object(completions, "create", side_effect=AssertionError("不应访问网络")):
+            cached = llm_client.chat_completion(messages)
+        self.assertEqual(cached.choices[0].message.content, "标题：雾港")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+import os
+import unittest
+from unittest import mock
+
+import httpx
+import openai
+
+import call_governor
+import llm_client
+
+class TestLLMClient(unittest.TestCase):
+    def setUp(self):
+        """每个测试使用独立的配置与统计"""
+        llm_client.configure(llm_client.LLMSettings(api_key="test-key", max_connections=4))
+        llm_client.reset_stats()
+        call_governor.configure(call_governor.CallGovernor(call_governor.GovernorSettings(max_retries=2)))
+
+    def tearDown(self):
+        llm_client.configure()
+        call_governor.configure()
+
+    def test_settings_from_env(self):
+        """测试从环境变量读取配置"""
+        with mock.patch.dict(os.environ, {"QWEN_MODEL_NAME": "qwen-turbo", "QWEN_POOL_SIZE": "8"}):
+            settings = llm_client.LLMSettings.from_env()
+        self.assertEqual(settings.model, "qwen-turbo")
+        self.assertEqual(settings.max_connections, 8)
+
+    def test_client_is_shared(self):
+        """测试同步客户端在进程内复用，重新配置后重建"""
+        client = llm_client.get_client()
+        self.assertIs(client, llm_client.get_client())
+        llm_client.configure(llm_client.LLMSettings(api_key="other"))
+        self.assertIsNot(client, llm_client.get_client())
+
+    def test_async_client_per_loop(self):
+        """测试异步客户端在同一事件循环内复用"""
+        async def pair():
+            return llm_client.get_async_client(), llm_client.get_async_client()
+        first, second = asyncio.run(pair())
+        self.assertIs(first, second)
+
+    def test_run_reuses_loop_client(self):
+        """测试 run() 在共享的后台事件循环中运行，各次调用复用同一个异步客户端，shutdown() 时关闭"""
+        async def create():
+            return llm_client.get_async_client()
+        client = llm_client.run(create())
+        self.assertIs(llm_client.run(create()), client)
+        self.assertFalse(client.is_closed())
+        llm_client.shutdown()
+        self.assertTrue(client.is_closed())
+        self.assertIsNot(llm_client.run(create()), client)
+
+    def test_run_keeps_caller_context(self):
+        """测试协程在调用方 contextvars 的副本中运行"""
+        var = contextvars.ContextVar("test_var", default="")
+        var.set("调用方")
+
+        async def read():
+            return var.get()
+        self.assertEqual(llm_client.run(read()), "调用方")
+
+    def test_reconfigure_closes_running_loop_client(self):
+        """测试重新配置时关闭仍在运行的事件循环中的客户端"""
+        async def reconfigure():
+            client = llm_client.get_async_client()
+            llm_client.configure(llm_client.LLMSettings(api_key="other"))
+            await asyncio.sleep(0)
+            return client
+        self.assertTrue(asyncio.run(reconfigure()).is_closed())
+
+    def test_chat_completion_records_latency(self):
+        """测试请求参数补全与延迟统计"""
+        completions = llm_client.get_client().chat.completions
+        with mock.patch.object(completions, "create", return_value="ok") as create:
+            self.assertEqual(llm_client.chat_completion([{"role": "user", "content": "你好"}]), "ok")
+        request = create.call_args.kwargs
+        self.assertEqual(request["model"], "qwen3-235b-a22b")
+        self.assertEqual(request["extra_body"], {"enable_thinking": False})
+
+        with mock.patch.object(completions, "create", side_effect=RuntimeError("down")):
+            with self.assertRaises(RuntimeError):
+                llm_client.chat_completion([])
+
+        stats = llm_client.get_stats()
+        self.assertEqual(stats["max_connections"], 4)
+        self.assertEqual(stats["latency"]["requests"], 2)
+        self.assertEqual(stats["latency"]["errors"], 1)
+
+    def test_rate_limited_request_is_retried(self):
+        """测试 429 响应经调用管控重试，客户端自身不再重试"""
+        self.assertEqual(llm_client.get_client().max_retries, 0)
+        response = httpx.Response(429, request=httpx.Request("POST", "http://test/v1/chat/completions"))
+        error = openai.RateLimitError("rate limited", response=response, body=None)
+        completions = llm_client.get_client().chat.completions
+        with mock.patch.object(completions, "create", side_effect=[error, "ok"]), mock.patch("time.sleep"):
+            self.assertEqual(llm_client.chat_completion([{"role": "user", "content": "你好"}]), "ok")
+
+        stats = llm_client.get_stats()
+        self.assertEqual(stats["latency"]["errors"], 1)
+        self.assertEqual(stats["governor"]["retries"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from manuscript_export import ManuscriptExporter, main, table_of_contents
+from project_store import ProjectStore, get_store
+
+OUTLINE = "第一卷 雾港\n第一章 雾起\n- 码头\n第二章 来信\n第二卷 旧案\n第三章 旧案"
+
+class TestManuscriptExport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, "雾港来信")
+        store = ProjectStore(self.root)
+        store.set_title("雾港来信")
+        store.set_outline(OUTLINE)
+        store.set_chapters(["海雾漫过码头。\n\n沈默站在邮局门口。", "信封上写着 <无名氏>。", "旧案重启。"])
+        store.flush()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_table_of_contents_from_outline(self):
+        """测试目录按大纲的卷与章生成，大纲中没有的章节按序号命名"""
+        toc = table_of_contents(OUTLINE, 4)
+        self.assertEqual([(e.volume, e.title) for e in toc], [
+            ("第一卷 雾港", "第一章 雾起"), ("第一卷 雾港", "第二章 来信"), ("第二卷 旧案", "第三章 旧案"), ("", "第4章")])
+
+    def test_export_markdown_and_epub(self):
+        """测试导出的 Markdown 含目录与按序排列的正文，EPUB 结构完整且正文已转义"""
+        with mock.patch("project_store.read_text", side_effect=AssertionError("不应整章读入")):
+            result = ManuscriptExporter(self.root).export()
+        with open(result.paths["markdown"], encoding="utf-8") as f:
+            markdown = f.read()
+        self.assertTrue(markdown.startswith("# 雾港来信\n\n## 目录\n\n- 第一卷 雾港\n  - [第一章 雾起](#chapter-1)"))
+        self.assertLess(markdown.index("沈默站在邮局门口。"), markdown.index("## 第二卷 旧案"))
+        self.assertLess(markdown.index("## 第二卷 旧案"), markdown.index("旧案重启。"))
+
+        with zipfile.ZipFile(result.paths["epub"]) as book:
+            self.assertEqual(book.namelist()[0], "mimetype")
+            self.assertEqual(book.getinfo("mimetype").compress_type, zipfile.ZIP_STORED)
+            self.assertIn("第二章 来信", book.read("OEBPS/nav.xhtml").decode("utf-8"))
+            chapter = book.read("OEBPS/text/chapter-00002.xhtml").decode("utf-8")
+            self.assertIn("<p>信封上写着 &lt;无名氏&gt;。</p>", chapter)
+            self.assertIn('href="text/chapter-00003.xhtml"', book.read("OEBPS/content.opf").decode("utf-8"))
+
+    def test_incremental_export(self):
+        """测试没有变化时跳过打包，修改一章后只重新渲染该章并清理旧片段"""
+        exporter = ManuscriptExporter(self.root)
+        self.assertEqual(exporter.export().rendered, 6)
+        result = exporter.export()
+        self.assertEqual((result.rendered, result.skipped), (0, ["markdown", "epub"]))
+
+        store = get_store(self.root)
+        store.set_chapter(1, "信封上没有署名。")
+        store.flush()
+        result = exporter.export()
+        self.assertEqual((result.rendered, result.reused, result.skipped), (2, 4, []))
+        self.assertEqual(len(os.listdir(exporter.parts)), 6)
+        with open(result.paths["markdown"], encoding="utf-8") as f:
+            self.assertIn("信封上没有署名。", f.read())
+
+    def test_main_reports_missing_project(self):
+        """测试命令行按标题查找项目，找不到时返回错误码"""
+        with mock.patch.dict(os.environ, {"NOVEL_WORKING_DIR": self.tmpdir.name}):
+            self.assertEqual(main(["雾港来信", "--format", "markdown"]), 0)
+            self.assertEqual(main(["不存在"]), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.root, "export", "雾港来信.md")))
+
+if __name__ == "__main__":
+    unittest.main()
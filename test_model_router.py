@@ -0,0 +1,136 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import openai
+
+import call_governor
+import llm_client
+import model_router
+from mock_qwen_server import MockQwenServer
+from model_router import ModelRouter, Route
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestModelRouter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.router = ModelRouter({
+            "summary": Route(model="qwen-turbo", max_tokens=512, timeout=30),
+            "draft": Route(model="qwen-plus", fallback="qwen-turbo", fallback_p95=10, fallback_error_rate=0.2,
+                           min_samples=5, fallback_cooldown=60),
+        }, clock=self.clock)
+
+    def test_unrouted_task_uses_defaults(self):
+        """测试未配置的任务沿用全局模型"""
+        route, model = self.router.resolve("outline", "qwen3-235b-a22b")
+        self.assertEqual((route, model), (Route(), "qwen3-235b-a22b"))
+        self.assertEqual(self.router.resolve(None, "qwen3-235b-a22b")[1], "qwen3-235b-a22b")
+
+    def test_slow_primary_falls_back_until_cooldown(self):
+        """测试主模型 p95 超过阈值时切换备用模型，冷却后清空统计重新试用主模型"""
+        for _ in range(4):
+            self.router.record("qwen-plus", 30.0)
+        self.assertEqual(self.router.resolve("draft", "default")[1], "qwen-plus")  # 样本不足
+        self.router.record("qwen-plus", 30.0)
+        self.assertEqual(self.router.resolve("draft", "default")[1], "qwen-turbo")
+        self.clock.now = 30.0
+        self.assertEqual(self.router.resolve("draft", "default")[1], "qwen-turbo")
+        self.clock.now = 61.0
+        self.assertEqual(self.router.resolve("draft", "default")[1], "qwen-plus")
+        self.assertEqual(self.router.snapshot()["models"]["qwen-plus"]["samples"], 0)
+        self.assertEqual(self.router.snapshot()["fallbacks"], {"draft": 1})
+
+    def test_error_rate_triggers_fallback(self):
+        """测试主模型错误率超过阈值时切换备用模型"""
+        for error in (False, False, False, True, True):
+            self.router.record("qwen-plus", 1.0, error=error)
+        self.assertEqual(self.router.resolve("draft", "default")[1], "qwen-turbo")
+        self.assertEqual(self.router.snapshot()["fallback_active"], ["draft"])
+
+    def test_from_config(self):
+        """测试从 JSON 配置创建路由表，字符串值视为模型名，未知字段报错"""
+        router = ModelRouter.from_config({"edit": "qwen-turbo", "summary": {"model": "qwen-turbo", "max_tokens": 256}})
+        self.assertEqual(router.routes["edit"], Route(model="qwen-turbo"))
+        self.assertEqual(router.routes["summary"].overrides(), {"max_tokens": 256})
+        with self.assertRaises(ValueError):
+            ModelRouter.from_config({"draft": {"modle": "qwen-plus"}})
+
+    def test_from_env_reads_file(self):
+        """测试 QWEN_MODEL_ROUTES 可以是 JSON 文件路径"""
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+            json.dump({"summary": {"model": "qwen-turbo"}}, f)
+        try:
+            with mock.patch.dict(os.environ, {"QWEN_MODEL_ROUTES": f.name}):
+                self.assertEqual(ModelRouter.from_env().routes["summary"].model, "qwen-turbo")
+        finally:
+            os.unlink(f.name)
+
+class TestRoutedRequests(unittest.TestCase):
+    def setUp(self):
+        self.server = MockQwenServer(latency=0, tokens_per_second=1e6, seed=0).start()
+        llm_client.configure(base_url=self.server.url, api_key="mock", model="qwen3-235b-a22b", max_tokens=2048)
+        call_governor.configure(call_governor.CallGovernor(call_governor.GovernorSettings(max_retries=0)))
+        model_router.configure(ModelRouter({"summary": Route(model="qwen-turbo", max_tokens=512, timeout=30)}))
+
+    def tearDown(self):
+        model_router.configure()
+        call_governor.configure()
+        llm_client.configure()
+        self.server.stop()
+
+    def test_build_request_precedence(self):
+        """测试请求参数优先级：全局配置 < 任务路由 < 显式参数"""
+        messages = [{"role": "user", "content": "概括"}]
+        request = llm_client.build_request(messages, "summary")
+        self.assertEqual((request["model"], request["max_tokens"], request["timeout"]), ("qwen-turbo", 512, 30))
+        self.assertEqual(llm_client.build_request(messages, "summary", max_tokens=100)["max_tokens"], 100)
+        self.assertEqual(llm_client.build_request(messages)["model"], "qwen3-235b-a22b")
+
+    def test_requests_are_recorded_per_model(self):
+        """测试实际请求使用路由的模型，并按模型记录延迟"""
+        response = llm_client.chat_completion([{"role": "user", "content": "概括"}], task="summary")
+        self.assertEqual(response.model, "qwen-turbo")
+        llm_client.chat_completion([{"role": "user", "content": "写一章"}])
+        models = llm_client.get_stats()["routing"]["models"]
+        self.assertEqual(models["qwen-turbo"]["samples"], 1)
+        self.assertEqual(models["qwen3-235b-a22b"]["samples"], 1)
+
+class TestFallbackOnFailures(unittest.TestCase):
+    def setUp(self):
+        self.server = MockQwenServer(latency=0, tokens_per_second=1e6, seed=0, failing_models=["qwen-plus"]).start()
+        llm_client.configure(base_url=self.server.url, api_key="mock", model="qwen3-235b-a22b")
+        call_governor.configure(call_governor.CallGovernor(call_governor.GovernorSettings(
+            max_retries=0, failure_threshold=5, reset_seconds=30)))
+        model_router.configure(ModelRouter({"draft": Route(model="qwen-plus", fallback="qwen-turbo",
+                                                           fallback_error_rate=0.5)}))
+
+    def tearDown(self):
+        model_router.configure()
+        call_governor.configure()
+        llm_client.configure()
+        self.server.stop()
+
+    def test_failing_primary_switches_to_fallback(self):
+        """测试主模型连续失败被熔断后（样本数尚未达到 min_samples），请求改用备用模型且不被主模型的熔断拦截"""
+        messages = [{"role": "user", "content": "写一章"}]
+        for _ in range(5):
+            with self.assertRaises(openai.RateLimitError):
+                llm_client.chat_completion(messages, task="draft")
+        governor = call_governor.get_governor()
+        self.assertTrue(governor.circuit_open("qwen-plus"))
+
+        response = llm_client.chat_completion(messages, task="draft")
+        self.assertEqual(response.model, "qwen-turbo")
+        self.assertEqual(governor.snapshot()["circuits"], {"qwen-plus": "open", "qwen-turbo": "closed"})
+        self.assertEqual(model_router.get_router().snapshot()["fallback_active"], ["draft"])
+
+if __name__ == "__main__":
+    unittest.main()
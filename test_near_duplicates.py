@@ -0,0 +1,25 @@
+import unittest
+
+from near_duplicates import MinHash, NearDuplicateFilter, deduplicate, similarity
+
+class TestNearDuplicates(unittest.TestCase):
+    def test_similarity_estimates_overlap(self):
+        """测试签名相似度随文本重合程度变化"""
+        minhash = MinHash(128)
+        base = minhash.signature("雾港邮局的分拣员沈默发现一封寄给死者的信")
+        self.assertEqual(similarity(base, minhash.signature("雾港邮局的分拣员沈默发现一封寄给死者的信")), 1.0)
+        self.assertGreater(similarity(base, minhash.signature("雾港邮局的分拣员沈默发现一封寄给亡者的信")), 0.6)
+        self.assertLess(similarity(base, minhash.signature("星际舰队在银河边缘遭遇未知文明")), 0.2)
+
+    def test_filter_drops_near_duplicates(self):
+        """测试过滤器只接受与已有文本不重复的文本"""
+        keep = NearDuplicateFilter(threshold=0.6)
+        self.assertTrue(keep.add("雾港谜案\n分拣员追查一封寄给死者的信"))
+        self.assertFalse(keep.add("雾港谜案\n分拣员追查一封寄给死者的来信"))
+        self.assertTrue(keep.add("星海远征\n舰队在银河边缘遭遇未知文明"))
+
+    def test_deduplicate_keeps_first_occurrence(self):
+        self.assertEqual(deduplicate(["甲乙丙丁戊", "甲乙丙丁戊", "庚辛壬癸子"]), [0, 2])
+
+if __name__ == "__main__":
+    unittest.main()
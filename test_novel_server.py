@@ -0,0 +1,199 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import call_governor
+import llm_client
+from mock_qwen_server import MockQwenServer
+from novel_server import SERVICE, NovelService, Session, create_app
+
+class TestNovelServer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {
+            "NOVEL_WORKING_DIR": self.tmpdir.name,
+            "NOVEL_CHECKPOINT_DB": os.path.join(self.tmpdir.name, "checkpoints.sqlite"),
+            "NOVEL_VERSIONING": "false",
+            "NOVEL_SUMMARIES": "false",
+            "QWEN_STREAM": "false",
+        })
+        self.env.start()
+        self.qwen = MockQwenServer(latency=0, tokens_per_second=1e6, seed=0).start()
+        llm_client.configure(base_url=self.qwen.url, api_key="mock")
+        call_governor.configure(call_governor.CallGovernor(call_governor.GovernorSettings()))
+
+    async def asyncSetUp(self):
+        self.client = TestClient(TestServer(create_app(NovelService(), heartbeat=0.5)))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    def tearDown(self):
+        llm_client.configure()
+        call_governor.configure()
+        self.qwen.stop()
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    async def read_events(self, session_id, until, after=0):
+        """读取 SSE 事件直到出现 until 中的事件"""
+        events, event = [], {}
+        async with self.client.get(f"/sessions/{session_id}/events",
+                                   headers={"Last-Event-ID": str(after)}) as response:
+            self.assertEqual(response.headers["Content-Type"], "text/event-stream")
+            async for raw in response.content:
+                line = raw.decode("utf-8").rstrip("\n")
+                if line.startswith("id: "):
+                    event = {"id": int(line[4:])}
+                elif line.startswith("event: "):
+                    event["event"] = line[7:]
+                elif line.startswith("data: "):
+                    event["data"] = json.loads(line[6:])
+                    events.append(event)
+                    if event["event"] in until:
+                        break
+        return events
+
+    async def wait_for_prompt(self, session_id, timeout=10.0):
+        for _ in range(int(timeout / 0.05)):
+            state = await (await self.client.get(f"/sessions/{session_id}")).json()
+            if state["prompt"] is not None:
+                return state
+            await asyncio.sleep(0.05)
+        self.fail(f"会话 {session_id} 没有进入等待回答状态")
+
+    async def test_human_in_the_loop_session(self):
+        """测试通过接口回答提示词完成概念与小说阶段，章节经 SSE 逐章推送"""
+        response = await self.client.post("/sessions", json={"outline": "第一章 雾起\n第二章 来信"})
+        self.assertEqual(response.status, 201)
+        session_id = (await response.json())["id"]
+
+        events = await self.read_events(session_id, {"prompt"})
+        self.assertEqual(events[-1]["data"]["prompt"], "\n请选择（1-2）：")
+        response = await self.client.post(f"/sessions/{session_id}/answer", json={"answer": "2"})
+        self.assertEqual(response.status, 200)
+
+        events = await self.read_events(session_id, {"prompt"}, after=events[-1]["id"])
+        concept = next(e for e in events if e["event"] == "concept")
+        self.assertEqual(concept["data"]["concept"]["title"], "雾港来信")
+        self.assertEqual(events[-1]["data"]["prompt"], "\n请选择（1-3）：")
+        await self.client.post(f"/sessions/{session_id}/answer", json={"answer": "1"})
+
+        events = await self.read_events(session_id, {"done", "error"}, after=events[-1]["id"])
+        self.assertEqual(events[-1]["event"], "done", events[-1])
+        self.assertEqual(sorted(e["data"]["chapter"] for e in events if e["event"] == "chapter"), [1, 2])
+        self.assertTrue(os.path.isdir(events[-1]["data"]["save_path"]))
+
+        state = await (await self.client.get(f"/sessions/{session_id}")).json()
+        self.assertEqual(state["phase"], "done")
+        self.assertEqual(state["result"]["chapters"], 2)
+
+    async def test_answer_without_prompt_is_rejected(self):
+        """测试没有等待回答的提示词时拒绝回答，未知会话返回 404，移除的会话可从检查点恢复"""
+        response = await self.client.post("/sessions", json={"concept": {"title": "星海"}, "outline": "第一章 启程"})
+        session_id = (await response.json())["id"]
+        events = await self.read_events(session_id, {"done", "error"})
+        self.assertEqual(events[-1]["event"], "done")
+        response = await self.client.post(f"/sessions/{session_id}/answer", json={"answer": "1"})
+        self.assertEqual(response.status, 409)
+        self.assertEqual((await self.client.get("/sessions/不存在")).status, 404)
+
+        # 移除后用原会话 ID 重新创建时从检查点恢复，不再重新生成
+        await self.client.delete(f"/sessions/{session_id}")
+        calls = self.qwen.requests
+        await self.client.post("/sessions", json={"id": session_id})
+        events = await self.read_events(session_id, {"done", "error"})
+        self.assertEqual(events[-1]["event"], "done")
+        self.assertEqual(events[-1]["data"]["chapters"], 1)
+        self.assertEqual(self.qwen.requests, calls)
+
+    async def test_unsafe_project_paths_are_rejected(self):
+        """测试标题为绝对路径或包含路径分隔符、.. 时拒绝创建会话，请求体中的 working_dir 被忽略"""
+        for title in ("../逃逸", "a/b", "a\\b", os.path.join(self.tmpdir.name, "外部"), ".."):
+            response = await self.client.post("/sessions", json={"concept": {"title": title}, "outline": "第一章"})
+            self.assertEqual(response.status, 400, title)
+        self.assertEqual(self.client.app[SERVICE].sessions, {})
+
+        outside = os.path.join(self.tmpdir.name, "outside")
+        response = await self.client.post("/sessions", json={
+            "concept": {"title": "星海"}, "outline": "第一章 启程", "working_dir": outside})
+        events = await self.read_events((await response.json())["id"], {"done", "error"})
+        self.assertEqual(events[-1]["event"], "done")
+        self.assertFalse(os.path.exists(outside))
+        self.assertTrue(os.path.isdir(os.path.join(self.tmpdir.name, "星海")))
+
+    async def test_idle_sessions_do_not_hold_threads(self):
+        """测试大量等待回答的会话相互独立，且不各自占用线程"""
+        ids = []
+        for _ in range(40):
+            response = await self.client.post("/sessions", json={})
+            ids.append((await response.json())["id"])
+        for session_id in ids:
+            await self.wait_for_prompt(session_id)
+        self.assertLess(threading.active_count(), 40)
+
+        await self.client.post(f"/sessions/{ids[0]}/answer", json={"answer": "2"})
+        state = await self.wait_for_prompt(ids[0])
+        self.assertEqual(state["prompt"], "\n请选择（1-3）：")
+        other = await (await self.client.get(f"/sessions/{ids[1]}")).json()
+        self.assertEqual(other["prompt"], "\n请选择（1-2）：")
+        self.assertEqual(len(await (await self.client.get("/sessions")).json()), 40)
+
+    async def test_chapter_deltas_are_streamed(self):
+        """测试章节以流式生成，正文片段作为 chapter_delta 推送，完整正文推送后不再保留片段"""
+        published = []
+        original = Session.publish
+
+        def record(session, event, data):
+            published.append(event)
+            original(session, event, data)
+
+        with mock.patch.object(Session, "publish", record):
+            response = await self.client.post("/sessions", json={"concept": {"title": "流式"}, "outline": "第一章 启程"})
+            session_id = (await response.json())["id"]
+            events = await self.read_events(session_id, {"done", "error"})
+        self.assertEqual(events[-1]["event"], "done", events[-1])
+        self.assertIn("chapter_delta", published)
+        self.assertLess(published.index("chapter_delta"), published.index("chapter"))
+        session = self.client.app[SERVICE].sessions[session_id]
+        self.assertNotIn("chapter_delta", [e["event"] for e in session.events])
+        self.assertEqual(session.events_after(0)[-1]["id"], session.last_event_id)
+
+    async def test_finished_sessions_expire(self):
+        """测试结束超过 TTL 的会话被移除，未结束的会话保留"""
+        service = self.client.app[SERVICE]
+        response = await self.client.post("/sessions", json={"concept": {"title": "过期"}, "outline": "第一章 启程"})
+        finished = (await response.json())["id"]
+        await self.read_events(finished, {"done", "error"})
+        waiting = (await (await self.client.post("/sessions", json={})).json())["id"]
+        await self.wait_for_prompt(waiting)
+
+        service.session_ttl = 3600
+        self.assertEqual(service.evict_expired(), [])
+        service.session_ttl = 0
+        self.assertEqual(service.evict_expired(), [finished])
+        self.assertEqual((await self.client.get(f"/sessions/{finished}")).status, 404)
+        self.assertEqual((await self.client.get(f"/sessions/{waiting}")).status, 200)
+
+    async def test_delete_cancels_running_session(self):
+        """测试删除运行中的会话时取消其任务并通知工作线程停止"""
+        self.qwen.latency = 0.5
+        response = await self.client.post("/sessions", json={"concept": {"title": "取消"}, "outline": "第一章 启程"})
+        session_id = (await response.json())["id"]
+        session = self.client.app[SERVICE].sessions[session_id]
+        self.assertTrue(session.running)
+        await self.client.delete(f"/sessions/{session_id}")
+        await asyncio.gather(session.task, return_exceptions=True)
+        self.assertTrue(session.task.cancelled())
+        self.assertTrue(session.cancelled.is_set())
+        self.assertFalse(session.running)
+
+if __name__ == '__main__':
+    unittest.main()
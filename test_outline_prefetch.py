@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import unittest
+
+from novel_agent import NovelConcept
+from outline_prefetch import OutlinePrefetcher, concept_hash
+
+class TestOutlinePrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.prefetcher = OutlinePrefetcher(max_entries=2)
+
+    def tearDown(self):
+        self.prefetcher.close()
+
+    def test_concept_hash_tracks_content(self):
+        """测试概念哈希只取决于内容"""
+        concept = NovelConcept(title="雾港来信", key_plot_points=["旧信"])
+        self.assertEqual(concept_hash(concept), concept_hash(concept.model_copy(deep=True)))
+        concept.key_plot_points.append("返乡")
+        self.assertNotEqual(concept_hash(concept), concept_hash(NovelConcept(title="雾港来信", key_plot_points=["旧信"])))
+
+    def test_take_waits_for_result(self):
+        """测试取用仍在生成的预取结果时等待完成，同一个键不重复开始"""
+        release = threading.Event()
+        calls = []
+
+        async def generate():
+            calls.append(1)
+            await asyncio.get_running_loop().run_in_executor(None, release.wait)
+            return "第一章 起"
+
+        self.assertTrue(self.prefetcher.start("a", generate))
+        self.assertFalse(self.prefetcher.start("a", generate))
+        threading.Timer(0.05, release.set).start()
+        self.assertEqual(self.prefetcher.take("a", timeout=5), "第一章 起")
+        self.assertIsNone(self.prefetcher.take("a"))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.prefetcher.snapshot()["hits"], 1)
+
+    def test_discard_cancels_running_generation(self):
+        """测试丢弃预取时取消进行中的生成"""
+        started, cancelled = threading.Event(), threading.Event()
+
+        async def generate():
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return "不应返回"
+
+        self.prefetcher.start("a", generate)
+        self.assertTrue(started.wait(5))
+        self.assertTrue(self.prefetcher.discard("a"))
+        self.assertTrue(cancelled.wait(5))
+        self.assertIsNone(self.prefetcher.take("a"))
+
+    def test_oldest_entry_evicted(self):
+        """测试超出容量时取消最早的预取"""
+        async def generate():
+            await asyncio.sleep(60)
+
+        for key in ("a", "b", "c"):
+            self.prefetcher.start(key, generate)
+        self.assertFalse(self.prefetcher.pending("a"))
+        self.assertTrue(self.prefetcher.pending("c"))
+        self.assertEqual(self.prefetcher.snapshot()["cancelled"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from outline_tree import OutlineTree, chapter_records, plan_regeneration
+
+OUTLINE = """全书总述
+第一卷 雾港
+卷首说明
+第一章 邮局
+- 沈默分拣信件
+- 林晚来信
+第二章 渡轮
+第二卷 归航
+第三章 码头
+场景1：周海生清点账目
+"""
+
+class TestOutlineTree(unittest.TestCase):
+    def test_parse_hierarchy(self):
+        """测试解析卷、章、场景的层级"""
+        tree = OutlineTree.parse(OUTLINE)
+        volumes = [node for node in tree.root.children if node.kind == "volume"]
+        self.assertEqual([v.heading for v in volumes], ["第一卷 雾港", "第二卷 归航"])
+        self.assertEqual(volumes[0].body, ["卷首说明"])
+        chapters = [chapter for _, chapter in tree.chapters()]
+        self.assertEqual([c.heading for c in chapters], ["第一章 邮局", "第二章 渡轮", "第三章 码头"])
+        self.assertEqual([s.heading for s in chapters[0].children], ["- 沈默分拣信件", "- 林晚来信"])
+        self.assertEqual(tree.chapter_entries()[2], "第三章 码头\n场景1：周海生清点账目")
+        self.assertEqual(OutlineTree.from_dict(tree.to_dict()).to_text(), tree.to_text())
+
+    def test_scene_edit_only_stales_its_chapter(self):
+        """测试修改场景只影响所在章节"""
+        tree = OutlineTree.parse(OUTLINE)
+        drafts = ["正文一", "正文二", "正文三"]
+        records = chapter_records(tree, drafts)
+
+        edited = OutlineTree.parse(OUTLINE.replace("林晚来信", "林晚失踪"))
+        reused, stale = plan_regeneration(records, edited, drafts)
+        self.assertEqual(stale, [0])
+        self.assertEqual(reused, [None, "正文二", "正文三"])
+
+    def test_volume_edit_stales_whole_volume(self):
+        """测试修改卷说明时该卷所有章节都需要重新生成"""
+        tree = OutlineTree.parse(OUTLINE)
+        drafts = ["正文一", "正文二", "正文三"]
+        edited = OutlineTree.parse(OUTLINE.replace("卷首说明", "新的卷首说明"))
+        _, stale = plan_regeneration(chapter_records(tree, drafts), edited, drafts)
+        self.assertEqual(stale, [0, 1])
+
+    def test_inserted_chapter_keeps_moved_drafts(self):
+        """测试插入新章节后，后移的章节仍沿用原有正文"""
+        tree = OutlineTree.parse("第一章 起\n第二章 承")
+        drafts = ["正文一", "正文二"]
+        edited = OutlineTree.parse("第一章 起\n第二章 新增\n第二章 承")
+        reused, stale = plan_regeneration(chapter_records(tree, drafts), edited, drafts)
+        self.assertEqual(stale, [1])
+        self.assertEqual(reused, ["正文一", None, "正文二"])
+
+    def test_failed_chapter_stays_stale(self):
+        """测试生成失败的章节下次仍需生成"""
+        tree = OutlineTree.parse("第一章 起\n第二章 承")
+        records = chapter_records(tree, ["正文一", None])
+        _, stale = plan_regeneration(records, tree, ["正文一", ""])
+        self.assertEqual(stale, [1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from novel_agent import NovelConcept, save_concept, save_draft
+from project_catalog import ProjectCatalog, get_catalog, main
+
+class TestProjectCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {
+            "NOVEL_WORKING_DIR": self.tmpdir.name,
+            "NOVEL_VERSIONING": "false",
+            "NOVEL_RETRIEVAL": "false",
+        })
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        get_catalog(self.tmpdir.name).close()
+        self.tmpdir.cleanup()
+
+    def save_project(self, title, genre, chapters):
+        concept = NovelConcept(title=title, genre=genre, word_count_target=100000)
+        save_concept(concept)
+        save_draft({'concept': concept, 'outline': "第一章 雾起", 'chapters': chapters,
+                    'working_dir': self.tmpdir.name})
+
+    def test_saves_update_catalog(self):
+        """测试保存概念与草稿后索引即可列出、筛选与打开项目"""
+        self.save_project("雾港来信", "悬疑", ["海雾漫过码头。", "沈默站在邮局门口。"])
+        self.save_project("星海", "科幻", ["启程。"])
+        catalog = get_catalog(self.tmpdir.name)
+
+        entry = catalog.get("雾港来信")
+        self.assertEqual((entry.genre, entry.word_count_target, entry.chapter_count, entry.word_count),
+                         ("悬疑", 100000, 2, 16))
+        self.assertTrue(os.path.exists(entry.concept_path))
+        self.assertTrue(os.path.isdir(entry.project_dir))
+        self.assertEqual([e.title for e in catalog.list(genre="科幻")], ["星海"])
+        self.assertEqual([e.title for e in catalog.list(search="雾港")], ["雾港来信"])
+        self.assertEqual(len(catalog.list(limit=1)), 1)
+        self.assertEqual(catalog.verify(), {"missing": [], "orphaned": [], "stale": []})
+
+    def test_untitled_project_uses_directory_title(self):
+        """测试空标题的概念文件、索引条目与项目目录都记在“未命名”下"""
+        self.save_project("", "悬疑", ["海雾漫过码头。"])
+        catalog = get_catalog(self.tmpdir.name)
+
+        self.assertIsNone(catalog.get(""))
+        entry = catalog.get("未命名")
+        self.assertEqual((entry.genre, entry.chapter_count), ("悬疑", 1))
+        self.assertEqual(os.path.basename(entry.concept_path), "未命名_concept.txt")
+        self.assertEqual(entry.project_dir, os.path.join(os.path.abspath(self.tmpdir.name), "未命名"))
+        self.assertEqual(catalog.verify(), {"missing": [], "orphaned": [], "stale": []})
+
+    def test_verify_and_rebuild(self):
+        """测试索引与磁盘不一致时 verify 能发现，rebuild 从磁盘重建（包括早期的整本草稿文件）"""
+        self.save_project("雾港来信", "悬疑", ["海雾漫过码头。"])
+        catalog = get_catalog(self.tmpdir.name)
+        catalog.remove("雾港来信")
+        with open(os.path.join(self.tmpdir.name, "旧稿_draft.txt"), "w", encoding="utf-8") as f:
+            f.write("很久以前写的草稿")
+        catalog._upsert("已删除", {"genre": "奇幻", "updated_at": 0.0})
+
+        self.assertEqual(catalog.verify(), {"missing": ["旧稿", "雾港来信"], "orphaned": ["已删除"], "stale": []})
+        self.assertEqual(main(["--working-dir", self.tmpdir.name, "verify"]), 1)
+        self.assertEqual(catalog.rebuild(), 2)
+        self.assertEqual(main(["--working-dir", self.tmpdir.name, "verify"]), 0)
+        self.assertEqual(catalog.get("旧稿").word_count, 8)
+        self.assertEqual(catalog.get("雾港来信").genre, "悬疑")
+
+    def test_catalog_persists(self):
+        """测试索引保存在工作目录中，重新打开后仍可查询"""
+        self.save_project("雾港来信", "悬疑", ["海雾漫过码头。"])
+        reopened = ProjectCatalog(self.tmpdir.name)
+        try:
+            self.assertEqual(reopened.get("雾港来信").chapter_count, 1)
+        finally:
+            reopened.close()
+
+if __name__ == "__main__":
+    unittest.main()
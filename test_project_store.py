@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from project_store import ChapterHandle, ProjectStore, atomic_write
+
+class TestProjectStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, "测试小说")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_only_dirty_chapters_written(self):
+        """测试修改一章后只写入该章与 manifest"""
+        store = ProjectStore(self.root)
+        store.set_outline("第一章\n第二章\n第三章")
+        chapters = ["第一章正文", "第二章正文", "第三章正文"]
+        store.set_chapters(chapters)
+        self.assertEqual(len(store.flush()), 5)
+
+        chapters[1] = "第二章改写后的正文"
+        store.set_chapters(chapters)
+        written = store.flush()
+        self.assertEqual([os.path.basename(p) for p in written], ["000002.txt", "manifest.json"])
+        self.assertEqual(store.flush(), [])
+
+    def test_reload_from_disk(self):
+        """测试新实例按哈希识别未改动的章节"""
+        store = ProjectStore(self.root)
+        store.set_chapters(["甲", "乙"])
+        store.flush()
+
+        reloaded = ProjectStore(self.root)
+        self.assertEqual(reloaded.read_chapters(), ["甲", "乙"])
+        reloaded.set_chapters(["甲", "新插入", "乙"])
+        written = reloaded.flush()
+        self.assertEqual([os.path.basename(p) for p in written], ["000003.txt", "manifest.json"])
+        self.assertEqual(ProjectStore(self.root).read_chapters(), ["甲", "新插入", "乙"])
+
+    def test_removed_chapters_deleted(self):
+        """测试删除的章节文件在 manifest 更新后被清理"""
+        store = ProjectStore(self.root)
+        store.set_chapters(["甲", "乙"])
+        store.flush()
+        store.set_chapters(["甲"])
+        store.flush()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, "chapters"))), ["000001.txt"])
+
+    def test_chapter_handle_reads_lazily(self):
+        """测试句柄只保存章节条目，正文按需从磁盘读取（大文件经 mmap）"""
+        store = ProjectStore(self.root)
+        handle = ChapterHandle(store.root, [store.write_chapter("甲" * 100), store.write_chapter("乙")])
+        self.assertEqual(store.chapter_count, 0)
+        self.assertEqual(len(handle), 2)
+        self.assertEqual(handle.chars, 101)
+        with mock.patch("project_store.MMAP_THRESHOLD", 10):
+            self.assertEqual(handle[0], "甲" * 100)
+        self.assertEqual(handle, ["甲" * 100, "乙"])
+        self.assertNotEqual(handle, ["甲", "乙"])
+
+    def test_set_entries_removes_replaced_chapters(self):
+        """测试保存句柄时 manifest 引用新写入的章节，被替换的旧章节文件在 flush 后删除"""
+        store = ProjectStore(self.root)
+        store.set_chapters(["甲", "乙"])
+        store.flush()
+        handle = store.handle()
+        revised = handle.replace(1, store.write_chapter("乙（改）"))
+        self.assertEqual(handle[1], "乙")
+
+        store.set_entries(revised.entries)
+        store.flush()
+        self.assertEqual(ProjectStore(self.root).read_chapters(), ["甲", "乙（改）"])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, "chapters"))), ["000001.txt", "000003.txt"])
+
+    def test_atomic_write_leaves_no_temp_files(self):
+        """测试原子写入不留下临时文件"""
+        path = os.path.join(self.root, "outline.txt")
+        atomic_write(path, "大纲")
+        atomic_write(path, "新大纲")
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "新大纲")
+        self.assertEqual(os.listdir(self.root), ["outline.txt"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+import call_governor
+import llm_client
+import prompt_builder
+from mock_qwen_server import MockQwenServer
+from novel_agent import NovelConcept, _draft_chapters, format_concept
+from prompt_builder import PromptBuilder
+
+class TestPromptBuilder(unittest.TestCase):
+    def test_prefix_is_canonical(self):
+        """测试换行与行尾空白不同的相同内容得到逐字节相同的前缀"""
+        a = PromptBuilder("标题：雾港来信\n类型：悬疑", "第一章 雾起\n第二章 来信\n")
+        b = PromptBuilder("标题：雾港来信  \r\n类型：悬疑\r\n", "\n第一章 雾起\r\n第二章 来信")
+        self.assertEqual(a.prefix.encode("utf-8"), b.prefix.encode("utf-8"))
+        self.assertEqual(a.revision, b.revision)
+        self.assertNotEqual(a.revision, PromptBuilder("标题：雾港来信\n类型：悬疑", "第一章 雾起").revision)
+
+    def test_volatile_parts_follow_prefix(self):
+        """测试每次不同的内容只出现在前缀之后的 user 消息中"""
+        builder = PromptBuilder("标题：雾港来信", "第一章 雾起\n第二章 来信")
+        first = builder.messages("前情：无", "撰写第一章")
+        second = builder.messages("", "撰写第二章")
+        self.assertEqual(first[0], second[0])
+        self.assertTrue(first[0]["content"].startswith(prompt_builder.SYSTEM_PROMPT))
+        self.assertEqual(first[1], {"role": "user", "content": "前情：无\n\n撰写第一章"})
+        self.assertEqual(second[1]["content"], "撰写第二章")
+
+class TestPromptCacheAccounting(unittest.TestCase):
+    def setUp(self):
+        self.server = MockQwenServer(latency=0, tokens_per_second=1e6, seed=0).start()
+        llm_client.configure(base_url=self.server.url, api_key="mock")
+        call_governor.configure(call_governor.CallGovernor(call_governor.GovernorSettings(max_retries=0)))
+        prompt_builder.reset_stats()
+
+    def tearDown(self):
+        prompt_builder.reset_stats()
+        call_governor.configure()
+        llm_client.configure()
+        self.server.stop()
+
+    def test_chapters_share_cached_prefix(self):
+        """测试各章请求共用同一前缀，缓存命中按项目记录"""
+        concept = NovelConcept(title="雾港来信", genre="悬疑")
+        outline = "第一章 雾起\n第二章 来信\n第三章 旧案"
+        entries = ["第一章 雾起", "第二章 来信", "第三章 旧案"]
+        builder = PromptBuilder(format_concept(concept), outline)
+        with prompt_builder.project("雾港来信", builder):
+            chapters = asyncio.run(_draft_chapters(concept, outline, entries, concurrency=1, retries=0))
+        self.assertTrue(all(chapters))
+        llm_client.chat_completion([{"role": "user", "content": "不属于任何项目"}])
+
+        stats = prompt_builder.snapshot()
+        self.assertEqual(list(stats), ["雾港来信"])
+        self.assertEqual(stats["雾港来信"]["requests"], 3)
+        self.assertEqual(stats["雾港来信"]["revision"], builder.revision)
+        self.assertEqual(stats["雾港来信"]["cached_tokens"], 2 * len(builder.prefix))
+        self.assertGreater(stats["雾港来信"]["hit_rate"], 0.5)
+
+if __name__ == "__main__":
+    unittest.main()
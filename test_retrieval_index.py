@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from retrieval_index import RetrievalIndex, format_passages, tokenize
+
+CHAPTERS = [
+    ("000001", "沈默第一次出现在雾港邮局，他的左手有一道旧伤疤。\n他负责分拣寄往码头的信件。"),
+    ("000002", "林晚坐渡轮回到雾港，她想查清父亲死亡的真相。"),
+    ("000003", "码头仓库里堆满了走私的香料，周海生在清点账目。"),
+]
+
+class TestRetrievalIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index = RetrievalIndex(os.path.join(self.tmpdir.name, "index.sqlite"))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def test_tokenize_bigrams(self):
+        """测试汉字二元组与英文单词切分"""
+        self.assertEqual(tokenize("雾港邮局 Post"), ["雾港", "港邮", "邮局", "post"])
+
+    def test_bm25_ranking(self):
+        """测试按相关度返回片段"""
+        self.index.sync(CHAPTERS)
+        results = self.index.search("沈默手上的伤疤", k=2)
+        self.assertEqual(results[0].position, 1)
+        self.assertIn("伤疤", format_passages(results))
+        self.assertEqual(self.index.search("伤疤", exclude_positions=[1]), [])
+
+    def test_before_position_excludes_later_chapters(self):
+        """测试 before_position 排除该位置及之后的所有章节"""
+        self.index.sync(CHAPTERS)
+        self.assertEqual({p.position for p in self.index.search("雾港码头", k=3)}, {1, 2, 3})
+        self.assertEqual({p.position for p in self.index.search("雾港码头", k=3, before_position=2)}, {1})
+        self.assertEqual(self.index.search("雾港码头", before_position=1), [])
+
+    def test_incremental_sync(self):
+        """测试只重建有变化的章节，并移除被删除的章节"""
+        self.assertEqual(self.index.sync(CHAPTERS), ["000001", "000002", "000003"])
+        changed = [CHAPTERS[0], ("000002", "林晚在灯塔下发现了一枚旧怀表。")]
+        self.assertEqual(self.index.sync(changed), ["000002"])
+        self.assertEqual(self.index.search("怀表")[0].position, 2)
+        self.assertEqual(self.index.search("走私香料"), [])
+
+if __name__ == '__main__':
+    unittest.main()
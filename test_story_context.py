@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+
+import llm_client
+from story_context import StoryContext
+
+class TestStoryContext(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    async def summarize(self, text, max_chars):
+        self.calls.append(text)
+        return f"摘要{len(self.calls)}"
+
+    def test_incremental_update(self):
+        """测试只为改动的章节及其所在篇章重新生成摘要"""
+        context = StoryContext(arc_size=2)
+        chapters = ["甲", "乙", "丙"]
+        self.assertEqual(asyncio.run(context.update(chapters, self.summarize)), [0, 1, 2])
+        self.assertEqual(len(context.arcs), 1)
+        self.assertEqual(len(self.calls), 4)
+
+        chapters[2] = "丙（改）"
+        self.assertEqual(asyncio.run(context.update(chapters, self.summarize)), [2])
+        self.assertEqual(len(self.calls), 5)
+
+        restored = StoryContext.from_dict(context.to_dict())
+        self.assertEqual(restored.stale_chapters(chapters), [])
+
+    def test_prompt_stays_within_budget(self):
+        """测试前情提要的规模不随章节数增长"""
+        chapters = ["海雾漫过码头。" * 200 for _ in range(60)]
+        context = StoryContext(arc_size=10)
+        context.chapters = [{"hash": "", "summary": "人物相遇，线索浮现。" * 5} for _ in chapters]
+        context.arcs = [{"hash": "", "summary": "一段篇章的经过。" * 10} for _ in range(6)]
+
+        early = context.build(5, chapters, budget_tokens=800, recent_chars=300)
+        late = context.build(59, chapters, budget_tokens=800, recent_chars=300)
+        self.assertIn("第5章概要", early)
+        self.assertIn("上一章结尾", late)
+        self.assertLessEqual(llm_client.estimate_tokens(late), 800 + 20)
+        self.assertIn("第59章概要", late)
+        self.assertNotIn("第1-10章概要", late)
+        self.assertEqual(context.build(0, chapters), "")
+
+    def test_build_looks_up_summaries_by_hash(self):
+        """测试提供各章哈希时按哈希取摘要，章节移动后摘要跟随章节，尚无正文的位置不取摘要"""
+        context = StoryContext(arc_size=10)
+        context.chapters = [{"hash": "甲", "summary": "甲的摘要"}, {"hash": "乙", "summary": "乙的摘要"},
+                            {"hash": "丙", "summary": "丙的摘要"}]
+        # 删除第一章、在最后插入新章节后生成第 3 章
+        prompt = context.build(2, ["乙正文", "丙正文", ""], hashes=["乙", "丙", None])
+        self.assertIn("第1章概要：乙的摘要", prompt)
+        self.assertIn("第2章概要：丙的摘要", prompt)
+        self.assertNotIn("甲的摘要", prompt)
+        self.assertIn("上一章结尾：\n丙正文", prompt)
+        self.assertEqual(context.build(1, ["", ""], hashes=[None, None]), "")
+
+if __name__ == '__main__':
+    unittest.main()
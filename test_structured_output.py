@@ -0,0 +1,63 @@
+import unittest
+from types import SimpleNamespace
+from typing import Dict, List
+from unittest import mock
+
+from pydantic import BaseModel
+
+from structured_output import StructuredOutputError, generate_model, load_json_object, validate_fields
+
+class Character(BaseModel):
+    name: str
+    role: str
+
+class Story(BaseModel):
+    title: str = ""
+    word_count: int = 0
+    characters: List[Dict] = []
+
+def reply(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+class TestStructuredOutput(unittest.TestCase):
+    def test_load_json_object(self):
+        self.assertEqual(load_json_object('```json\n{"title": "雾港"}\n```'), {"title": "雾港"})
+        with self.assertRaises(StructuredOutputError):
+            load_json_object("[1, 2]")
+
+    def test_validate_fields_reports_each_field(self):
+        """测试逐字段校验，只报告缺失或不合法的字段"""
+        valid, errors = validate_fields(
+            Story, {"title": "雾港", "word_count": "十万", "characters": [{"name": "沈默"}]},
+            required=("title", "word_count", "characters"), types={"characters": List[Character]},
+        )
+        self.assertEqual(valid, {"title": "雾港"})
+        self.assertEqual(set(errors), {"word_count", "characters"})
+
+    def test_repair_requests_only_invalid_fields(self):
+        """测试只对不合法的字段发起修复请求，合法字段原样保留"""
+        replies = [
+            reply('{"title": "雾港", "word_count": "十万"}'),
+            reply('{"word_count": 100000}'),
+        ]
+        with mock.patch("llm_client.chat_completion", side_effect=replies) as completion:
+            story, errors = generate_model(Story, [{"role": "user", "content": "生成"}],
+                                           required=("title", "word_count"))
+        self.assertEqual((story.title, story.word_count), ("雾港", 100000))
+        self.assertEqual(errors, {})
+        self.assertEqual(completion.call_args_list[1].kwargs["task"], "repair")
+        repair_prompt = completion.call_args_list[1].args[0][-1]["content"]
+        self.assertIn("word_count", repair_prompt)
+        self.assertNotIn("title", repair_prompt)
+
+    def test_unrepaired_fields_keep_defaults(self):
+        """测试多轮修复后仍不合法的字段保留默认值并返回原因"""
+        replies = [reply('{"title": "雾港"}'), reply("不是 JSON"), reply('{"word_count": "很多"}')]
+        with mock.patch("llm_client.chat_completion", side_effect=replies):
+            story, errors = generate_model(Story, [{"role": "user", "content": "生成"}],
+                                           required=("title", "word_count"))
+        self.assertEqual((story.title, story.word_count), ("雾港", 0))
+        self.assertEqual(list(errors), ["word_count"])
+
+if __name__ == "__main__":
+    unittest.main()
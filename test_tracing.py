@@ -0,0 +1,114 @@
+import inspect
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import call_governor
+import llm_client
+import tracing
+from mock_qwen_server import MockQwenServer
+from project_store import atomic_write
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "trace.jsonl")
+        self.tracer = tracing.Tracer(self.path)
+        tracing.configure(self.tracer)
+
+    def tearDown(self):
+        tracing.configure()
+        self.tmpdir.cleanup()
+
+    def test_child_counters_roll_up_to_parent(self):
+        """测试子 span 的计数累加到父 span，并逐行写入 JSONL"""
+        with tracing.span("save", "node") as node:
+            with tracing.span("chat_completion", "llm") as call:
+                call.add(prompt_tokens=100, completion_tokens=20, retries=1)
+            atomic_write(os.path.join(self.tmpdir.name, "a.txt"), "你好")
+
+        with open(self.path, encoding="utf-8") as f:
+            spans = [json.loads(line) for line in f]
+        self.assertEqual([s["name"] for s in spans], ["chat_completion", "save"])
+        self.assertEqual(spans[0]["parent_id"], node.span_id)
+        self.assertEqual((spans[1]["prompt_tokens"], spans[1]["completion_tokens"]), (100, 20))
+        self.assertEqual((spans[1]["retries"], spans[1]["bytes_written"]), (1, 6))
+
+    def test_errors_are_recorded(self):
+        with self.assertRaises(ValueError):
+            with tracing.span("create_draft", "node"):
+                raise ValueError("坏了")
+        self.assertIn("ValueError", self.tracer.spans[0]["error"])
+        self.assertEqual(self.tracer.summary()[0]["errors"], 1)
+
+    def test_traced_keeps_signature(self):
+        """测试装饰后的节点保留签名，LangGraph 仍能注入 config"""
+        def node(state, config: "Optional[RunnableConfig]" = None):
+            return state
+
+        wrapped = tracing.traced("node", "node")(node)
+        self.assertEqual(list(inspect.signature(wrapped).parameters), ["state", "config"])
+        self.assertEqual(wrapped({"a": 1}), {"a": 1})
+        self.assertEqual(self.tracer.summary()[0]["count"], 1)
+
+    def test_llm_usage_is_recorded(self):
+        """测试模型调用的 token 用量与缓存命中 token 记入 span"""
+        llm_client.configure(llm_client.LLMSettings(api_key="test-key"))
+        usage = SimpleNamespace(prompt_tokens=50, completion_tokens=10,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=40))
+        completions = llm_client.get_client().chat.completions
+        try:
+            with mock.patch.object(completions, "create", return_value=SimpleNamespace(usage=usage)):
+                with tracing.span("summarize", "node"):
+                    llm_client.chat_completion([{"role": "user", "content": "你好"}])
+        finally:
+            llm_client.configure()
+
+        rows = {row["name"]: row for row in self.tracer.summary()}
+        self.assertEqual(rows["chat_completion"]["cached_tokens"], 40)
+        self.assertEqual(rows["summarize"]["llm_calls"], 1)
+        self.assertEqual(rows["summarize"]["prompt_tokens"], 50)
+        self.assertIn("summarize", tracing.format_summary(self.tracer.summary()))
+
+    def test_streamed_usage_is_recorded(self):
+        """测试流式请求带 include_usage，模拟服务返回的用量（同步与异步）都记入 span"""
+        server = MockQwenServer(latency=0, tokens_per_second=1e6, seed=0).start()
+        llm_client.configure(base_url=server.url, api_key="mock")
+        call_governor.configure(call_governor.CallGovernor(call_governor.GovernorSettings(max_retries=0)))
+        messages = [{"role": "user", "content": "请根据以上信息撰写本章正文"}]
+
+        async def astream():
+            return [chunk async for chunk in await llm_client.achat_completion(messages, stream=True)]
+
+        try:
+            self.assertEqual(llm_client.build_request(messages, stream=True)["stream_options"], {"include_usage": True})
+            with tracing.span("sync", "node"):
+                chunks = list(llm_client.chat_completion(messages, stream=True))
+            with tracing.span("async", "node"):
+                llm_client.run(astream())
+        finally:
+            call_governor.configure()
+            llm_client.configure()
+            server.stop()
+
+        content = ''.join(chunk.choices[0].delta.content for chunk in chunks if chunk.choices)
+        self.assertEqual((chunks[-1].choices, chunks[-1].usage.completion_tokens), ([], len(content)))
+        self.assertEqual(chunks[-2].choices[0].finish_reason, "stop")
+        rows = {row["name"]: row for row in self.tracer.summary()}
+        for name in ("sync", "async"):
+            self.assertEqual(rows[name]["completion_tokens"], len(content))
+            self.assertGreater(rows[name]["prompt_tokens"], 0)
+
+    def test_disabled_tracing_is_noop(self):
+        tracing.configure()
+        with mock.patch.dict(os.environ, {"NOVEL_TRACE_FILE": ""}):
+            self.assertIsNone(tracing.get_tracer())
+            with tracing.span("x", "node") as span:
+                span.add(prompt_tokens=1)
+            self.assertIs(span, tracing.NULL_SPAN)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import unittest
+
+from version_store import DRAFT_DOC, VersionStore, chapter_doc, split_chunks
+
+def make_novel(changed: str = "") -> str:
+    paragraphs = [f"第{i}段：海雾从码头漫上来，吞没了路灯。{'补' * (i % 7)}\n" for i in range(400)]
+    if changed:
+        paragraphs[200] = changed + "\n"
+    return ''.join(paragraphs)
+
+class TestVersionStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = VersionStore(self.tmpdir.name)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def chunk_files(self) -> int:
+        return sum(len(files) for _, _, files in os.walk(os.path.join(self.store.root, "chunks")))
+
+    def test_chunks_roundtrip(self):
+        """测试切块后能无损拼回"""
+        text = make_novel()
+        self.assertEqual(''.join(split_chunks(text)), text)
+        self.assertGreater(len(split_chunks(text)), 1)
+
+    def test_revisions_share_unchanged_chunks(self):
+        """测试只修改一段时新修订只新增少量块"""
+        first = self.store.commit("draft", make_novel())
+        before = self.chunk_files()
+        second = self.store.commit("draft", make_novel("第200段：改写后的段落。"))
+        self.assertLessEqual(self.chunk_files() - before, 2)
+        self.assertIsNone(self.store.commit("draft", make_novel("第200段：改写后的段落。")))
+
+        self.assertEqual([r.id for r in self.store.list("draft")], [second, first])
+        self.assertEqual(self.store.get(first), make_novel())
+
+        diff = self.store.diff(first, second)
+        self.assertIn("@@ -199,5 +199,5 @@", diff)
+        self.assertIn("+第200段：改写后的段落。", diff)
+        self.assertEqual(sum(line.startswith('-第') for line in diff.splitlines()), 1)
+
+    def test_restore(self):
+        """测试恢复旧修订会成为最新修订"""
+        first = self.store.commit("outline", "第一章\n")
+        self.store.commit("outline", "第一章\n第二章\n")
+        self.assertEqual(self.store.restore(first), "第一章\n")
+        latest = self.store.list("outline", limit=1)[0]
+        self.assertEqual(self.store.get(latest.id), "第一章\n")
+
+    def test_draft_restore_and_diff_rebuild_chapters(self):
+        """测试按草稿修订恢复与比较时得到各章正文，而不是修订 ID 列表"""
+        def save(chapters):
+            revisions = [self.store.commit(chapter_doc(i), text) or self.store.latest(chapter_doc(i))
+                         for i, text in enumerate(chapters)]
+            return self.store.commit(DRAFT_DOC, json.dumps(revisions))
+
+        first = save(["海雾漫过码头。\n", "沈默站在邮局门口。\n"])
+        second = save(["海雾漫过码头。\n", "信封上没有署名。\n", "第三章的开头。\n"])
+        self.assertEqual(self.store.get_draft(second)[1], "信封上没有署名。\n")
+
+        diff = self.store.diff_draft(first, second)
+        self.assertNotIn("第 1 章", diff)
+        self.assertIn("=== 第 2 章 ===", diff)
+        self.assertIn("-沈默站在邮局门口。", diff)
+        self.assertIn("+第三章的开头。", diff)
+
+        self.assertEqual(self.store.restore_draft(first), ["海雾漫过码头。\n", "沈默站在邮局门口。\n"])
+        restored = self.store.latest(DRAFT_DOC)
+        self.assertEqual(self.store.get_draft(restored), self.store.get_draft(first))
+        self.assertEqual(self.store.get(self.store.latest(chapter_doc(1))), "沈默站在邮局门口。\n")
+
+    def test_uncompressed_store(self):
+        """测试不压缩时同样可读写"""
+        store = VersionStore(os.path.join(self.tmpdir.name, "raw"), compress=False)
+        revision = store.commit("concept", "标题：雾港来信\n")
+        self.assertEqual(store.get(revision), "标题：雾港来信\n")
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
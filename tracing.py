@@ -0,0 +1,228 @@
+"""工作流节点与模型调用的追踪
+
+每个工作流节点、模型调用和 save_* 保存操作记为一个 span，记录墙钟耗时、排队等待、
+输入/输出/缓存命中 token 数、重试次数与写入字节数。子 span 结束时把这些计数累加到父 span，
+因此节点 span 中就是该节点下全部模型调用与写入的合计。
+
+span 按 JSONL 逐行写入 NOVEL_TRACE_FILE（或 --trace 指定的文件），--profile 在退出时打印
+按节点汇总的耗时与 token 用量。未启用追踪时 span() 返回空操作对象，几乎没有开销。
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+# 子 span 结束时累加到父 span 的计数
+COUNTERS = ("llm_calls", "prompt_tokens", "completion_tokens", "cached_tokens",
+            "retries", "queue_wait_seconds", "bytes_written")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("novel_span", default=None)
+
+class Span:
+    """一次追踪的操作"""
+
+    def __init__(self, tracer: "Tracer", name: str, kind: str, parent: Optional["Span"], **attributes):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.span_id = os.urandom(8).hex()
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.attributes: Dict = dict(attributes)
+        self._lock = threading.Lock()
+
+    def set(self, **attributes) -> None:
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, **counters) -> None:
+        """累加计数（例如 token 数、写入字节数）"""
+        with self._lock:
+            for key, value in counters.items():
+                if value:
+                    self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.set(error=f"{type(error).__name__}: {error}")
+        if self.parent is not None:
+            self.parent.add(**{key: self.attributes.get(key) for key in COUNTERS})
+        self.tracer.record(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.started_at,
+            "duration_seconds": self.duration,
+            **self.attributes,
+        }
+
+class _NullSpan:
+    """未启用追踪时使用的空操作 span"""
+    def set(self, **attributes) -> None:
+        pass
+
+    def add(self, **counters) -> None:
+        pass
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class Tracer:
+    """收集 span，可选地逐行写入 JSONL 文件"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def start(self, name: str, kind: str, **attributes) -> Span:
+        """开始一个 span，父 span 为当前上下文中的 span；需要调用方自行 finish()"""
+        return Span(self, name, kind, _current.get(), **attributes)
+
+    def record(self, span: Span) -> None:
+        data = span.to_dict()
+        with self._lock:
+            self.spans.append(data)
+            if self._file is not None:
+                self._file.write(json.dumps(data, ensure_ascii=False) + '\n')
+                self._file.flush()
+
+    def summary(self) -> List[Dict]:
+        """按 (类型, 名称) 汇总 span：次数、耗时分位数与各项计数合计"""
+        groups: Dict = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            groups.setdefault((span["kind"], span["name"]), []).append(span)
+        rows = []
+        for (kind, name), group in groups.items():
+            durations = sorted(s["duration_seconds"] for s in group)
+            row = {
+                "kind": kind,
+                "name": name,
+                "count": len(group),
+                "errors": sum(1 for s in group if s.get("error")),
+                "total_seconds": sum(durations),
+                "p50_seconds": durations[min(len(durations) - 1, int(0.50 * len(durations)))],
+                "p95_seconds": durations[min(len(durations) - 1, int(0.95 * len(durations)))],
+            }
+            for key in COUNTERS:
+                row[key] = sum(s.get(key, 0) for s in group)
+            rows.append(row)
+        return sorted(rows, key=lambda r: (r["kind"] != "node", -r["total_seconds"]))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def format_summary(rows: List[Dict]) -> str:
+    """把 summary() 的结果整理成表格"""
+    lines = [f"{'类型':<6}{'名称':<24}{'次数':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'总计(s)':>9}"
+             f"{'输入tok':>9}{'输出tok':>9}{'缓存tok':>9}{'重试':>6}{'排队(s)':>9}{'写入(B)':>10}"]
+    for r in rows:
+        lines.append(
+            f"{r['kind']:<6}{r['name']:<24}{r['count']:>6}{r['p50_seconds'] * 1000:>10.1f}"
+            f"{r['p95_seconds'] * 1000:>10.1f}{r['total_seconds']:>9.2f}{r['prompt_tokens']:>9}"
+            f"{r['completion_tokens']:>9}{r['cached_tokens']:>9}{r['retries']:>6}"
+            f"{r['queue_wait_seconds']:>9.2f}{r['bytes_written']:>10}"
+        )
+    return '\n'.join(lines)
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+_configured = False
+
+def configure(tracer: Optional[Tracer] = None) -> None:
+    """设置全局追踪器；传入 None 时下次使用前重新读取 NOVEL_TRACE_FILE"""
+    global _tracer, _configured
+    with _tracer_lock:
+        old, _tracer = _tracer, tracer
+        _configured = tracer is not None
+    if old is not None and old is not tracer:
+        old.close()
+
+def get_tracer() -> Optional[Tracer]:
+    """获取全局追踪器，未启用时返回 None"""
+    global _tracer, _configured
+    if not _configured:
+        with _tracer_lock:
+            if not _configured:
+                path = os.getenv("NOVEL_TRACE_FILE")
+                _tracer = Tracer(path) if path else None
+                _configured = True
+    return _tracer
+
+def current_span():
+    """当前上下文中的 span，没有时返回空操作对象"""
+    return _current.get() or NULL_SPAN
+
+@contextlib.contextmanager
+def activate(span: Span) -> Iterator[Span]:
+    """在上下文中把 span 设为当前 span（不负责结束它）"""
+    if span is NULL_SPAN:
+        yield span
+        return
+    token = _current.set(span)
+    try:
+        yield span
+    finally:
+        _current.reset(token)
+
+@contextlib.contextmanager
+def span(name: str, kind: str, **attributes) -> Iterator:
+    """追踪一段操作；未启用追踪时产出空操作 span"""
+    tracer = get_tracer()
+    if tracer is None:
+        yield NULL_SPAN
+        return
+    current = tracer.start(name, kind, **attributes)
+    try:
+        with activate(current):
+            yield current
+    except BaseException as e:
+        current.finish(e)
+        raise
+    current.finish()
+
+def traced(name: str, kind: str):
+    """把函数调用记为 span 的装饰器，保留原函数签名（LangGraph 依据签名注入 config）"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+__all__ = [
+    "Span",
+    "Tracer",
+    "activate",
+    "configure",
+    "current_span",
+    "format_summary",
+    "get_tracer",
+    "span",
+    "traced",
+]
@@ -0,0 +1,281 @@
+"""去重的版本历史存储
+
+把文本按内容切分成块，每个块以哈希为名只保存一份（安装了 zstandard 时压缩保存），
+每个修订只记录块哈希列表。列出、比较、恢复修订都只需读取索引和有差异的块：
+
+    {project_dir}/.versions/
+        versions.sqlite
+        chunks/ab/abcdef....
+"""
+import difflib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from project_store import atomic_write
+
+try:
+    import zstandard
+except ImportError:  # 未安装时不压缩
+    zstandard = None
+
+VERSION_DIR = ".versions"
+
+# 草稿修订的文档名：内容为按章节顺序排列的各章修订 ID（JSON 列表）
+DRAFT_DOC = "draft"
+
+def chapter_doc(index: int) -> str:
+    """第 index 章（从 0 开始）的文档名，按章节位置而不是章节文件 ID 命名，重写后历史仍连续"""
+    return f"chapter/{index + 1}"
+
+# 块文件首字节标记编码方式
+_RAW = b"R"
+_ZSTD = b"Z"
+
+def split_chunks(text: str, min_size: int = 512, max_size: int = 8192) -> List[str]:
+    """按行切分内容定义的块
+
+    块边界只取决于行内容与距上一个边界的长度，局部修改后边界很快重新对齐，
+    未改动的段落仍得到相同的块。
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        current.append(line)
+        size += len(line)
+        if size >= max_size or (size >= min_size and zlib.crc32(line.encode("utf-8")) % 8 == 0):
+            chunks.append(''.join(current))
+            current, size = [], 0
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+@dataclass
+class Revision:
+    """一个修订的元数据"""
+    id: int
+    doc: str
+    created_at: str
+    message: str
+    size: int
+    chunk_count: int
+
+class VersionStore:
+    """单个项目的版本历史"""
+
+    def __init__(self, root: str, compress: Optional[bool] = None):
+        self.root = os.path.join(root, VERSION_DIR)
+        self.compress = (zstandard is not None) if compress is None else compress and zstandard is not None
+        os.makedirs(os.path.join(self.root, "chunks"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, "versions.sqlite"), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, lines INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS revisions ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, doc TEXT NOT NULL, created_at TEXT NOT NULL,"
+                " message TEXT NOT NULL, size INTEGER NOT NULL, text_hash TEXT NOT NULL, chunks TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_revisions_doc ON revisions (doc, id)")
+
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.root, "chunks", digest[:2], digest[2:])
+
+    def _write_chunk(self, digest: str, chunk: str) -> None:
+        data = chunk.encode("utf-8")
+        if self.compress:
+            data = _ZSTD + zstandard.ZstdCompressor().compress(data)
+        else:
+            data = _RAW + data
+        atomic_write(self._chunk_path(digest), data)
+
+    def _read_chunk(self, digest: str) -> str:
+        with open(self._chunk_path(digest), "rb") as f:
+            data = f.read()
+        if data[:1] == _ZSTD:
+            if zstandard is None:
+                raise RuntimeError("该版本块使用 zstd 压缩，请先安装 zstandard")
+            return zstandard.ZstdDecompressor().decompress(data[1:]).decode("utf-8")
+        return data[1:].decode("utf-8")
+
+    def commit(self, doc: str, text: str, message: str = "") -> Optional[int]:
+        """保存一个新修订，内容与该文档最新修订相同时不保存并返回 None"""
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            latest = self._conn.execute(
+                "SELECT text_hash FROM revisions WHERE doc = ? ORDER BY id DESC LIMIT 1", (doc,)
+            ).fetchone()
+            if latest and latest[0] == text_hash:
+                return None
+
+            digests = []
+            for chunk in split_chunks(text):
+                digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+                digests.append(digest)
+                known = self._conn.execute("SELECT 1 FROM chunks WHERE hash = ?", (digest,)).fetchone()
+                if not known:
+                    self._write_chunk(digest, chunk)
+                    with self._conn:
+                        self._conn.execute(
+                            "INSERT OR IGNORE INTO chunks (hash, size, lines) VALUES (?, ?, ?)",
+                            (digest, len(chunk), len(chunk.splitlines(keepends=True))),
+                        )
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO revisions (doc, created_at, message, size, text_hash, chunks)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (doc, datetime.now().isoformat(timespec="seconds"), message, len(text),
+                     text_hash, json.dumps(digests)),
+                )
+            return cursor.lastrowid
+
+    def latest(self, doc: str) -> Optional[int]:
+        """文档最新修订的 ID，没有修订时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM revisions WHERE doc = ? ORDER BY id DESC LIMIT 1", (doc,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def list(self, doc: Optional[str] = None, limit: Optional[int] = None) -> List[Revision]:
+        """按时间倒序列出修订"""
+        query = "SELECT id, doc, created_at, message, size, chunks FROM revisions"
+        params: list = []
+        if doc is not None:
+            query += " WHERE doc = ?"
+            params.append(doc)
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [Revision(r[0], r[1], r[2], r[3], r[4], len(json.loads(r[5]))) for r in rows]
+
+    def _chunks_of(self, revision_id: int) -> List[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT chunks FROM revisions WHERE id = ?", (revision_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"不存在的修订：{revision_id}")
+        return json.loads(row[0])
+
+    def get(self, revision_id: int) -> str:
+        """读取某个修订的完整文本"""
+        return ''.join(self._read_chunk(digest) for digest in self._chunks_of(revision_id))
+
+    def restore(self, revision_id: int, message: str = "") -> str:
+        """把某个修订恢复为其文档的最新修订，返回恢复后的文本"""
+        with self._lock:
+            row = self._conn.execute("SELECT doc FROM revisions WHERE id = ?", (revision_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"不存在的修订：{revision_id}")
+        text = self.get(revision_id)
+        self.commit(row[0], text, message or f"恢复到修订 {revision_id}")
+        return text
+
+    def _line_counts(self, digests: List[str]) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT hash, lines FROM chunks WHERE hash IN ({','.join('?' * len(set(digests)))})",
+                list(set(digests)),
+            ).fetchall() if digests else []
+        return dict(rows)
+
+    def diff(self, old_id: int, new_id: int, context: int = 2) -> str:
+        """比较两个修订，只读取有差异的块，输出统一 diff 格式"""
+        return '\n'.join(self._diff(self._chunks_of(old_id), self._chunks_of(new_id),
+                                    f"修订 {old_id}", f"修订 {new_id}", context))
+
+    def _diff(self, old_chunks: List[str], new_chunks: List[str], old_label: str, new_label: str,
+              context: int) -> List[str]:
+        lines = self._line_counts(old_chunks + new_chunks)
+        output = [f"--- {old_label}", f"+++ {new_label}"]
+        matcher = difflib.SequenceMatcher(a=old_chunks, b=new_chunks, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            old_start = sum(lines[d] for d in old_chunks[:i1])
+            new_start = sum(lines[d] for d in new_chunks[:j1])
+            old_lines = ''.join(self._read_chunk(d) for d in old_chunks[i1:i2]).splitlines()
+            new_lines = ''.join(self._read_chunk(d) for d in new_chunks[j1:j2]).splitlines()
+            line_matcher = difflib.SequenceMatcher(a=old_lines, b=new_lines, autojunk=False)
+            for group in line_matcher.get_grouped_opcodes(context):
+                a1, a2, b1, b2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+                output.append(f"@@ -{old_start + a1 + 1},{a2 - a1} +{new_start + b1 + 1},{b2 - b1} @@")
+                for op, x1, x2, y1, y2 in group:
+                    if op == "equal":
+                        output.extend(' ' + line for line in old_lines[x1:x2])
+                        continue
+                    output.extend('-' + line for line in old_lines[x1:x2])
+                    output.extend('+' + line for line in new_lines[y1:y2])
+        return output
+
+    def _draft_revisions(self, revision_id: int) -> List[Optional[int]]:
+        revisions = json.loads(self.get(revision_id))
+        if not isinstance(revisions, list):
+            raise ValueError(f"修订 {revision_id} 不是草稿修订")
+        return revisions
+
+    def get_draft(self, revision_id: int) -> List[str]:
+        """读取草稿修订，返回按顺序排列的各章正文"""
+        return [self.get(chapter) if chapter is not None else "" for chapter in self._draft_revisions(revision_id)]
+
+    def restore_draft(self, revision_id: int, message: str = "") -> List[str]:
+        """把草稿修订中的各章恢复为对应位置的最新修订，再记录一个新的草稿修订，返回各章正文"""
+        message = message or f"恢复到草稿修订 {revision_id}"
+        chapters = self.get_draft(revision_id)
+        revisions = []
+        for i, text in enumerate(chapters):
+            doc = chapter_doc(i)
+            revisions.append(self.commit(doc, text, message) or self.latest(doc))
+        self.commit(DRAFT_DOC, json.dumps(revisions), message)
+        return chapters
+
+    def diff_draft(self, old_id: int, new_id: int, context: int = 2) -> str:
+        """逐章比较两个草稿修订，只输出有改动的章节；增删的章节与空文本比较"""
+        old, new = self._draft_revisions(old_id), self._draft_revisions(new_id)
+        output = [f"--- 草稿修订 {old_id}", f"+++ 草稿修订 {new_id}"]
+        for i in range(max(len(old), len(new))):
+            a = old[i] if i < len(old) else None
+            b = new[i] if i < len(new) else None
+            if a == b:
+                continue
+            output.append(f"=== 第 {i + 1} 章 ===")
+            output.extend(self._diff(self._chunks_of(a) if a is not None else [],
+                                     self._chunks_of(b) if b is not None else [],
+                                     f"修订 {a}" if a is not None else "（无）",
+                                     f"修订 {b}" if b is not None else "（无）", context))
+        return '\n'.join(output)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+_stores: Dict[str, VersionStore] = {}
+_stores_lock = threading.Lock()
+
+def get_version_store(project_root: str) -> VersionStore:
+    """获取项目的版本存储，进程内共享"""
+    root = os.path.abspath(project_root)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = VersionStore(root)
+        return _stores[root]
+
+__all__ = [
+    "DRAFT_DOC",
+    "Revision",
+    "VersionStore",
+    "chapter_doc",
+    "get_version_store",
+    "split_chunks",
+]